@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out as separate writes; without this the client's
+    # delayed ACK adds ~40 ms to every non-streaming reply
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/api/version":
+            self.send_error(404)
+            return
+        self._send_json(200, {"version": "0.0.0-fake"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self.send_error(404)
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server: FakeOllamaServer = self.server.owner
+
+        with server.lock:
+            server.requests += 1
+            status = server.fail_statuses.pop(0) if server.fail_statuses else 200
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.latency)
+            if status != 200:
+                self._send_json(status, {"error": f"fake status {status}"})
+                return
+            self._generate(body, server)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _generate(self, body: dict, server: "FakeOllamaServer"):
+        pieces = server.pieces
+        # Like Ollama, the returned context is the one sent plus this prompt
+        # and reply (one fake token per word), and only the new prompt is
+        # evaluated.
+        prompt_tokens = len(body.get("prompt", "").split())
+        context = body.get("context", []) + [1] * (prompt_tokens + len(pieces))
+        stats = {
+            "done": True,
+            "total_duration": 3_500_000,
+            "load_duration": 500_000,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": 1_000 * prompt_tokens,
+            "eval_count": len(pieces),
+            "eval_duration": 2_000_000,
+            "context": context,
+        }
+
+        if not body.get("stream", True):
+            self._send_json(200, {"response": "".join(pieces), **stats})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = [{"response": piece, "done": False} for piece in pieces] + [{"response": "", **stats}]
+        for i, chunk in enumerate(chunks):
+            time.sleep(server.token_delay)
+            line = (json.dumps(chunk) + "\n").encode("utf-8")
+            if i == server.cut_stream_after:
+                self._cut(line, server.cut_mode)
+                return
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _cut(self, line: bytes, mode: str):
+        half = line[: len(line) // 2]
+        if mode == "drop":
+            # the chunk announces the whole line, then the connection closes
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + half)
+            self.close_connection = True
+        else:
+            # a well-formed body whose last line is cut-off JSON
+            half += b"\n"
+            self.wfile.write(f"{len(half):x}\r\n".encode("ascii") + half + b"\r\n0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeOllamaServer:
+    # Minimal stand-in for Ollama's /api/generate (plain and NDJSON streaming)
+    # and /api/version, with injectable error statuses.
+    def __init__(
+        self,
+        pieces: list[str] | None = None,
+        latency: float = 0.0,
+        token_delay: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.pieces = pieces or [" The", " door", " creaked", " open", "."]
+        self.latency = latency
+        self.token_delay = token_delay
+        self.requests = 0
+        # statuses to answer the next requests with before generating again
+        self.fail_statuses: list[int] = []
+        # index of the stream line to cut in half: "drop" closes the
+        # connection mid-chunk, "garble" ends the stream after the half line
+        self.cut_stream_after: int | None = None
+        self.cut_mode = "drop"
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.owner = self
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllamaServer":
+        # a short poll interval so stop() returns quickly
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
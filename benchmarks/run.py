@@ -0,0 +1,402 @@
+import argparse
+import json
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from components.clean import build_corpus, tokenize
+from components.ngram_model import SmartNGramModel, derive_order_counts, iter_corpus, load_model, save_model
+from components.ollama_client import OllamaClient, OllamaStream, set_default_client
+from components.perf import format_bytes, peak_rss_bytes
+from components.story_ollama import StorySession, build_prompt, call_ollama
+from components.token_cache import build_token_cache, count_ngrams_cached, read_token_cache
+
+from .fake_ollama import FakeOllamaServer
+from .synthetic import write_raw_dump
+
+
+# Same orders and pruning settings as components.train_ngrams.main
+CONFIGS = [(2, 2, 12), (3, 2, 10), (4, 3, 8), (5, 3, 6)]
+PREFIXES = [
+    "The door creaked open and",
+    "She looked at the sky.",
+    "Nobody knew why the",
+    "kalo mira tesu",
+]
+DEFAULT_THRESHOLD = 0.15
+MIN_DELTA_SECONDS = 0.001
+
+_LEGACY_PUNCT_RE = re.compile(r"([.!?])")
+_LEGACY_SPACE_RE = re.compile(r"\s+")
+
+
+def legacy_tokenize(text: str) -> list[str]:
+    # The two-pass tokenizer clean.tokenize replaced; kept as the reference
+    # for the tokenizer speedup.
+    text = text.lower()
+    text = _LEGACY_PUNCT_RE.sub(r" \1 ", text)
+    text = _LEGACY_SPACE_RE.sub(" ", text).strip()
+    return text.split()
+
+
+def _timed(fn: Callable, repeat: int = 1):
+    # Best of `repeat` runs; the result of the last run is returned.
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def _quiet(msg: str):
+    pass
+
+
+def bench_clean(workdir: Path, stories: int, seed: int, workers: int) -> tuple[Path, dict]:
+    raw_path = write_raw_dump(workdir / "raw.txt", stories, seed=seed)
+    corpus_path = workdir / "stories.txt"
+    results = {}
+    for label, num_workers in (("serial", 1), ("parallel", workers)):
+        if label == "parallel" and num_workers <= 1:
+            continue
+        _, seconds = _timed(lambda: build_corpus(raw_path, corpus_path, workers=num_workers, log=_quiet))
+        size_mb = raw_path.stat().st_size / (1024 * 1024)
+        results[f"build_corpus_{label}"] = {
+            "seconds": seconds,
+            "mb_per_sec": size_mb / seconds,
+            "workers": num_workers,
+        }
+    return corpus_path, results
+
+
+def bench_tokenize(workdir: Path, corpus_path: Path, repeat: int) -> dict:
+    stories = list(iter_corpus(corpus_path))
+    results = {}
+    for name, fn in (("tokenize_legacy", legacy_tokenize), ("tokenize", tokenize)):
+        tokens, seconds = _timed(lambda: sum(len(fn(story)) for story in stories), repeat)
+        results[name] = {"seconds": seconds, "tokens_per_sec": tokens / seconds}
+    results["tokenize"]["speedup"] = results["tokenize_legacy"]["seconds"] / results["tokenize"]["seconds"]
+
+    cache_file = workdir / "stories.tokens.bin"
+    _, seconds = _timed(lambda: build_token_cache(corpus_path, cache_file, log=_quiet))
+    results["token_cache_build"] = {"seconds": seconds, "bytes": cache_file.stat().st_size}
+
+    cache = read_token_cache(cache_file)
+    _, seconds = _timed(lambda: count_ngrams_cached(cache, 4), repeat)
+    results["count_cached_n4"] = {"seconds": seconds, "tokens_per_sec": cache.num_tokens / seconds}
+
+    # Counts for every order in CONFIGS: one pass per order, or one padded
+    # pass at the top order with the rest derived (train_ngrams default).
+    orders = [n for n, _, _ in CONFIGS]
+    top = max(orders)
+
+    def separate():
+        for n in orders:
+            count_ngrams_cached(cache, n)
+
+    def derived():
+        for _ in derive_order_counts(count_ngrams_cached(cache, top, pad=True)[0], top):
+            pass
+
+    for name, fn in (("count_orders_separate", separate), ("count_orders_derived", derived)):
+        _, seconds = _timed(fn, repeat)
+        results[name] = {"seconds": seconds, "tokens_per_sec": cache.num_tokens / seconds}
+    results["count_orders_derived"]["speedup"] = (
+        results["count_orders_separate"]["seconds"] / results["count_orders_derived"]["seconds"]
+    )
+    return results
+
+
+def bench_models(workdir: Path, corpus_path: Path, repeat: int, drafts: int) -> dict:
+    results = {}
+    for n, min_count, top_k in CONFIGS:
+        model = SmartNGramModel(n=n, min_count=min_count, top_k=top_k)
+        _, fit_seconds = _timed(lambda: model.fit(iter_corpus(corpus_path)))
+        results[f"fit_n{n}"] = {
+            "seconds": fit_seconds,
+            "tokens_per_sec": model.total_tokens / fit_seconds,
+            "contexts": len(model.context_counts),
+        }
+
+        path = workdir / f"ngram_{n}.bin"
+        _, save_seconds = _timed(lambda: save_model(model, path), repeat)
+        loaded, load_seconds = _timed(lambda: load_model(path), repeat)
+        results[f"save_n{n}"] = {"seconds": save_seconds, "bytes": path.stat().st_size}
+        results[f"load_n{n}"] = {"seconds": load_seconds}
+
+        def draft():
+            produced = 0
+            for i in range(drafts):
+                prefix = PREFIXES[i % len(PREFIXES)]
+                produced += len(tokenize(loaded.generate_multi(prefix, num_sentences=3, max_tokens=40, seed=i)))
+            return produced
+
+        produced, draft_seconds = _timed(draft, repeat)
+        results[f"generate_multi_n{n}"] = {
+            "seconds": draft_seconds,
+            "tokens_per_sec": produced / draft_seconds if draft_seconds > 0 else 0.0,
+            "tokens": produced,
+        }
+    return results
+
+
+# Fresh interpreter: import the draft path, load one model, draft once (what
+# the GUI does between launch and its first draft, minus the window).
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from pathlib import Path
+from components.compare import ComparisonEngine
+imported = time.perf_counter()
+engine = ComparisonEngine({"4": Path(sys.argv[1])})
+model = engine.model("4")
+loaded = time.perf_counter()
+model.generate_multi(sys.argv[2], num_sentences=3, max_tokens=40, seed=0)
+drafted = time.perf_counter()
+engine.close()
+print(json.dumps({"import": imported - start, "load": loaded - imported, "draft": drafted - loaded}))
+"""
+
+
+def bench_cold_start(workdir: Path, repeat: int) -> dict:
+    root = Path(__file__).resolve().parent.parent
+    model_path = workdir / "ngram_4.bin"
+
+    def launch() -> dict:
+        out = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, str(model_path), PREFIXES[0]],
+            cwd=root,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        return json.loads(out)
+
+    phases, seconds = _timed(launch, repeat)
+    return {
+        "cold_start_first_draft": {
+            "seconds": seconds,
+            "ms_import": 1000 * phases["import"],
+            "ms_load": 1000 * phases["load"],
+            "ms_draft": 1000 * phases["draft"],
+        }
+    }
+
+
+def bench_ollama(calls: int, latency: float, repeat: int) -> dict:
+    results = {}
+    with FakeOllamaServer(latency=latency) as server:
+        # No response cache: every call has to make the HTTP round-trip.
+        client = OllamaClient(base_url=server.base_url, cache=None)
+        set_default_client(client)
+        try:
+            prompts = [build_prompt(PREFIXES[i % len(PREFIXES)], f"draft {i}") for i in range(calls)]
+            responses, seconds = _timed(lambda: [call_ollama(prompt) for prompt in prompts], repeat)
+            errors = sum(1 for r in responses if r.startswith("[ERROR]"))
+            results["call_ollama"] = {
+                "seconds": seconds,
+                "ms_per_call": 1000 * seconds / calls,
+                "errors": errors,
+            }
+
+            def stream_all():
+                ttft = 0.0
+                for prompt in prompts:
+                    stream = OllamaStream(prompt, client=client)
+                    for _ in stream:
+                        pass
+                    ttft += stream.time_to_first_token or 0.0
+                return ttft
+
+            ttft, seconds = _timed(stream_all, repeat)
+            results["ollama_stream"] = {
+                "seconds": seconds,
+                "ms_per_call": 1000 * seconds / calls,
+                "ms_to_first_token": 1000 * ttft / calls,
+            }
+        finally:
+            set_default_client(None)
+            client.close()
+    return results
+
+
+def bench_session(workdir: Path, turns: int) -> dict:
+    # Prompt tokens per turn of a session vs. re-sending the whole story in
+    # one prompt each turn; the fake server counts one token per word.
+    model = load_model(workdir / "ngram_4.bin")
+    pieces = [f" word{i}" for i in range(60)] + ["."]
+    with FakeOllamaServer(pieces=pieces) as server:
+        client = OllamaClient(base_url=server.base_url, cache=None)
+        try:
+            session = StorySession(client=client, context_budget=1024, window_words=200)
+
+            def play():
+                per_turn, naive = [], []
+                for turn in range(turns):
+                    draft, stream = session.prepare(PREFIXES[0] if turn == 0 else "", model)
+                    naive.append(len(build_prompt(session.story, draft).split()))
+                    for _ in stream:
+                        pass
+                    per_turn.append(session.complete(stream)["prompt_tokens"])
+                return per_turn, naive
+
+            (per_turn, naive), seconds = _timed(play)
+        finally:
+            client.close()
+    return {
+        "story_session": {
+            "seconds": seconds,
+            "ms_per_turn": 1000 * seconds / turns,
+            "prompt_tokens_max": max(per_turn),
+            "prompt_tokens_last": per_turn[-1],
+            "naive_prompt_tokens_last": naive[-1],
+            "compactions": sum(turn["compacted"] for turn in session.turns),
+        }
+    }
+
+
+def run(args) -> dict:
+    random.seed(args.seed)
+    results: dict[str, dict] = {}
+
+    with tempfile.TemporaryDirectory(prefix="ngram-bench-") as tmp:
+        workdir = args.workdir or Path(tmp)
+        workdir.mkdir(parents=True, exist_ok=True)
+
+        print(f"[INFO] Cleaning {args.stories} synthetic stories...")
+        corpus_path, clean_results = bench_clean(workdir, args.stories, args.seed, args.workers)
+        results.update(clean_results)
+        peak_after_clean = peak_rss_bytes()
+
+        print("[INFO] Tokenizer and token cache...")
+        results.update(bench_tokenize(workdir, corpus_path, args.repeat))
+
+        print("[INFO] Training, saving, loading and drafting n=2..5...")
+        results.update(bench_models(workdir, corpus_path, args.repeat, args.drafts))
+
+        print("[INFO] Cold start to first draft in a fresh process...")
+        results.update(bench_cold_start(workdir, args.repeat))
+
+        print(f"[INFO] {args.session_turns}-turn story session against a fake Ollama server...")
+        results.update(bench_session(workdir, args.session_turns))
+
+        print(f"[INFO] {args.ollama_calls} round-trips against a fake Ollama server...")
+        results.update(bench_ollama(args.ollama_calls, args.ollama_latency, args.repeat))
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "stories": args.stories,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "peak_rss": {
+            "after_clean": peak_after_clean,
+            "main": peak_rss_bytes(),
+            "workers": peak_rss_bytes(children=True),
+        },
+        "results": results,
+    }
+
+
+def _worse(metric: str, old: float, new: float, threshold: float) -> float | None:
+    # Relative slowdown if it exceeds the threshold; throughputs are
+    # higher-is-better, times lower-is-better.
+    if not old:
+        return None
+    if metric.endswith("_per_sec"):
+        change = (old - new) / old
+    elif metric == "seconds":
+        # sub-millisecond differences are timer noise
+        change = (new - old) / old if new - old > MIN_DELTA_SECONDS else 0.0
+    elif metric.startswith("ms_"):
+        change = (new - old) / old if new - old > 1000 * MIN_DELTA_SECONDS else 0.0
+    else:
+        return None
+    return change if change > threshold else None
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    for key in ("stories", "seed"):
+        if baseline.get("meta", {}).get(key) != current["meta"][key]:
+            print(f"[WARN] Baseline was run with a different --{key}; numbers are not comparable")
+
+    regressions = []
+    for name, metrics in current["results"].items():
+        old_metrics = baseline.get("results", {}).get(name)
+        if old_metrics is None:
+            continue
+        # Where a rate is reported it is what matters; the wall time also
+        # depends on how much output the run happened to produce.
+        has_rate = any(metric.endswith("_per_sec") for metric in metrics)
+        for metric, new in metrics.items():
+            if has_rate and metric == "seconds":
+                continue
+            old = old_metrics.get(metric)
+            if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+                continue
+            change = _worse(metric, old, new, threshold)
+            if change is not None:
+                regressions.append(f"{name}.{metric}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+
+    old_rss, new_rss = baseline.get("peak_rss", {}).get("main"), current["peak_rss"]["main"]
+    if old_rss and new_rss and (new_rss - old_rss) / old_rss > threshold:
+        regressions.append(f"peak_rss.main: {format_bytes(old_rss)} -> {format_bytes(new_rss)}")
+    return regressions
+
+
+def print_results(report: dict):
+    print(f"\n{'benchmark':<24} {'seconds':>10}  details")
+    for name, metrics in report["results"].items():
+        details = ", ".join(
+            f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}"
+            for k, v in metrics.items()
+            if k != "seconds"
+        )
+        print(f"{name:<24} {metrics['seconds']:>10.4f}  {details}")
+    rss = report["peak_rss"]
+    print(f"\npeak RSS: {format_bytes(rss['main'])} main / {format_bytes(rss['workers'])} workers")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cleaning, training, drafting and the Ollama client.")
+    parser.add_argument("--stories", type=int, default=5000, help="synthetic corpus size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per timing (best is kept)")
+    parser.add_argument("--workers", type=int, default=2, help="processes for the parallel clean")
+    parser.add_argument("--drafts", type=int, default=200, help="generate_multi calls per order")
+    parser.add_argument("--ollama-calls", type=int, default=50)
+    parser.add_argument("--ollama-latency", type=float, default=0.0, help="fake server delay per request (s)")
+    parser.add_argument("--session-turns", type=int, default=30, help="turns of the story-session benchmark")
+    parser.add_argument("--workdir", type=Path, help="keep generated files here instead of a temp dir")
+    parser.add_argument("--out", type=Path, default=Path("benchmarks/results.json"))
+    parser.add_argument("--compare", type=Path, metavar="BASELINE", help="flag regressions against this JSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_results(report)
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"[INFO] Results saved to {args.out}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"[WARN] {len(regressions)} regression(s) over {args.threshold:.0%} vs {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"[INFO] No regressions over {args.threshold:.0%} vs {args.compare}")
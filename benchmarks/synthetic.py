@@ -0,0 +1,63 @@
+import random
+from collections.abc import Iterator
+from pathlib import Path
+
+
+def make_vocab(vocab_size: int) -> list[str]:
+    syllables = ["ka", "lo", "mi", "ra", "te", "su", "no", "vi", "de", "pa", "ri", "go"]
+    words = []
+    for i in range(vocab_size):
+        word = ""
+        j = i
+        while True:
+            word += syllables[j % len(syllables)]
+            j //= len(syllables)
+            if j == 0:
+                break
+        words.append(word)
+    return words
+
+
+def generate_stories(
+    num_stories: int,
+    vocab_size: int = 5000,
+    min_words: int = 30,
+    max_words: int = 250,
+    seed: int = 0,
+) -> Iterator[str]:
+    # Zipf-like word frequencies and random sentence breaks, fully determined
+    # by the seed so benchmark runs are comparable.
+    rng = random.Random(seed)
+    vocab = make_vocab(vocab_size)
+    weights = [1 / (rank + 1) for rank in range(vocab_size)]
+
+    for _ in range(num_stories):
+        words = rng.choices(vocab, weights, k=rng.randint(min_words, max_words))
+        sentences: list[str] = []
+        current: list[str] = []
+        for word in words:
+            current.append(word)
+            if len(current) >= 4 and rng.random() < 0.12:
+                sentences.append(" ".join(current).capitalize() + rng.choice(".!?"))
+                current = []
+        if current:
+            sentences.append(" ".join(current).capitalize() + ".")
+        yield " ".join(sentences)
+
+
+def write_corpus(path: Path, num_stories: int, vocab_size: int = 5000, seed: int = 0) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        for story in generate_stories(num_stories, vocab_size=vocab_size, seed=seed):
+            f.write(story + "\n")
+    return path
+
+
+def write_raw_dump(path: Path, num_stories: int, vocab_size: int = 5000, seed: int = 0) -> Path:
+    # Same stories wrapped in the Reddit dump markup that clean.build_corpus strips.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        for story in generate_stories(num_stories, vocab_size=vocab_size, seed=seed):
+            middle = len(story) // 2
+            f.write(f"<sos> **{story[:middle]}** <nl> {story[middle:]} <eos> ^(footer)\n")
+    return path
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from .metrics import get_metrics
+from .ngram_model import SmartNGramModel, load_model
+
+
+MODEL_FILES = {
+    "2": Path("models/ngram_2.bin"),
+    "3": Path("models/ngram_3.bin"),
+    "4": Path("models/ngram_4.bin"),
+    "5": Path("models/ngram_5.bin"),
+}
+
+
+class ComparisonEngine:
+    # Loads every order concurrently in the background and drafts with all of
+    # them at once; compare() yields each order's result as soon as that
+    # model is loaded and has drafted, so a slow load only delays its own row.
+    def __init__(self, model_files: dict[str, Path] = MODEL_FILES, max_workers: int | None = None):
+        self.model_files = model_files
+        # Loads get their own threads: a draft waiting on a load can then
+        # never hold the thread that load needs.
+        self._load_pool = ThreadPoolExecutor(
+            max_workers=max(len(model_files), 1),
+            thread_name_prefix="ngram-load",
+        )
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers or max(len(model_files), 1),
+            thread_name_prefix="ngram-compare",
+        )
+        self._loads: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, n_str: str) -> SmartNGramModel:
+        path = self.model_files.get(n_str)
+        if path is None or not path.exists():
+            raise FileNotFoundError(f"Model for n={n_str} not found ({path}). Train n-grams first.")
+        with get_metrics().span("model_load"):
+            return load_model(path)
+
+    def preload(self, orders: list[str] | None = None) -> dict[str, Future]:
+        orders = list(self.model_files) if orders is None else orders
+        with self._lock:
+            for n_str in orders:
+                if n_str not in self._loads:
+                    self._loads[n_str] = self._load_pool.submit(self._load, n_str)
+            return {n_str: self._loads[n_str] for n_str in orders}
+
+    def model(self, n_str: str, timeout: float | None = None) -> SmartNGramModel:
+        return self.preload([n_str])[n_str].result(timeout)
+
+    def status(self) -> dict[str, str]:
+        # "loading", "ready", "missing"/"failed" or "idle" per order
+        with self._lock:
+            loads = dict(self._loads)
+        status = {}
+        for n_str in self.model_files:
+            future = loads.get(n_str)
+            if future is None:
+                status[n_str] = "idle"
+            elif not future.done():
+                status[n_str] = "loading"
+            elif future.exception() is None:
+                status[n_str] = "ready"
+            elif isinstance(future.exception(), FileNotFoundError):
+                status[n_str] = "missing"
+            else:
+                status[n_str] = "failed"
+        return status
+
+    def reset(self):
+        # Forget loaded models (e.g. after retraining); in-flight loads finish
+        # but their results are dropped.
+        with self._lock:
+            self._loads.clear()
+
+    def _draft(
+        self,
+        n_str: str,
+        load: Future,
+        text: str,
+        samples: int,
+        num_sentences: int,
+        max_tokens: int,
+        seed: int | None,
+        started: float,
+    ) -> dict:
+        result = {"n": n_str, "drafts": [], "backoff": "", "error": None}
+        try:
+            model = load.result()
+            hits = Counter()
+            with get_metrics().span("draft"):
+                result["drafts"] = model.generate_batch(
+                    [text] * samples, num_sentences, max_tokens, seed, backoff_hits=hits
+                )
+            result["backoff"] = model.backoff_summary(hits)
+        except Exception as e:
+            result["error"] = str(e)
+        result["seconds"] = time.perf_counter() - started
+        return result
+
+    def compare(
+        self,
+        text: str,
+        orders: list[str] | None = None,
+        samples: int = 1,
+        num_sentences: int = 3,
+        max_tokens: int = 80,
+        seed: int | None = None,
+    ) -> Iterator[dict]:
+        # Yields {"n", "drafts", "backoff", "error", "seconds"} per order in
+        # completion order; seconds counts from the call, load included.
+        orders = list(self.model_files) if orders is None else orders
+        started = time.perf_counter()
+        # Each draft waits on the load resolved here, even if reset() runs
+        # meanwhile.
+        loads = self.preload(orders)
+        futures = [
+            self._pool.submit(self._draft, n_str, loads[n_str], text, samples, num_sentences, max_tokens, seed, started)
+            for n_str in orders
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._load_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,38 @@
+import argparse
+from pathlib import Path
+
+from .ngram_model import load_pickle_model, save_model
+
+
+MODELS_DIR = Path("models")
+
+
+def convert(pkl_path: Path, out_path: Path | None = None) -> Path:
+    if out_path is None:
+        out_path = pkl_path.with_suffix(".bin")
+
+    model = load_pickle_model(pkl_path)
+    save_model(model, out_path, {"converted_from": pkl_path.name})
+    return out_path
+
+
+def main(paths: list[Path] | None = None):
+    if not paths:
+        paths = sorted(MODELS_DIR.glob("ngram_*.pkl"))
+    if not paths:
+        print(f"No pickled models found in {MODELS_DIR}.")
+        return
+
+    for pkl_path in paths:
+        if not pkl_path.exists():
+            print(f"[WARN] {pkl_path} not found, skipping.")
+            continue
+        out_path = convert(pkl_path)
+        print(f"[OK] {pkl_path} -> {out_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert pickled n-gram models to the binary format.")
+    parser.add_argument("paths", nargs="*", type=Path, help="pickled models (default: models/ngram_*.pkl)")
+    args = parser.parse_args()
+    main(args.paths)
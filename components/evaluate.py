@@ -0,0 +1,332 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import tempfile
+import time
+from collections import Counter
+from collections.abc import Iterator
+from multiprocessing import get_context
+from pathlib import Path
+
+from .clean import tokenize, OUT_PATH as CORPUS_PATH
+from .compare import MODEL_FILES
+from .model_meta import model_stats
+from .ngram_model import SmartNGramModel, derive_order_counts, load_model, save_model
+from .perf import format_bytes, memory_peak_bytes
+from .token_cache import TokenCache, count_ngrams_cached, load_token_cache, read_token_cache
+
+
+HOLDOUT_EVERY = 10
+SMOOTHING = 1.0
+CHUNK_STORIES = 500
+ROW_CACHE_SIZE = 200_000
+
+
+def split_indices(num_stories: int, every: int = HOLDOUT_EVERY, held_out: bool = False) -> list[int]:
+    # Every `every`-th story is held out; the rest is the training split.
+    return [i for i in range(num_stories) if (i % every == 0) == held_out]
+
+
+class Scorer:
+    # Per-token log2-probabilities of the distribution drafts are sampled
+    # from: the <unk>-filtered top-k successors of the full (n-1)-token
+    # context (the model's SampleTable) if it was seen, else the unigram
+    # counts. Held-out tokens are folded to <unk> like training folded them.
+    # Context distributions are interpolated with the unigram distribution,
+    # with the weight the full context count gives, so successors outside
+    # the top k keep some mass and top_k only changes the sampled part:
+    #   p(w | ctx) = (c(ctx) * c_k(ctx, w) / c_k(ctx) + beta * p_uni(w)) / (c(ctx) + beta)
+    #   p_uni(w)   = (c(w) + 1) / (N + V)
+    # The unigram fallback is scored in full: cut to its top k it would give
+    # almost every token only the smoothing mass.
+    def __init__(self, model: SmartNGramModel, smoothing: float = SMOOTHING):
+        self.model = model
+        self.smoothing = smoothing
+        self.store = model.context_counts
+        self.table = model.sample_table
+
+        self.unigrams: Counter = Counter()
+        for tok, c in model.unigram_counts.items():
+            self.unigrams[tok if c >= model.min_count else "<unk>"] += c
+        self._uni_total = sum(self.unigrams.values()) + len(self.unigrams)
+        self._rows: dict[int, tuple[dict[int, int], int, int]] = {}
+
+    def _p_unigram(self, token: str) -> float:
+        return (self.unigrams.get(token, 0) + 1) / self._uni_total
+
+    def _row(self, row: int) -> tuple[dict[int, int], int, int]:
+        # -> (top-k successor counts, their sum, the full context count)
+        cached = self._rows.get(row)
+        if cached is None:
+            if len(self._rows) >= ROW_CACHE_SIZE:
+                self._rows.clear()
+            table, store = self.table, self.store
+            start, end = table.offsets[row], table.offsets[row + 1]
+            cum = table.cum[start:end]
+            counts = dict(zip(table.ids[start:end], (c - prev for c, prev in zip(cum, [0, *cum[:-1]]))))
+            total = sum(store.succ_counts[store.offsets[row] : store.offsets[row + 1]])
+            cached = self._rows[row] = (counts, cum[-1], total)
+        return cached
+
+    def score(self, text: str) -> tuple[float, int, int, int]:
+        return self.score_tokens(tokenize(text))
+
+    def score_tokens(self, story_tokens: list[str]) -> tuple[float, int, int, int]:
+        # -> (sum of log2 p, tokens scored, <unk> tokens, unigram backoffs)
+        unigrams = self.unigrams
+        tokens = ["<bos>"] + [tok if tok in unigrams else "<unk>" for tok in story_tokens] + ["<eos>"]
+
+        store = self.store
+        token_ids = store.token_ids
+        beta = self.smoothing
+        state = store.advance_state(store.start_state(()), tokens[0])
+        log_prob = 0.0
+        unk = backoff = 0
+
+        for token in tokens[1:]:
+            p_uni = self._p_unigram(token)
+            row = store.find_state(state)
+            if row >= 0:
+                counts, top_total, total = self._row(row)
+                c = counts.get(token_ids.get(token, -1), 0)
+                p = (total * c / top_total + beta * p_uni) / (total + beta)
+            else:
+                p = p_uni
+                backoff += 1
+            log_prob += math.log2(p)
+            unk += token == "<unk>"
+            state = store.advance_state(state, token)
+
+        return log_prob, len(tokens) - 1, unk, backoff
+
+
+_worker_scorer: Scorer | None = None
+_worker_cache: TokenCache | None = None
+
+
+def _init_worker(model_path: Path, cache_file: Path, smoothing: float):
+    global _worker_scorer, _worker_cache
+    _worker_scorer = Scorer(load_model(model_path), smoothing)
+    _worker_cache = read_token_cache(cache_file)
+
+
+def _score_chunk(stories: list[int]) -> tuple[float, int, int, int, int | None]:
+    # -> score totals and the worker's peak RSS so far
+    totals = [0.0, 0, 0, 0]
+    for story in stories:
+        for i, value in enumerate(_worker_scorer.score_tokens(_worker_cache.story_tokens(story))):
+            totals[i] += value
+    return *totals, memory_peak_bytes()
+
+
+def _chunks(stories: list[int], size: int) -> Iterator[list[int]]:
+    for start in range(0, len(stories), size):
+        yield stories[start : start + size]
+
+
+def evaluate_file(
+    model_path: Path,
+    cache: TokenCache,
+    stories: list[int],
+    workers: int = 1,
+    smoothing: float = SMOOTHING,
+) -> dict:
+    # Workers map the saved model and the token cache themselves and only
+    # receive story indices. They are spawned fresh for every model (also
+    # with workers=1), so their peak RSS is this model's scoring memory
+    # rather than the lifetime peak of this process or pages inherited
+    # through fork.
+    start = time.perf_counter()
+    initargs = (model_path, cache.path, smoothing)
+    with get_context("spawn").Pool(processes=workers, initializer=_init_worker, initargs=initargs) as pool:
+        parts = list(pool.imap_unordered(_score_chunk, _chunks(stories, CHUNK_STORIES)))
+    seconds = time.perf_counter() - start
+
+    log_prob = sum(p[0] for p in parts)
+    tokens = sum(p[1] for p in parts)
+    unk = sum(p[2] for p in parts)
+    backoff = sum(p[3] for p in parts)
+    peaks = [p[4] for p in parts if p[4] is not None]
+    bits = -log_prob / tokens if tokens else 0.0
+    return {
+        "perplexity": 2 ** bits if tokens else float("inf"),
+        "bits_per_token": bits,
+        "tokens": tokens,
+        "unk_rate": unk / tokens if tokens else 0.0,
+        "backoff_rate": backoff / tokens if tokens else 0.0,
+        "eval_seconds": seconds,
+        "eval_tokens_per_sec": tokens / seconds if seconds > 0 else 0.0,
+        "file_bytes": model_path.stat().st_size,
+        # largest peak RSS of one scoring worker
+        "worker_peak_rss": max(peaks) if peaks else None,
+    }
+
+
+def evaluate_models(
+    model_files: dict[str, Path] = MODEL_FILES,
+    corpus_path: Path = CORPUS_PATH,
+    every: int = HOLDOUT_EVERY,
+    workers: int = 1,
+    smoothing: float = SMOOTHING,
+    log=print,
+) -> list[dict]:
+    cache = load_token_cache(corpus_path, log)
+    stories = split_indices(cache.num_stories, every, held_out=True)
+    log(f"[INFO] Scoring {len(stories)} held-out stories (every {every}th of {corpus_path})")
+    results = []
+    for n_str, path in model_files.items():
+        if not path.exists():
+            log(f"[WARN] Model for n={n_str} not found at {path}, skipping.")
+            continue
+        model = load_model(path)
+        result = {"n": model.n, "min_count": model.min_count, "top_k": model.top_k, "model": str(path)}
+        result.update(evaluate_file(path, cache, stories, workers, smoothing))
+        results.append(result)
+        log(f"[n={model.n}] perplexity {result['perplexity']:.1f} ({result['eval_seconds']:.1f}s)")
+    return results
+
+
+def sweep(
+    orders: list[int],
+    min_counts: list[int],
+    top_ks: list[int],
+    corpus_path: Path = CORPUS_PATH,
+    every: int = HOLDOUT_EVERY,
+    workers: int = 1,
+    smoothing: float = SMOOTHING,
+    log=print,
+) -> list[dict]:
+    # Trains every (n, min_count, top_k) on the training split and scores it
+    # on the held-out split. The highest order is counted once, lower orders
+    # are derived from it, and each order's counts are re-folded for every
+    # min_count/top_k.
+    cache = load_token_cache(corpus_path, log)
+    stories = split_indices(cache.num_stories, every, held_out=True)
+    train_stories = split_indices(cache.num_stories, every, held_out=False)
+    log(f"[INFO] {len(stories)} held-out stories, every {every}th of {corpus_path}")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="ngram-eval-") as tmp:
+        count_start = time.perf_counter()
+        top = max(orders)
+        padded_counts, unigram_counts, total_tokens = count_ngrams_cached(cache, top, train_stories, pad=True)
+        log(f"[n={top}] Counted training split in {time.perf_counter() - count_start:.1f}s")
+        derived = derive_order_counts(padded_counts, top)
+        del padded_counts
+
+        for n, raw_counts in derived:
+            if n not in orders:
+                continue
+            counts = (raw_counts, unigram_counts, total_tokens)
+            count_seconds = time.perf_counter() - count_start
+
+            for min_count, top_k in itertools.product(min_counts, top_ks):
+                start = time.perf_counter()
+                model = SmartNGramModel(n=n, min_count=min_count, top_k=top_k)
+                model._fold_counts(*counts)
+                fold_seconds = time.perf_counter() - start
+
+                path = Path(tmp) / f"ngram_{n}_{min_count}_{top_k}.bin"
+                save_model(model, path)
+                stats = model_stats(model)
+
+                result = {
+                    "n": n,
+                    "min_count": min_count,
+                    "top_k": top_k,
+                    "train_seconds": count_seconds + fold_seconds,
+                    "num_contexts": stats["num_contexts"],
+                    "model_bytes": stats["model_bytes"],
+                }
+                result.update(evaluate_file(path, cache, stories, workers, smoothing))
+                results.append(result)
+                log(
+                    f"[n={n} min_count={min_count} top_k={top_k}] perplexity {result['perplexity']:.1f}, "
+                    f"{format_bytes(result['file_bytes'])}, eval {result['eval_seconds']:.1f}s"
+                )
+                del model
+            del counts, raw_counts
+            # the next order is derived from this one, so it counts from here
+            count_start = time.perf_counter()
+    results.sort(key=lambda r: r["n"])
+    return results
+
+
+def select(results: list[dict], max_perplexity: float) -> dict | None:
+    # Smallest model file that meets the bar; ties go to the faster scorer.
+    passing = [r for r in results if r["perplexity"] <= max_perplexity]
+    if not passing:
+        return None
+    return min(passing, key=lambda r: (r["file_bytes"], -r["eval_tokens_per_sec"]))
+
+
+def print_results(results: list[dict]):
+    header = f"{'n':>2} {'min_count':>9} {'top_k':>5} {'perplexity':>10} {'bits/tok':>8} {'unk':>6} {'backoff':>7} {'file':>10} {'eval s':>7} {'worker RSS':>10}"
+    print("\n" + header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['n']:>2} {r['min_count']:>9} {r['top_k']:>5} {r['perplexity']:>10.1f} {r['bits_per_token']:>8.3f} "
+            f"{r['unk_rate']:>6.1%} {r['backoff_rate']:>7.1%} {format_bytes(r['file_bytes']):>10} "
+            f"{r['eval_seconds']:>7.1f} {format_bytes(r['worker_peak_rss']):>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Held-out perplexity of n-gram models, or a sweep over configs.")
+    parser.add_argument("--corpus", type=Path, default=CORPUS_PATH)
+    parser.add_argument("--holdout-every", type=int, default=HOLDOUT_EVERY, help="hold out every k-th story")
+    parser.add_argument("--workers", type=int, default=None, help="scoring processes (default: CPU count)")
+    parser.add_argument("--smoothing", type=float, default=SMOOTHING, help="weight of the unigram prior per context")
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="train each --n/--min-count/--top-k combination on the training split instead of scoring models/",
+    )
+    parser.add_argument("--n", type=int, nargs="+", default=[2, 3, 4, 5])
+    parser.add_argument("--min-count", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[8])
+    parser.add_argument("--max-perplexity", type=float, help="pick the smallest model at or below this perplexity")
+    parser.add_argument("--out", type=Path, help="write results as JSON")
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count() or 1
+    if args.sweep:
+        results = sweep(
+            args.n,
+            args.min_count,
+            args.top_k,
+            corpus_path=args.corpus,
+            every=args.holdout_every,
+            workers=workers,
+            smoothing=args.smoothing,
+        )
+    else:
+        print("[INFO] models/ were trained on the whole corpus, so the held-out split was seen in training.")
+        results = evaluate_models(
+            corpus_path=args.corpus,
+            every=args.holdout_every,
+            workers=workers,
+            smoothing=args.smoothing,
+        )
+
+    if not results:
+        print("Nothing evaluated.")
+    else:
+        print_results(results)
+
+        if args.max_perplexity is not None:
+            best = select(results, args.max_perplexity)
+            if best is None:
+                print(f"\nNo configuration reaches perplexity <= {args.max_perplexity}.")
+            else:
+                print(
+                    f"\nSelected n={best['n']} min_count={best['min_count']} top_k={best['top_k']}: "
+                    f"perplexity {best['perplexity']:.1f}, {format_bytes(best['file_bytes'])}"
+                )
+
+        if args.out:
+            args.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+            print(f"[INFO] Results saved to {args.out}")
@@ -0,0 +1,268 @@
+import heapq
+import tempfile
+import time
+from array import array
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+
+from .ngram_model import SmartNGramModel
+from .ngram_store import CompactContextCounts, narrow_uint_array
+from .perf import format_bytes
+from .token_cache import BOS_ID, EOS_ID, TokenCache
+
+
+# Rough peak cost of one n-gram in the in-memory counter (packed int key,
+# count, dict slot), including its record while a run is being written.
+ENTRY_BYTES = 128
+FIELD_BITS = 64
+READ_RECORDS = 1 << 16
+PROGRESS_EVERY = 100_000
+MERGE_PROGRESS_EVERY = 1_000_000
+
+
+# A record is key << 128 | first << 64 | count: the n-gram, the sequence
+# number of its first occurrence in the corpus and its count. Sorting
+# records sorts by key, so runs and their merge are plain sorted int streams.
+def _split_record(record: int) -> tuple[int, int, int]:
+    mask = (1 << FIELD_BITS) - 1
+    return record >> (2 * FIELD_BITS), (record >> FIELD_BITS) & mask, record & mask
+
+
+def _drain_records(counts: Counter, first_base: int) -> list[int]:
+    # Empties the counter newest-first, freeing entries as it goes; dict
+    # order is first-seen order, so the rank is the n-gram's first occurrence.
+    records = []
+    rank = first_base + len(counts)
+    while counts:
+        key, count = counts.popitem()
+        rank -= 1
+        records.append((((key << FIELD_BITS) | rank) << FIELD_BITS) | count)
+    records.sort()
+    return records
+
+
+def _write_run(path: Path, records: list[int], record_bytes: int):
+    with path.open("wb") as f:
+        for start in range(0, len(records), READ_RECORDS):
+            f.write(b"".join(r.to_bytes(record_bytes, "big") for r in records[start : start + READ_RECORDS]))
+
+
+def _read_run(path: Path, record_bytes: int) -> Iterator[int]:
+    with path.open("rb") as f:
+        while chunk := f.read(record_bytes * READ_RECORDS):
+            for start in range(0, len(chunk), record_bytes):
+                yield int.from_bytes(chunk[start : start + record_bytes], "big")
+
+
+def _combine(records: Iterable[int]) -> Iterator[tuple[int, int, int]]:
+    # (key, first, count) per distinct key, summed over runs; runs are in
+    # corpus order, so the smallest first is the earliest occurrence.
+    current, first, total = None, 0, 0
+    for record in records:
+        key, rec_first, count = _split_record(record)
+        if key == current:
+            first = min(first, rec_first)
+            total += count
+            continue
+        if current is not None:
+            yield current, first, total
+        current, first, total = key, rec_first, count
+    if current is not None:
+        yield current, first, total
+
+
+class ExternalNGramCounter:
+    # Counts order-n n-grams of token-cache stories as packed integer keys
+    # (ids back to back, like CompactContextCounts state keys) and spills the
+    # counter as a sorted run file whenever it would outgrow max_memory.
+    # merged() then streams all runs k-way merged in key order.
+    def __init__(
+        self,
+        n: int,
+        num_tokens: int,
+        max_memory: int,
+        spill_dir: Path,
+        log: Callable[[str], None] = print,
+    ):
+        self.n = n
+        self.bits = max(1, (num_tokens - 1).bit_length())
+        self.max_entries = max(max_memory // ENTRY_BYTES, 1)
+        self.record_bytes = (self.bits * n + 2 * FIELD_BITS + 7) // 8
+        self.spill_dir = spill_dir
+        self.log = log
+        self.counts: Counter = Counter()
+        self.runs: list[Path] = []
+        self.spilled = 0
+
+    def add_story(self, ids: Iterable[int]):
+        bits, mask = self.bits, (1 << (self.bits * self.n)) - 1
+        key = 0
+        keys = []
+        for tok_id in ids:
+            key = ((key << bits) | tok_id) & mask
+            keys.append(key)
+        self.counts.update(keys[self.n - 1 :])
+        if len(self.counts) >= self.max_entries:
+            self.spill()
+
+    def spill(self):
+        if not self.counts:
+            return
+        start = time.perf_counter()
+        num_ngrams = len(self.counts)
+        path = self.spill_dir / f"run_{self.n}_{len(self.runs):04d}.bin"
+        _write_run(path, _drain_records(self.counts, self.spilled), self.record_bytes)
+        self.runs.append(path)
+        self.spilled += num_ngrams
+        self.log(
+            f"[n={self.n}] Spilled run {len(self.runs)}: {num_ngrams} n-grams, "
+            f"{format_bytes(path.stat().st_size)} in {time.perf_counter() - start:.1f}s"
+        )
+        # a fresh counter, since popitem() leaves the old table allocated
+        self.counts = Counter()
+
+    def merged(self) -> Iterator[tuple[int, int, int]]:
+        # What is still in memory joins the merge as one more sorted run
+        # instead of being written out.
+        sources = [_read_run(path, self.record_bytes) for path in self.runs]
+        if self.counts:
+            sources.append(iter(_drain_records(self.counts, self.spilled)))
+        self.log(f"[n={self.n}] Merging {len(sources)} sorted runs")
+        return _combine(heapq.merge(*sources))
+
+
+def build_store(
+    merged: Iterable[tuple[int, int, int]],
+    tokens: list[str],
+    order: int,
+    log: Callable[[str], None] = print,
+) -> CompactContextCounts:
+    # Fills a CompactContextCounts row by row from (key, first, count) in key
+    # order. Key order is token-id order, which is exactly the store's row
+    # order; successors are sorted by count, ties in first-seen order.
+    store = CompactContextCounts(tokens, order, [], array("Q", [0]), array("Q"), array("Q"))
+    bits = store.bits
+    succ_mask = (1 << bits) - 1
+    slices = store.word_slices
+    key_columns = [array("Q") for _ in slices]
+    offsets, succ_ids, succ_counts = store.offsets, store.succ_ids, store.succ_counts
+
+    def flush(context: int, row: list[tuple[int, int, int]]):
+        row.sort(key=lambda item: (-item[2], item[1]))
+        for succ, _, count in row:
+            succ_ids.append(succ)
+            succ_counts.append(count)
+        offsets.append(len(succ_ids))
+        for column, (shift, mask) in zip(key_columns, slices):
+            column.append((context >> shift) & mask)
+
+    current, row = None, []
+    for merged_keys, (key, first, count) in enumerate(merged, 1):
+        context = key >> bits
+        if context != current:
+            if current is not None:
+                flush(current, row)
+            current, row = context, []
+        row.append((key & succ_mask, first, count))
+        if merged_keys % MERGE_PROGRESS_EVERY == 0:
+            log(f"[n={order + 1}] Merged {merged_keys} n-grams into {len(offsets) - 1} contexts...")
+    if current is not None:
+        flush(current, row)
+
+    store.key_columns = key_columns if len(offsets) > 1 else []
+    store.succ_ids = narrow_uint_array(succ_ids)
+    store.succ_counts = narrow_uint_array(succ_counts)
+    return store
+
+
+def count_unigrams(cache: TokenCache) -> tuple[Counter, int]:
+    # Pass one: <bos>/<eos> once per story plus every cached id. Cache ids
+    # are assigned in first-seen order, so listing them in id order with
+    # <eos> after the first story's types gives count_ngrams' insertion order
+    # (which breaks ties in the unigram fallback).
+    id_counts = Counter(cache.ids)
+    if cache.num_stories:
+        id_counts[BOS_ID] += cache.num_stories
+        id_counts[EOS_ID] += cache.num_stories
+    first_types = len(set(cache.story_ids(0))) if cache.num_stories else 0
+    order = [BOS_ID, *range(2, 2 + first_types), EOS_ID, *range(2 + first_types, len(cache.vocab))]
+    vocab = cache.vocab
+    unigram_counts = Counter({vocab[t]: id_counts[t] for t in order if t in id_counts})
+    return unigram_counts, cache.num_tokens + 2 * cache.num_stories
+
+
+def _count_store(
+    cache: TokenCache,
+    n: int,
+    id_map: list[int],
+    tokens: list[str],
+    max_memory: int,
+    spill_dir: Path | None,
+    log: Callable[[str], None],
+    cancel_check: Callable[[], None] | None = None,
+) -> tuple[CompactContextCounts, int]:
+    ids, offsets = cache.ids, cache.offsets
+    bos, eos = id_map[BOS_ID], id_map[EOS_ID]
+    with tempfile.TemporaryDirectory(prefix="ngram-runs-", dir=spill_dir) as tmp:
+        counter = ExternalNGramCounter(n, len(tokens), max_memory, Path(tmp), log)
+        for i in range(cache.num_stories):
+            if cancel_check is not None:
+                cancel_check()
+            counter.add_story([bos, *[id_map[t] for t in ids[offsets[i] : offsets[i + 1]]], eos])
+            if (i + 1) % PROGRESS_EVERY == 0:
+                log(f"[n={n}] Counted {i + 1}/{cache.num_stories} stories, {len(counter.runs)} runs spilled")
+        store = build_store(counter.merged(), tokens, n - 1, log)
+    return store, len(counter.runs)
+
+
+def fit_external(
+    cache: TokenCache,
+    n: int,
+    min_count: int,
+    top_k: int,
+    max_memory: int,
+    keep_raw: bool = False,
+    spill_dir: Path | None = None,
+    log: Callable[[str], None] = print,
+    cancel_check: Callable[[], None] | None = None,
+) -> tuple[SmartNGramModel, int]:
+    # Out-of-core equivalent of SmartNGramModel.fit on the cached corpus.
+    # Unigrams are counted first, so rare tokens are already folded into
+    # <unk> as the n-grams are counted; each counting pass keeps at most
+    # max_memory of n-grams in memory. Returns the model and the number of
+    # runs spilled.
+    model = SmartNGramModel(n=n, min_count=min_count, top_k=top_k)
+    model.unigram_counts, model.total_tokens = count_unigrams(cache)
+    log(f"[n={n}] Counted {model.total_tokens} tokens, {len(model.unigram_counts)} types")
+
+    # Folded ids: frequent tokens keep their relative order, rare ones share <unk>.
+    vocab = cache.vocab
+    unigram_counts = model.unigram_counts
+    folded_tokens = [tok for tok in vocab if unigram_counts[tok] >= min_count]
+    folded_ids = {tok: i for i, tok in enumerate(folded_tokens)}
+    any_rare = len(folded_tokens) < len(vocab)
+    if any_rare:
+        folded_ids["<unk>"] = len(folded_tokens)
+        folded_tokens.append("<unk>")
+    id_map = [folded_ids.get(tok, len(folded_tokens) - 1) for tok in vocab]
+
+    start = time.perf_counter()
+    model.context_counts, runs = _count_store(cache, n, id_map, folded_tokens, max_memory, spill_dir, log, cancel_check)
+    log(f"[n={n}] {len(model.context_counts)} contexts from {runs} runs in {time.perf_counter() - start:.1f}s")
+
+    if keep_raw and not any_rare:
+        # nothing was folded, so the raw counts are the same store
+        model.raw_counts = model.context_counts
+    elif keep_raw:
+        start = time.perf_counter()
+        raw_counts, raw_runs = _count_store(
+            cache, n, list(range(len(vocab))), vocab, max_memory, spill_dir, log, cancel_check
+        )
+        model.raw_counts = raw_counts
+        runs += raw_runs
+        log(f"[n={n}] {len(raw_counts)} raw contexts from {raw_runs} runs in {time.perf_counter() - start:.1f}s")
+
+    model.vocab = set(unigram_counts) | {"<unk>"}
+    model.finalize()
+    return model, runs
@@ -0,0 +1,136 @@
+import itertools
+import queue
+import threading
+import traceback
+from collections.abc import Callable, Hashable
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id: int, group: str, key: Hashable, fn: Callable, args: tuple, kwargs: dict):
+        self.id = job_id
+        self.group = group
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+        self.status = "queued"
+        self.result = None
+        self.error: str | None = None
+        self.cancel_event = threading.Event()
+
+        self.on_done: Callable | None = None
+        self.on_progress: Callable | None = None
+        self.on_error: Callable | None = None
+        self._events: queue.Queue | None = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def progress(self, message):
+        # Called from the worker thread; doubles as a cancellation point.
+        self.check_cancelled()
+        if self.on_progress is not None:
+            self._events.put((self.on_progress, message))
+
+
+class JobQueue:
+    def __init__(self, num_workers: int = 2):
+        self._pending: queue.Queue = queue.Queue()
+        self._events: queue.Queue = queue.Queue()
+        self._active: dict[Hashable, Job] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(
+        self,
+        group: str,
+        key: Hashable,
+        fn: Callable,
+        *args,
+        on_done: Callable | None = None,
+        on_progress: Callable | None = None,
+        on_error: Callable | None = None,
+        **kwargs,
+    ) -> tuple[Job, bool]:
+        # Returns (job, created); an identical request that is still queued
+        # or running is coalesced into the existing job.
+        with self._lock:
+            existing = self._active.get(key)
+            if existing is not None and not existing.cancelled:
+                return existing, False
+
+            job = Job(next(self._ids), group, key, fn, args, kwargs)
+            job.on_done = on_done
+            job.on_progress = on_progress
+            job.on_error = on_error
+            job._events = self._events
+            self._active[key] = job
+
+        self._pending.put(job)
+        return job, True
+
+    def cancel(self, group: str | None = None) -> int:
+        with self._lock:
+            jobs = [job for job in self._active.values() if group is None or job.group == group]
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    def active(self, group: str | None = None) -> list[Job]:
+        with self._lock:
+            return [job for job in self._active.values() if group is None or job.group == group]
+
+    def poll(self, limit: int = 200):
+        # Runs queued callbacks; call this from the UI thread (e.g. via after()).
+        for _ in range(limit):
+            try:
+                callback, value = self._events.get_nowait()
+            except queue.Empty:
+                return
+            callback(value)
+
+    def _finish(self, job: Job, status: str, callback: Callable | None, value):
+        job.status = status
+        with self._lock:
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+        if callback is not None:
+            self._events.put((callback, value))
+
+    def _worker(self):
+        while True:
+            job: Job = self._pending.get()
+            if job.cancelled:
+                self._finish(job, "cancelled", job.on_error, JobCancelled())
+                continue
+
+            job.status = "running"
+            try:
+                job.result = job.fn(job, *job.args, **job.kwargs)
+            except JobCancelled as e:
+                self._finish(job, "cancelled", job.on_error, e)
+            except Exception as e:
+                job.error = traceback.format_exc()
+                self._finish(job, "failed", job.on_error, e)
+            else:
+                self._finish(job, "done", job.on_done, job.result)
@@ -0,0 +1,169 @@
+import csv
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+
+METRICS_PATH = Path("data/metrics.json")
+WINDOW = 500
+# Histogram bucket upper bounds in seconds; the last bucket is open-ended.
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# Stages of one draft -> prompt -> LLM request, in pipeline order.
+STAGES = ["model_load", "draft", "prompt", "http", "llm_load", "llm_prompt_eval", "llm_eval", "llm_total"]
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _bucket_label(i: int) -> str:
+    return f"<={BUCKETS[i]}s" if i < len(BUCKETS) else f">{BUCKETS[-1]}s"
+
+
+class Metrics:
+    # Rolling windows of the last `window` samples per timing span and per
+    # counter, plus lifetime totals. Safe to record from worker threads.
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self.started = time.time()
+        self._spans: dict[str, deque[float]] = {}
+        self._counters: dict[str, deque[float]] = {}
+        self._totals: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, table: dict[str, deque[float]], name: str, value: float):
+        with self._lock:
+            samples = table.get(name)
+            if samples is None:
+                samples = table[name] = deque(maxlen=self.window)
+            samples.append(value)
+            self._totals[name] = self._totals.get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float):
+        self._add(self._spans, stage, seconds)
+
+    def count(self, name: str, value: float = 1):
+        self._add(self._counters, name, value)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def _describe(self, samples: list[float], name: str) -> dict:
+        return {
+            "count": len(samples),
+            "total": self._totals.get(name, 0),
+            "mean": sum(samples) / len(samples) if samples else 0.0,
+            "p50": percentile(samples, 0.50),
+            "p95": percentile(samples, 0.95),
+            "max": max(samples, default=0.0),
+        }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            spans = {name: list(samples) for name, samples in self._spans.items()}
+            counters = {name: list(samples) for name, samples in self._counters.items()}
+
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        span_stats = {}
+        for name in sorted(spans, key=lambda s: (order.get(s, len(STAGES)), s)):
+            samples = spans[name]
+            hist = [0] * (len(BUCKETS) + 1)
+            for value in samples:
+                hist[bisect_left(BUCKETS, value)] += 1
+            stats = self._describe(samples, name)
+            stats["histogram"] = {_bucket_label(i): c for i, c in enumerate(hist) if c}
+            span_stats[name] = stats
+
+        return {
+            "started": self.started,
+            "exported": time.time(),
+            "window": self.window,
+            "spans": span_stats,
+            "counters": {name: self._describe(counters[name], name) for name in sorted(counters)},
+        }
+
+    def export(self, path: Path = METRICS_PATH) -> Path:
+        # .csv gets one summary row per span/counter, anything else JSON.
+        snapshot = self.snapshot()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix.lower() == ".csv":
+            fields = ["kind", "name", "count", "total", "mean", "p50", "p95", "max"]
+            with path.open("w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+                writer.writeheader()
+                for kind in ("spans", "counters"):
+                    for name, stats in snapshot[kind].items():
+                        writer.writerow({"kind": kind[:-1], "name": name, **stats})
+        else:
+            path.write_text(json.dumps(snapshot, indent=2), encoding="utf-8")
+        return path
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        if not snapshot["spans"] and not snapshot["counters"]:
+            return "No requests measured yet."
+
+        lines = [f"{'stage':<16} {'n':>5} {'p50':>9} {'p95':>9} {'max':>9}"]
+        for name, stats in snapshot["spans"].items():
+            lines.append(
+                f"{name:<16} {stats['count']:>5} "
+                f"{stats['p50'] * 1000:>7.1f}ms {stats['p95'] * 1000:>7.1f}ms {stats['max'] * 1000:>7.1f}ms"
+            )
+        if snapshot["counters"]:
+            lines.append("")
+            lines.append(f"{'counter':<16} {'n':>5} {'p50':>9} {'p95':>9} {'total':>9}")
+            for name, stats in snapshot["counters"].items():
+                lines.append(
+                    f"{name:<16} {stats['count']:>5} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['total']:>9.0f}"
+                )
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+            self._totals.clear()
+            self.started = time.time()
+
+
+def record_ollama_timings(data: dict, wall_seconds: float, metrics: "Metrics | None" = None):
+    # Ollama reports its own durations in nanoseconds; whatever is left of the
+    # wall time is HTTP and client overhead.
+    metrics = metrics or get_metrics()
+    metrics.observe("llm_total", wall_seconds)
+    for field, stage in (
+        ("load_duration", "llm_load"),
+        ("prompt_eval_duration", "llm_prompt_eval"),
+        ("eval_duration", "llm_eval"),
+    ):
+        if field in data:
+            metrics.observe(stage, data[field] / 1e9)
+    if "total_duration" in data:
+        metrics.observe("http", max(wall_seconds - data["total_duration"] / 1e9, 0.0))
+    for field, name in (("prompt_eval_count", "prompt_tokens"), ("eval_count", "llm_tokens")):
+        if field in data:
+            metrics.count(name, data[field])
+
+
+_default_metrics: Metrics | None = None
+
+
+def get_metrics() -> Metrics:
+    global _default_metrics
+    if _default_metrics is None:
+        _default_metrics = Metrics()
+    return _default_metrics
@@ -0,0 +1,104 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+
+MAGIC = b"NGRAMBIN"
+FORMAT_VERSION = 1
+ALIGN = 8
+
+# File layout (little-endian):
+#   MAGIC | uint32 version | uint32 header length | JSON header | padding
+#   | section data, each section aligned to 8 bytes
+# The JSON header holds the model fields plus, per section, its offset,
+# length and array typecode ("B" for raw byte blobs such as token tables).
+_PREFIX = struct.Struct("<II")
+
+
+def _pad(size: int) -> int:
+    return -size % ALIGN
+
+
+def is_binary_model(path: Path) -> bool:
+    with path.open("rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _section_bytes(data: array | memoryview | bytes) -> tuple[str, bytes | array | memoryview]:
+    if isinstance(data, bytes):
+        return "B", data
+    # arrays, or memoryviews of an already mapped model being re-saved
+    typecode = data.typecode if isinstance(data, array) else data.format
+    if sys.byteorder != "little":
+        data = array(typecode, data)
+        data.byteswap()
+    return typecode, data
+
+
+def write_binary(path: Path, fields: dict, sections: dict[str, array | memoryview | bytes]):
+    layout: dict[str, dict] = {}
+    offset = 0
+    for name, data in sections.items():
+        typecode, data = _section_bytes(data)
+        length = len(data) if typecode == "B" else len(data) * data.itemsize
+        layout[name] = {"offset": offset, "length": length, "typecode": typecode}
+        offset += length + _pad(length)
+
+    header = json.dumps({"fields": fields, "sections": layout}, sort_keys=True).encode("utf-8")
+    prefix_len = len(MAGIC) + _PREFIX.size + len(header)
+    header += b" " * _pad(prefix_len)
+
+    # Write next to the target and swap it in, so processes that still have
+    # the old file mapped keep reading a consistent copy.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(MAGIC)
+        f.write(_PREFIX.pack(FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name, data in sections.items():
+            _, data = _section_bytes(data)
+            f.write(data)
+            f.write(b"\0" * _pad(layout[name]["length"]))
+    os.replace(tmp_path, path)
+
+
+def read_header(path: Path) -> tuple[dict, int]:
+    with path.open("rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a binary n-gram model: {path}")
+        version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Unsupported model format version {version} in {path}")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    return header, len(MAGIC) + _PREFIX.size + header_len
+
+
+def read_binary(path: Path) -> tuple[dict, dict[str, memoryview | array]]:
+    header, data_start = read_header(path)
+
+    with path.open("rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+
+    # Sections are returned as views into the shared read-only mapping; pages
+    # are only read from disk when a row is touched.
+    sections: dict[str, memoryview | array] = {}
+    for name, info in header["sections"].items():
+        start = data_start + info["offset"]
+        raw = view[start : start + info["length"]]
+        typecode = info["typecode"]
+        if typecode == "B":
+            sections[name] = raw
+        elif sys.byteorder != "little":
+            arr = array(typecode, raw.tobytes())
+            arr.byteswap()
+            sections[name] = arr
+        else:
+            sections[name] = raw.cast(typecode)
+
+    return header["fields"], sections
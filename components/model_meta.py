@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from pathlib import Path
+
+from .ngram_store import context_counts_nbytes, successor_counts
+
+
+META_VERSION = 1
+CHECKSUM_CHUNK = 1 << 20
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def metadata_path(model_path: Path) -> Path:
+    # models/ngram_4.bin -> models/ngram_4.meta.json
+    return model_path.with_suffix(".meta.json")
+
+
+def file_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(CHECKSUM_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _histogram_label(size: int) -> str:
+    # power-of-two buckets: 1, 2-3, 4-7, 8-15, ...
+    low = 1 << (size.bit_length() - 1)
+    high = 2 * low - 1
+    return str(low) if low == high else f"{low}-{high}"
+
+
+def model_stats(model) -> dict:
+    # One pass over the per-context successor counts; everything else is
+    # already a field on the model.
+    store = model.context_counts
+    num_contexts = len(store)
+
+    sizes: Counter[int] = Counter()
+    total_successors = 0
+    for size in successor_counts(store):
+        sizes[size] += 1
+        total_successors += size
+
+    store_bytes = context_counts_nbytes(store)
+    model_bytes = store_bytes
+    if model.sample_table is not None:
+        model_bytes += model.sample_table.nbytes
+    if model.raw_counts is not None:
+        model_bytes += context_counts_nbytes(model.raw_counts)
+
+    histogram: dict[str, int] = {}
+    quantiles: dict[str, int] = {}
+    seen = 0
+    pending = list(QUANTILES)
+    for size in sorted(sizes):
+        if size > 0:
+            label = _histogram_label(size)
+            histogram[label] = histogram.get(label, 0) + sizes[size]
+        seen += sizes[size]
+        while pending and seen >= pending[0] * num_contexts:
+            quantiles[f"p{round(pending.pop(0) * 100)}"] = size
+
+    return {
+        "n": model.n,
+        "vocab_size": len(model.vocab),
+        "total_tokens": model.total_tokens,
+        "num_contexts": num_contexts,
+        "avg_next_per_context": total_successors / num_contexts if num_contexts else 0.0,
+        "max_next_per_context": max(sizes, default=0),
+        "bytes_per_context": store_bytes / num_contexts if num_contexts else 0.0,
+        "total_successors": total_successors,
+        "model_bytes": model_bytes,
+        "successor_quantiles": quantiles,
+        "successor_histogram": histogram,
+    }
+
+
+def build_metadata(model, model_path: Path, config: dict | None = None) -> dict:
+    stat = model_path.stat()
+    return {
+        "version": META_VERSION,
+        "model_file": model_path.name,
+        "file_bytes": stat.st_size,
+        "file_mtime_ns": stat.st_mtime_ns,
+        "sha256": file_checksum(model_path),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {
+            **(config or {}),
+            "n": model.n,
+            "min_count": model.min_count,
+            "top_k": model.top_k,
+            "pruning": model.pruning,
+            "keeps_raw_counts": model.raw_counts is not None,
+        },
+        "stats": model_stats(model),
+    }
+
+
+def write_metadata(model, model_path: Path, config: dict | None = None) -> Path:
+    meta = build_metadata(model, model_path, config)
+    path = metadata_path(model_path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_metadata(model_path: Path) -> dict | None:
+    path = metadata_path(model_path)
+    if not path.exists():
+        return None
+    meta = json.loads(path.read_text(encoding="utf-8"))
+    if meta.get("version", 0) > META_VERSION:
+        return None
+    return meta
+
+
+def metadata_is_current(meta: dict, model_path: Path, verify_checksum: bool = False) -> bool:
+    # Size and mtime catch a model rewritten without its sidecar; the
+    # checksum is only read back on request since it hashes the whole file.
+    stat = model_path.stat()
+    if meta.get("file_bytes") != stat.st_size or meta.get("file_mtime_ns") != stat.st_mtime_ns:
+        return False
+    return not verify_checksum or meta.get("sha256") == file_checksum(model_path)
@@ -1,14 +1,26 @@
+import math
 import pickle
 import random
 import re
+import threading
+from array import array
+from bisect import bisect_left
 from collections import defaultdict, Counter
+from collections.abc import Iterable, Iterator, Mapping
 from pathlib import Path
 
 from .clean import tokenize, OUT_PATH as CORPUS_PATH
+from .model_format import is_binary_model, read_binary, write_binary
+from .model_meta import write_metadata
+from .ngram_store import CompactContextCounts, SampleTable
 
 
+# Models are shared by concurrent drafts (GUI workers, the service,
+# ComparisonEngine); their cumulative backoff_hits are updated under this.
+_BACKOFF_LOCK = threading.Lock()
+
 class SmartNGramModel:
-    def __init__(self, n: int = 4, min_count: int = 3, top_k: int = 8):
+    def __init__(self, n: int = 4, min_count: int = 3, top_k: int = 8, keep_raw: bool = False):
         if n < 2:
             raise ValueError("n must be >= 2 for n-gram model")
 
@@ -16,67 +28,224 @@ class SmartNGramModel:
         self.min_count = min_count
         self.top_k = top_k
 
-        self.context_counts: dict[tuple, Counter] = defaultdict(Counter)
+        self.context_counts: Mapping[tuple, Counter] = defaultdict(Counter)
         self.unigram_counts: Counter = Counter()
         self.vocab: set[str] = set()
         self.total_tokens: int = 0
 
-    def fit(self, texts: list[str]):
-        for text in texts:
-            tokens = ["<bos>"] + tokenize(text) + ["<eos>"]
-            self.unigram_counts.update(tokens)
-
-        for text in texts:
-            tokens = ["<bos>"] + tokenize(text) + ["<eos>"]
-            norm_tokens = [
-                tok if self.unigram_counts[tok] >= self.min_count else "<unk>"
-                for tok in tokens
-            ]
-            self.total_tokens += len(norm_tokens)
-
-            if len(norm_tokens) < self.n:
-                continue
-
-            for i in range(len(norm_tokens) - self.n + 1):
-                context = tuple(norm_tokens[i : i + self.n - 1])
-                next_tok = norm_tokens[i + self.n - 1]
-                self.context_counts[context][next_tok] += 1
+        # Unfolded n-gram counts (rare tokens not yet mapped to <unk>), kept
+        # only for models that support partial_fit/merge.
+        self.raw_counts: Mapping[tuple, Counter] | None = defaultdict(Counter) if keep_raw else None
+
+        self.sample_table: SampleTable | None = None
+        self._unigram_tokens: list[str] = []
+        self._unigram_cum: list[int] = []
+
+        # context order that served each sampled token (0 = unigram fallback)
+        self.backoff_hits: Counter = Counter()
+
+        # settings of the last prune() call, None for an unpruned model
+        self.pruning: dict | None = None
+
+    def fit(self, texts: Iterable[str]):
+        raw_counts, unigram_counts, total_tokens = count_ngrams(texts, self.n)
+        self._fold_counts(raw_counts, unigram_counts, total_tokens)
+
+    def partial_fit(self, texts: Iterable[str]):
+        if self.raw_counts is None:
+            raise ValueError("partial_fit needs raw counts; train the model with keep_raw=True")
+        self.fit(texts)
+
+    def merge(self, other: "SmartNGramModel") -> "SmartNGramModel":
+        if other.n != self.n:
+            raise ValueError(f"Cannot merge n={other.n} model into n={self.n} model")
+        if self.raw_counts is None or other.raw_counts is None:
+            raise ValueError("merge needs raw counts on both models; train them with keep_raw=True")
+        self._fold_counts(other.raw_counts, other.unigram_counts, other.total_tokens)
+        return self
+
+    def _fold_counts(self, raw_counts: Mapping[tuple, Counter], unigram_counts: Counter, total_tokens: int):
+        # n-grams are counted over raw tokens; rare ones are folded into <unk>
+        # afterwards, which gives the same counts as normalizing before counting.
+        self.unigram_counts.update(unigram_counts)
+        self.total_tokens += total_tokens
+
+        rare = {tok for tok, c in self.unigram_counts.items() if c < self.min_count}
+
+        if self.raw_counts is not None and len(self.raw_counts):
+            # Raw counts are accumulated and the min_count threshold is applied
+            # to the cumulative unigram counts, so the folded model matches a
+            # full retrain on all data seen so far. The new counts are merged
+            # into the sorted raw store and the folded store is rebuilt from
+            # it array to array, without going back to Counters.
+            if not isinstance(self.raw_counts, CompactContextCounts):
+                self.raw_counts = CompactContextCounts.from_counts(self.raw_counts, self.n - 1)
+            self.raw_counts = self.raw_counts.merge_counts(raw_counts)
+            self.context_counts = self.raw_counts.fold(rare)
+            self.sample_table = None
+            self.vocab = set(self.unigram_counts.keys()) | {"<unk>"}
+            self.finalize()
+            return
+
+        if self.raw_counts is not None:
+            self.raw_counts = raw_counts
+            self.context_counts = defaultdict(Counter)
+        elif isinstance(self.context_counts, CompactContextCounts):
+            self.context_counts = defaultdict(Counter, self.context_counts.to_dict())
+
+        for context, successors in raw_counts.items():
+            if rare and not rare.isdisjoint(context):
+                context = tuple("<unk>" if tok in rare else tok for tok in context)
+            target = self.context_counts[context]
+            if rare and not rare.isdisjoint(successors):
+                for tok, c in successors.items():
+                    target["<unk>" if tok in rare else tok] += c
+            else:
+                target.update(successors)
 
         self.vocab = set(self.unigram_counts.keys()) | {"<unk>"}
+        self.finalize()
 
-    def _next_dist(self, context: tuple) -> Counter:
-        context = tuple(context)
-        for k in range(len(context), 0, -1):
-            subctx = context[-k:]
-            if subctx in self.context_counts:
-                return self.context_counts[subctx]
+    def finalize(self):
+        if not isinstance(self.context_counts, CompactContextCounts):
+            self.context_counts = CompactContextCounts.from_counts(self.context_counts, self.n - 1)
+            self.sample_table = None
 
-        return self.unigram_counts
+        if not hasattr(self, "backoff_hits"):
+            self.backoff_hits = Counter()
+        if not hasattr(self, "raw_counts"):
+            self.raw_counts = None
+        if not hasattr(self, "pruning"):
+            self.pruning = None
 
-    def _sample_next(self, context: tuple) -> str:
-        dist = self._next_dist(context)
-        if not dist:
-            return random.choice(list(self.vocab))
+        if self.raw_counts is not None and not isinstance(self.raw_counts, CompactContextCounts):
+            self.raw_counts = CompactContextCounts.from_counts(self.raw_counts, self.n - 1)
 
-        items = [(tok, c) for tok, c in dist.items() if tok != "<unk>"]
-        if not items:
-            items = list(dist.items())
+        table = getattr(self, "sample_table", None)
+        if table is None or table.top_k != self.top_k:
+            self.sample_table = SampleTable.from_store(self.context_counts, self.top_k)
 
+        items = [(tok, c) for tok, c in self.unigram_counts.items() if tok != "<unk>"]
+        if not items:
+            items = list(self.unigram_counts.items())
         items.sort(key=lambda x: x[1], reverse=True)
-        if self.top_k is not None and self.top_k > 0 and len(items) > self.top_k:
+        if self.top_k is not None and self.top_k > 0:
             items = items[: self.top_k]
 
-        tokens, counts = zip(*items)
-        total = sum(counts)
-        r = random.random() * total
-        cm = 0.0
-        for tok, c in zip(tokens, counts):
-            cm += c
-            if r <= cm:
-                return tok
-        return tokens[-1]
-
-    def generate_multi(self, prefix: str, num_sentences: int = 3, max_tokens: int = 80) -> str:
+        self._unigram_tokens = [tok for tok, _ in items]
+        self._unigram_cum = []
+        total = 0
+        for _, c in items:
+            total += c
+            self._unigram_cum.append(total)
+
+    def prune(self, min_context_count: int = 1, min_kl_gain: float | None = None, sampling_only: bool = False):
+        # min_context_count: drop contexts seen fewer times than this.
+        # min_kl_gain: entropy-based pruning; drop a context when
+        #   count(context) * KL(p(.|context) || p_unigram) is below this many
+        #   bits, i.e. when backing off to unigrams loses little.
+        # sampling_only: keep per context only the <unk>-filtered top-k
+        #   successors _sample_next can draw, so generation is unchanged.
+        # Pruned models keep no raw counts, so they cannot be partial_fit.
+        self.finalize()
+        store: CompactContextCounts = self.context_counts
+
+        if min_context_count > 1 or min_kl_gain is not None:
+            unigram_total = sum(self.unigram_counts.values()) or 1
+            rare_mass = sum(c for c in self.unigram_counts.values() if c < self.min_count)
+            p_unigram = [
+                (rare_mass if tok == "<unk>" else self.unigram_counts.get(tok, 0)) / unigram_total
+                for tok in store.tokens
+            ]
+
+            keep: list[int] = []
+            for row in range(len(store)):
+                start, end = store.offsets[row], store.offsets[row + 1]
+                counts = store.succ_counts[start:end]
+                total = sum(counts)
+                if total < min_context_count:
+                    continue
+                if min_kl_gain is not None:
+                    kl = 0.0
+                    for tok_id, c in zip(store.succ_ids[start:end], counts):
+                        p = c / total
+                        kl += p * math.log2(p / max(p_unigram[tok_id], 1e-12))
+                    if total * kl < min_kl_gain:
+                        continue
+                keep.append(row)
+
+            if len(keep) < len(store):
+                store = store.select_rows(keep)
+
+        table = SampleTable.from_store(store, self.top_k)
+        if sampling_only:
+            store = CompactContextCounts.from_sample_table(store, table)
+
+        self.context_counts = store
+        self.sample_table = table
+        self.raw_counts = None
+        self.pruning = {
+            "min_context_count": min_context_count,
+            "min_kl_gain": min_kl_gain,
+            "sampling_only": sampling_only,
+        }
+
+    def _next_dist(self, context: tuple) -> Counter:
+        row = self._find_row(tuple(context))
+        if row >= 0:
+            return self.context_counts.row(row)
+
+        return self.unigram_counts
+
+    def _find_row(self, context: tuple) -> int:
+        # Only full (n-1)-token contexts are stored, so the longest match is
+        # either the last n-1 tokens or nothing (unigram fallback).
+        order = self.n - 1
+        if len(context) < order:
+            return -1
+        return self.context_counts.find(context[-order:] if len(context) > order else context)
+
+    def _record_backoff(self, hits: Counter, backoff_hits: Counter | None):
+        # hits are one call's; they go to the caller's counter and, once per
+        # call, to the model's running totals.
+        if backoff_hits is not None:
+            backoff_hits.update(hits)
+        with _BACKOFF_LOCK:
+            self.backoff_hits.update(hits)
+
+    def backoff_stats(self, hits: Counter | None = None) -> dict[str, float]:
+        # Shares of sampled tokens per context order, over `hits` or else
+        # everything this model has sampled.
+        hits = self.backoff_hits if hits is None else hits
+        total = sum(hits.values())
+        if total == 0:
+            return {}
+        return {
+            f"order_{order}" if order else "unigram": count / total
+            for order, count in sorted(hits.items(), reverse=True)
+        }
+
+    def backoff_summary(self, hits: Counter | None = None) -> str:
+        stats = self.backoff_stats(hits)
+        if not stats:
+            return "[backoff: no tokens sampled yet]"
+        return "[backoff: " + ", ".join(f"{name} {rate:.0%}" for name, rate in stats.items()) + "]"
+
+    def _sample_row(self, row: int, rng=random) -> str:
+        if row >= 0:
+            return self.context_counts.tokens[self.sample_table.sample(row, rng.random())]
+
+        if not self._unigram_cum:
+            return rng.choice(list(self.vocab))
+
+        cum = self._unigram_cum
+        r = rng.random() * cum[-1]
+        return self._unigram_tokens[bisect_left(cum, r, 0, len(cum) - 1)]
+
+    def _sample_next(self, context: tuple, rng=random) -> str:
+        return self._sample_row(self._find_row(tuple(context)), rng)
+
+    def _start_context(self, prefix: str) -> tuple:
         prefix_tokens = tokenize(prefix)
 
         if prefix_tokens and prefix_tokens[-1] in {".", "!", "?"}:
@@ -87,57 +256,257 @@ class SmartNGramModel:
         if len(context_tokens) < self.n - 1:
             context_tokens = ["<bos>"] * (self.n - 1 - len(context_tokens)) + context_tokens
 
-        context = tuple(context_tokens[-(self.n - 1):])
+        return tuple(context_tokens[-(self.n - 1):])
+
+    @staticmethod
+    def _detokenize(generated: list[str]) -> str:
+        clean_tokens = [t for t in generated if t != "<unk>"]
+        text = " ".join(clean_tokens)
+        text = re.sub(r"\s+([.!?,;:])", r"\1", text)
+        return text
+
+    def generate_multi(
+        self,
+        prefix: str,
+        num_sentences: int = 3,
+        max_tokens: int = 80,
+        seed: int | None = None,
+        backoff_hits: Counter | None = None,
+    ) -> str:
+        # backoff_hits, if given, receives this call's context orders
+        # (n-1 = full context, 0 = unigram fallback) per sampled token.
+        rng = random if seed is None else random.Random(seed)
+        store = self.context_counts
+        state = store.start_state(self._start_context(prefix))
         generated: list[str] = []
         sentence_count = 0
+        hits: Counter = Counter()
+        top = self.n - 1
 
         for _ in range(max_tokens):
-            next_tok = self._sample_next(context)
+            row = store.find_state(state)
+            hits[top if row >= 0 else 0] += 1
+            next_tok = self._sample_row(row, rng)
 
             if next_tok == "<eos>":
                 break
 
             generated.append(next_tok)
-            context = tuple(list(context[1:]) + [next_tok])
+            state = store.advance_state(state, next_tok)
 
             if next_tok in {".", "!", "?"}:
                 sentence_count += 1
                 if sentence_count >= num_sentences:
                     break
 
-        clean_tokens = [t for t in generated if t != "<unk>"]
-        text = " ".join(clean_tokens)
-        text = re.sub(r"\s+([.!?,;:])", r"\1", text)
-        return text
+        self._record_backoff(hits, backoff_hits)
+        return self._detokenize(generated)
+
+    def generate_batch(
+        self,
+        prefixes: list[str],
+        num_sentences: int = 3,
+        max_tokens: int = 80,
+        seed: int | None = None,
+        backoff_hits: Counter | None = None,
+    ) -> list[str]:
+        # Draft i is identical to generate_multi(prefixes[i], ..., seed=seed + i).
+        # All drafts advance one token per step; each distinct context state
+        # is looked up once per step and finished drafts drop out of the batch.
+        store = self.context_counts
+        rngs = [random.Random(None if seed is None else seed + i) for i in range(len(prefixes))]
+        states = [store.start_state(self._start_context(prefix)) for prefix in prefixes]
+        generated: list[list[str]] = [[] for _ in prefixes]
+        sentence_counts = [0] * len(prefixes)
+        active = list(range(len(prefixes)))
+        hits: Counter = Counter()
+        top = self.n - 1
+
+        for _ in range(max_tokens):
+            if not active:
+                break
+
+            rows = {state: -1 for state in (states[i] for i in active)}
+            for state in rows:
+                rows[state] = store.find_state(state)
+
+            still_active = []
+            for i in active:
+                row = rows[states[i]]
+                hits[top if row >= 0 else 0] += 1
+                next_tok = self._sample_row(row, rngs[i])
+                if next_tok == "<eos>":
+                    continue
+
+                generated[i].append(next_tok)
+                states[i] = store.advance_state(states[i], next_tok)
+
+                if next_tok in {".", "!", "?"}:
+                    sentence_counts[i] += 1
+                    if sentence_counts[i] >= num_sentences:
+                        continue
+                still_active.append(i)
+            active = still_active
+
+        self._record_backoff(hits, backoff_hits)
+        return [self._detokenize(tokens) for tokens in generated]
 
     def generate(self, prefix: str, max_tokens: int = 40) -> str:
         return self.generate_multi(prefix, num_sentences=1, max_tokens=max_tokens)
 
 
-def load_corpus(corpus_path: Path = CORPUS_PATH) -> list[str]:
+def count_ngrams(texts: Iterable[str], n: int) -> tuple[dict[tuple, Counter], Counter, int]:
+    raw_counts: dict[tuple, Counter] = defaultdict(Counter)
+    unigram_counts: Counter = Counter()
+    total_tokens = 0
+
+    for text in texts:
+        tokens = ["<bos>"] + tokenize(text) + ["<eos>"]
+        unigram_counts.update(tokens)
+        total_tokens += len(tokens)
+
+        for i in range(len(tokens) - n + 1):
+            raw_counts[tuple(tokens[i : i + n - 1])][tokens[i + n - 1]] += 1
+
+    return raw_counts, unigram_counts, total_tokens
+
+
+# Padding after <eos>: with n - 2 of them every lower-order n-gram of a story
+# starts an order-n window, so lower orders can be summed out of the top one.
+PAD = None
+
+
+def _strip_padding(counts: dict[tuple, Counter]) -> dict[tuple, Counter]:
+    # Only contexts that end in <eos> are followed by PAD, and those never
+    # have a real successor, so dropping them keeps the unpadded insertion order.
+    stripped: dict[tuple, Counter] = defaultdict(Counter)
+    for context, successors in counts.items():
+        if PAD not in context and PAD not in successors:
+            stripped[context] = successors
+    return stripped
+
+
+def derive_order_counts(padded_counts: dict[tuple, Counter], n: int) -> Iterator[tuple[int, dict[tuple, Counter]]]:
+    # Yields (k, raw counts) for k = n..2 from order-n counts over padded
+    # stories; each equals count_ngrams(texts, k), insertion order included.
+    # Every order is summed from the one above it, which is then released.
+    counts = padded_counts
+    for k in range(n, 1, -1):
+        if k < n:
+            lower: dict[tuple, Counter] = defaultdict(Counter)
+            for context, successors in counts.items():
+                lower[context[:-1]][context[-1]] += sum(successors.values())
+            counts = lower
+        yield k, _strip_padding(counts)
+
+
+def iter_corpus(corpus_path: Path = CORPUS_PATH) -> Iterator[str]:
     if not corpus_path.exists():
         raise FileNotFoundError(f"Corpus not found: {corpus_path.resolve()}")
 
-    stories: list[str] = []
     with corpus_path.open("r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
-            if not line:
-                continue
-            stories.append(line)
-
-    return stories
+            if line:
+                yield line
 
 
-def save_model(model: SmartNGramModel, path: Path):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("wb") as f:
-        pickle.dump(model, f)
+def load_corpus(corpus_path: Path = CORPUS_PATH) -> list[str]:
+    return list(iter_corpus(corpus_path))
+
+
+def _encode_tokens(tokens) -> bytes:
+    return "\n".join(tokens).encode("utf-8")
+
+
+def _decode_tokens(blob) -> list[str]:
+    return bytes(blob).decode("utf-8").split("\n") if len(blob) else []
+
+
+def _store_sections(store: CompactContextCounts, prefix: str = "") -> dict:
+    sections = {
+        f"{prefix}tokens": _encode_tokens(store.tokens),
+        f"{prefix}offsets": store.offsets,
+        f"{prefix}succ_ids": store.succ_ids,
+        f"{prefix}succ_counts": store.succ_counts,
+    }
+    for i, column in enumerate(store.key_columns):
+        sections[f"{prefix}keys_{i}"] = column
+    return sections
+
+
+def _load_store(sections: dict, order: int, key_words: int, prefix: str = "") -> CompactContextCounts:
+    return CompactContextCounts(
+        tokens=_decode_tokens(sections[f"{prefix}tokens"]),
+        order=order,
+        key_columns=[sections[f"{prefix}keys_{i}"] for i in range(key_words)],
+        offsets=sections[f"{prefix}offsets"],
+        succ_ids=sections[f"{prefix}succ_ids"],
+        succ_counts=sections[f"{prefix}succ_counts"],
+    )
+
+
+def save_model(model: SmartNGramModel, path: Path, config: dict | None = None):
+    model.finalize()
+    store: CompactContextCounts = model.context_counts
+    table: SampleTable = model.sample_table
+
+    fields = {
+        "n": model.n,
+        "min_count": model.min_count,
+        "top_k": model.top_k,
+        "vocab_size": len(model.vocab),
+        "total_tokens": model.total_tokens,
+        "num_contexts": len(store),
+        "key_words": len(store.key_columns),
+        "raw_key_words": None,
+        "pruning": model.pruning,
+    }
+    sections = {
+        "unigram_tokens": _encode_tokens(model.unigram_counts.keys()),
+        "unigram_counts": array("Q", model.unigram_counts.values()),
+        **_store_sections(store),
+        "sample_offsets": table.offsets,
+        "sample_ids": table.ids,
+        "sample_cum": table.cum,
+    }
+    if model.raw_counts is not None:
+        fields["raw_key_words"] = len(model.raw_counts.key_columns)
+        sections.update(_store_sections(model.raw_counts, prefix="raw_"))
+
+    write_binary(path, fields, sections)
+    # Stats sidecar (models/ngram_N.meta.json) so tools can report on a model
+    # without opening it; `config` records how it was produced.
+    write_metadata(model, path, config)
+
+
+def load_pickle_model(path: Path) -> SmartNGramModel:
+    with path.open("rb") as f:
+        model: SmartNGramModel = pickle.load(f)
+    model.finalize()
+    return model
 
 
 def load_model(path: Path) -> SmartNGramModel:
     if not path.exists():
         raise FileNotFoundError(f"Model file not found: {path.resolve()}")
-    with path.open("rb") as f:
-        model: SmartNGramModel = pickle.load(f)
+    if not is_binary_model(path):
+        return load_pickle_model(path)
+
+    fields, sections = read_binary(path)
+
+    model = SmartNGramModel(n=fields["n"], min_count=fields["min_count"], top_k=fields["top_k"])
+    model.total_tokens = fields["total_tokens"]
+    model.pruning = fields.get("pruning")
+    model.unigram_counts = Counter(
+        dict(zip(_decode_tokens(sections["unigram_tokens"]), sections["unigram_counts"]))
+    )
+    model.vocab = set(model.unigram_counts.keys()) | {"<unk>"}
+    model.context_counts = _load_store(sections, model.n - 1, fields["key_words"])
+    if fields.get("raw_key_words") is not None:
+        model.raw_counts = _load_store(sections, model.n - 1, fields["raw_key_words"], prefix="raw_")
+    model.sample_table = SampleTable(
+        model.top_k, sections["sample_offsets"], sections["sample_ids"], sections["sample_cum"]
+    )
+    model.finalize()
     return model
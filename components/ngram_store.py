@@ -0,0 +1,442 @@
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from collections.abc import Iterable, Iterator, Mapping
+
+
+def _detach(state: dict) -> dict:
+    # Memory-mapped sections cannot be pickled; copy them into arrays.
+    return {
+        key: array(value.format, value) if isinstance(value, memoryview) else value
+        for key, value in state.items()
+    }
+
+
+def _uint_array(values: list[int]) -> array:
+    arr = array("I", [])
+    try:
+        arr.extend(values)
+    except OverflowError:
+        return array("Q", values)
+    return arr
+
+
+def narrow_uint_array(values: array) -> array:
+    if values and max(values) >= 1 << 32:
+        return values
+    return array("I", values)
+
+
+def _sorted_successors(counts: Mapping[int, int]) -> tuple[list[int], list[int]]:
+    items = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    return [i for i, _ in items], [c for _, c in items]
+
+
+def _merge_rows(
+    base: Iterable[tuple[tuple[int, ...], list[int], list[int]]],
+    extra: list[tuple[tuple[int, ...], Mapping[int, int]]],
+) -> Iterator[tuple[tuple[int, ...], list[int], list[int]]]:
+    # Merges sorted rows (ids, succ_ids, succ_counts) with sorted extra rows
+    # (ids, {succ_id: count}). On a shared context the stored successors keep
+    # their order, extra ones follow, and the row is re-sorted by count.
+    extra_rows = iter(extra)
+    pending = next(extra_rows, None)
+    for ids, succ_ids, succ_counts in base:
+        while pending is not None and pending[0] < ids:
+            yield (pending[0], *_sorted_successors(pending[1]))
+            pending = next(extra_rows, None)
+        if pending is not None and pending[0] == ids:
+            combined = Counter(dict(zip(succ_ids, succ_counts)))
+            combined.update(pending[1])
+            yield (ids, *_sorted_successors(combined))
+            pending = next(extra_rows, None)
+        else:
+            yield ids, succ_ids, succ_counts
+    while pending is not None:
+        yield (pending[0], *_sorted_successors(pending[1]))
+        pending = next(extra_rows, None)
+
+
+# Read-only context -> successor counts backed by flat arrays (CSR layout).
+# Token ids of a context are packed into 64-bit key words stored column-wise
+# in sorted order; the successors of row i live in
+# succ_ids/succ_counts[offsets[i]:offsets[i + 1]], sorted by count
+# (descending, ties kept in first-seen order like the original Counter sort).
+class CompactContextCounts(Mapping):
+    def __init__(
+        self,
+        tokens: list[str],
+        order: int,
+        key_columns: list,
+        offsets,
+        succ_ids,
+        succ_counts,
+    ):
+        self.tokens = tokens
+        self.order = order
+        self.key_columns = key_columns
+        self.offsets = offsets
+        self.succ_ids = succ_ids
+        self.succ_counts = succ_counts
+
+        self.bits = max(1, (len(tokens) - 1).bit_length())
+        self.ids_per_word = max(1, 64 // self.bits)
+        self.token_ids = {tok: i for i, tok in enumerate(tokens)}
+        self._init_state_layout()
+
+    def _init_state_layout(self):
+        # A context state is (key, blocked): key holds the ids of the last
+        # `order` tokens back to back, blocked counts the steps until a token
+        # missing from the vocabulary has left the window.
+        self.state_mask = (1 << (self.bits * self.order)) - 1
+        self.word_slices: list[tuple[int, int]] = []
+        remaining = self.order
+        while remaining > 0:
+            count = min(self.ids_per_word, remaining)
+            remaining -= count
+            self.word_slices.append((self.bits * remaining, (1 << (self.bits * count)) - 1))
+
+    @classmethod
+    def from_counts(cls, context_counts: Mapping[tuple, Counter], order: int) -> "CompactContextCounts":
+        token_ids: dict[str, int] = {}
+        for context, successors in context_counts.items():
+            for tok in context:
+                token_ids.setdefault(tok, len(token_ids))
+            for tok in successors:
+                token_ids.setdefault(tok, len(token_ids))
+
+        store = cls(list(token_ids), order, [], array("Q"), array("I"), array("I"))
+
+        rows = sorted((store.pack([token_ids[tok] for tok in context]), context) for context in context_counts)
+
+        offsets = array("Q", [0])
+        succ_ids: list[int] = []
+        succ_counts: list[int] = []
+        for _, context in rows:
+            items = sorted(context_counts[context].items(), key=lambda x: x[1], reverse=True)
+            succ_ids.extend(token_ids[tok] for tok, _ in items)
+            succ_counts.extend(c for _, c in items)
+            offsets.append(len(succ_ids))
+
+        num_words = len(rows[0][0]) if rows else 0
+        store.key_columns = [array("Q", (key[w] for key, _ in rows)) for w in range(num_words)]
+        store.offsets = offsets
+        store.succ_ids = _uint_array(succ_ids)
+        store.succ_counts = _uint_array(succ_counts)
+        return store
+
+    @classmethod
+    def from_rows(
+        cls,
+        tokens: list[str],
+        order: int,
+        rows: Iterable[tuple[tuple[int, ...], list[int], list[int]]],
+    ) -> "CompactContextCounts":
+        # rows are (context ids, successor ids, successor counts) in context
+        # id order, which is key order at any bit width.
+        store = cls(tokens, order, [], array("Q"), array("I"), array("I"))
+        key_columns: list[array] = []
+        offsets = array("Q", [0])
+        succ_ids = array("Q")
+        succ_counts = array("Q")
+        for ids, row_ids, row_counts in rows:
+            key = store.pack(list(ids))
+            if not key_columns:
+                key_columns = [array("Q") for _ in key]
+            for column, word in zip(key_columns, key):
+                column.append(word)
+            succ_ids.extend(row_ids)
+            succ_counts.extend(row_counts)
+            offsets.append(len(succ_ids))
+
+        store.key_columns = key_columns
+        store.offsets = offsets
+        store.succ_ids = narrow_uint_array(succ_ids)
+        store.succ_counts = narrow_uint_array(succ_counts)
+        return store
+
+    def _rows(self) -> Iterator[tuple[tuple[int, ...], list[int], list[int]]]:
+        offsets, succ_ids, succ_counts = self.offsets, self.succ_ids, self.succ_counts
+        for row in range(len(self)):
+            start, end = offsets[row], offsets[row + 1]
+            yield self.unpack_ids(row), list(succ_ids[start:end]), list(succ_counts[start:end])
+
+    def merge_counts(self, counts: Mapping[tuple, Counter]) -> "CompactContextCounts":
+        # New store with counts added. Existing token ids are kept and new
+        # tokens appended, so the stored rows stay in order and only the
+        # added contexts are sorted and merged in.
+        token_ids = dict(self.token_ids)
+        for context, successors in counts.items():
+            for tok in context:
+                token_ids.setdefault(tok, len(token_ids))
+            for tok in successors:
+                token_ids.setdefault(tok, len(token_ids))
+
+        extra = sorted(
+            (
+                (tuple(token_ids[tok] for tok in context), {token_ids[tok]: c for tok, c in successors.items()})
+                for context, successors in counts.items()
+            ),
+            key=lambda item: item[0],
+        )
+        return CompactContextCounts.from_rows(list(token_ids), self.order, _merge_rows(self._rows(), extra))
+
+    def fold(self, rare: set[str], unk: str = "<unk>") -> "CompactContextCounts":
+        # Store with the rare tokens mapped to unk. The other tokens keep
+        # their relative order, so rows without a rare context token stay
+        # sorted; rows that collapse onto an unk context are summed and merged in.
+        rare_ids = {self.token_ids[tok] for tok in rare if tok in self.token_ids}
+        if not rare_ids:
+            return self
+
+        tokens = [tok for i, tok in enumerate(self.tokens) if i not in rare_ids]
+        folded_ids = {tok: i for i, tok in enumerate(tokens)}
+        if unk not in folded_ids:
+            folded_ids[unk] = len(tokens)
+            tokens.append(unk)
+        unk_id = folded_ids[unk]
+        id_map = [folded_ids.get(tok, unk_id) for tok in self.tokens]
+
+        def fold_successors(succ_ids: list[int], succ_counts: list[int], into: dict[int, int]):
+            for i, c in zip(succ_ids, succ_counts):
+                into[id_map[i]] = into.get(id_map[i], 0) + c
+
+        # First pass: sum the rows that collapse onto an unk context.
+        collapsed: dict[tuple[int, ...], dict[int, int]] = {}
+        for ids, succ_ids, succ_counts in self._rows():
+            if not rare_ids.isdisjoint(ids):
+                folded = tuple(id_map[i] for i in ids)
+                fold_successors(succ_ids, succ_counts, collapsed.setdefault(folded, {}))
+
+        def base_rows():
+            for ids, succ_ids, succ_counts in self._rows():
+                if not rare_ids.isdisjoint(ids):
+                    continue
+                folded = tuple(id_map[i] for i in ids)
+                if rare_ids.isdisjoint(succ_ids):
+                    yield folded, [id_map[i] for i in succ_ids], succ_counts
+                else:
+                    merged: dict[int, int] = {}
+                    fold_successors(succ_ids, succ_counts, merged)
+                    yield (folded, *_sorted_successors(merged))
+
+        return CompactContextCounts.from_rows(tokens, self.order, _merge_rows(base_rows(), sorted(collapsed.items())))
+
+    @classmethod
+    def from_sample_table(cls, store: "CompactContextCounts", table: "SampleTable") -> "CompactContextCounts":
+        # Keeps only what sampling reads: per row, the top-k successors and
+        # their counts recovered from the cumulative weights.
+        offsets, cum = table.offsets, table.cum
+        counts: list[int] = []
+        for row in range(len(offsets) - 1):
+            previous = 0
+            for i in range(offsets[row], offsets[row + 1]):
+                counts.append(cum[i] - previous)
+                previous = cum[i]
+
+        return cls(
+            store.tokens,
+            store.order,
+            [array("Q", column) for column in store.key_columns],
+            array("Q", offsets),
+            _uint_array(list(table.ids)),
+            _uint_array(counts),
+        )
+
+    def select_rows(self, rows: list[int]) -> "CompactContextCounts":
+        # rows must be ascending so the key columns stay sorted
+        offsets = array("Q", [0])
+        succ_ids: list[int] = []
+        succ_counts: list[int] = []
+        for row in rows:
+            start, end = self.offsets[row], self.offsets[row + 1]
+            succ_ids.extend(self.succ_ids[start:end])
+            succ_counts.extend(self.succ_counts[start:end])
+            offsets.append(len(succ_ids))
+
+        return CompactContextCounts(
+            self.tokens,
+            self.order,
+            [array("Q", (column[row] for row in rows)) for column in self.key_columns],
+            offsets,
+            _uint_array(succ_ids),
+            _uint_array(succ_counts),
+        )
+
+    def pack(self, ids: list[int]) -> tuple[int, ...]:
+        bits, per_word = self.bits, self.ids_per_word
+        words = []
+        for start in range(0, len(ids), per_word):
+            word = 0
+            for tok_id in ids[start : start + per_word]:
+                word = (word << bits) | tok_id
+            words.append(word)
+        return tuple(words)
+
+    def unpack_ids(self, row: int) -> tuple[int, ...]:
+        bits, per_word = self.bits, self.ids_per_word
+        mask = (1 << bits) - 1
+        ids: list[int] = []
+        remaining = self.order
+        for column in self.key_columns:
+            count = min(per_word, remaining)
+            word = column[row]
+            ids.extend((word >> (bits * (count - 1 - j))) & mask for j in range(count))
+            remaining -= count
+        return tuple(ids)
+
+    def unpack(self, row: int) -> tuple:
+        return tuple(self.tokens[i] for i in self.unpack_ids(row))
+
+    def find_key(self, key: tuple[int, ...]) -> int:
+        lo, hi = 0, len(self.offsets) - 1
+        for column, word in zip(self.key_columns, key):
+            lo = bisect_left(column, word, lo, hi)
+            hi = bisect_right(column, word, lo, hi)
+            if lo == hi:
+                return -1
+        return lo
+
+    def find(self, context: tuple) -> int:
+        if len(context) != self.order:
+            return -1
+        token_ids = self.token_ids
+        try:
+            ids = [token_ids[tok] for tok in context]
+        except KeyError:
+            return -1
+        return self.find_key(self.pack(ids))
+
+    def start_state(self, context: tuple) -> tuple[int, int]:
+        state = (0, self.order)
+        for tok in context[-self.order:]:
+            state = self.advance_state(state, tok)
+        return state
+
+    def advance_state(self, state: tuple[int, int], token: str) -> tuple[int, int]:
+        key, blocked = state
+        tok_id = self.token_ids.get(token)
+        if tok_id is None:
+            return (key << self.bits) & self.state_mask, self.order
+        return ((key << self.bits) | tok_id) & self.state_mask, max(blocked - 1, 0)
+
+    def find_state(self, state: tuple[int, int]) -> int:
+        key, blocked = state
+        if blocked or not self.key_columns:
+            return -1
+        if len(self.word_slices) == 1:
+            column = self.key_columns[0]
+            i = bisect_left(column, key)
+            return i if i < len(column) and column[i] == key else -1
+        return self.find_key(tuple((key >> shift) & mask for shift, mask in self.word_slices))
+
+    def row(self, row: int) -> Counter:
+        start, end = self.offsets[row], self.offsets[row + 1]
+        tokens = self.tokens
+        return Counter(
+            {tokens[i]: c for i, c in zip(self.succ_ids[start:end], self.succ_counts[start:end])}
+        )
+
+    def successor_counts(self) -> Iterator[int]:
+        offsets = self.offsets
+        return (offsets[i + 1] - offsets[i] for i in range(len(offsets) - 1))
+
+    def to_dict(self) -> dict[tuple, Counter]:
+        return {self.unpack(i): self.row(i) for i in range(len(self))}
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [*self.key_columns, self.offsets, self.succ_ids, self.succ_counts]
+        total = sum(arr.itemsize * len(arr) for arr in arrays)
+        total += sys.getsizeof(self.tokens) + sum(sys.getsizeof(tok) for tok in self.tokens)
+        return total
+
+    def __getitem__(self, context: tuple) -> Counter:
+        row = self.find(tuple(context))
+        if row < 0:
+            raise KeyError(context)
+        return self.row(row)
+
+    def __contains__(self, context) -> bool:
+        return self.find(tuple(context)) >= 0
+
+    def __iter__(self) -> Iterator[tuple]:
+        return (self.unpack(i) for i in range(len(self)))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getstate__(self):
+        state = _detach(self.__dict__)
+        del state["token_ids"]
+        state["key_columns"] = [
+            array(column.format, column) if isinstance(column, memoryview) else column
+            for column in self.key_columns
+        ]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.token_ids = {tok: i for i, tok in enumerate(self.tokens)}
+        self._init_state_layout()
+
+
+def context_counts_nbytes(context_counts: Mapping[tuple, Counter]) -> int:
+    if isinstance(context_counts, CompactContextCounts):
+        return context_counts.nbytes
+
+    # Token strings are shared with the vocabulary, so only the containers count.
+    total = sys.getsizeof(context_counts)
+    for context, successors in context_counts.items():
+        total += sys.getsizeof(context) + sys.getsizeof(successors)
+    return total
+
+
+def successor_counts(context_counts: Mapping[tuple, Counter]) -> Iterator[int]:
+    if isinstance(context_counts, CompactContextCounts):
+        return context_counts.successor_counts()
+    return (len(successors) for successors in context_counts.values())
+
+
+# Per-row sampling table: the <unk>-filtered top-k successors of every row of a
+# CompactContextCounts with their cumulative counts, so a draw is one bisect.
+class SampleTable:
+    def __init__(self, top_k: int | None, offsets, ids, cum):
+        self.top_k = top_k
+        self.offsets = offsets
+        self.ids = ids
+        self.cum = cum
+
+    @classmethod
+    def from_store(cls, store: CompactContextCounts, top_k: int | None, skip_token: str = "<unk>") -> "SampleTable":
+        skip_id = store.token_ids.get(skip_token, -1)
+        limit = top_k if top_k is not None and top_k > 0 else None
+        src_offsets, src_ids, src_counts = store.offsets, store.succ_ids, store.succ_counts
+
+        offsets = array("Q", [0])
+        ids: list[int] = []
+        cum: list[int] = []
+        for row in range(len(store)):
+            start, end = src_offsets[row], src_offsets[row + 1]
+            chosen = [i for i in range(start, end) if src_ids[i] != skip_id] or list(range(start, end))
+            total = 0
+            for i in chosen[:limit]:
+                total += src_counts[i]
+                ids.append(src_ids[i])
+                cum.append(total)
+            offsets.append(len(ids))
+
+        return cls(top_k, offsets, _uint_array(ids), array("Q", cum))
+
+    def __getstate__(self):
+        return _detach(self.__dict__)
+
+    def sample(self, row: int, r: float) -> int:
+        lo, hi = self.offsets[row], self.offsets[row + 1]
+        cum = self.cum
+        return self.ids[bisect_left(cum, r * cum[hi - 1], lo, hi - 1)]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(arr.itemsize * len(arr) for arr in (self.offsets, self.ids, self.cum))
@@ -0,0 +1,372 @@
+import asyncio
+import json
+import time
+import weakref
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .llm_cache import ResponseCache
+from .metrics import get_metrics, record_ollama_timings
+
+
+OLLAMA_MODEL = "gemma3:4b"
+OLLAMA_BASE_URL = "http://localhost:11434"
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class OllamaError(Exception):
+    pass
+
+
+class OllamaConnectionError(OllamaError):
+    pass
+
+
+class OllamaTimeoutError(OllamaError):
+    pass
+
+
+class OllamaHTTPError(OllamaError):
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"Ollama HTTP {status_code}: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class OllamaClient:
+    def __init__(
+        self,
+        base_url: str = OLLAMA_BASE_URL,
+        model: str = OLLAMA_MODEL,
+        timeout: float = 120,
+        retries: int = 2,
+        backoff: float = 0.5,
+        pool_size: int = 8,
+        cache: ResponseCache | None = None,
+        keep_alive: str | None = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.cache = cache
+        # How long Ollama keeps the model loaded after a request (e.g. "30m");
+        # None leaves the server default.
+        self.keep_alive = keep_alive
+
+        # One keep-alive pool per client instead of a new TCP connection per call.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def generate_url(self) -> str:
+        return f"{self.base_url}/api/generate"
+
+    def _payload(
+        self,
+        prompt: str,
+        model: str | None,
+        options: dict | None,
+        stream: bool,
+        context: list[int] | None = None,
+    ) -> dict:
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": stream,
+        }
+        if options:
+            payload["options"] = options
+        if context:
+            payload["context"] = context
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    def _post(self, payload: dict, stream: bool = False, timeout: float | None = None) -> requests.Response:
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.post(
+                    self.generate_url,
+                    json=payload,
+                    timeout=timeout or self.timeout,
+                    stream=stream,
+                )
+            except requests.exceptions.ConnectionError as e:
+                # includes connect timeouts: nothing reached the server yet
+                error: OllamaError = OllamaConnectionError(
+                    f"Cannot connect to Ollama at {self.base_url}. Is it running?"
+                )
+                error.__cause__ = e
+            except requests.exceptions.Timeout as e:
+                # A read timeout means the server is still busy with the
+                # request; sending it again would only wait that long again.
+                raise OllamaTimeoutError(f"Ollama did not answer within {timeout or self.timeout}s.") from e
+            else:
+                if resp.status_code == 200:
+                    return resp
+                error = OllamaHTTPError(resp.status_code, resp.text)
+                resp.close()
+                if resp.status_code not in RETRY_STATUSES:
+                    raise error
+
+            if attempt >= self.retries:
+                raise error
+            time.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    def generate_raw(
+        self,
+        prompt: str,
+        model: str | None = None,
+        options: dict | None = None,
+        timeout: float | None = None,
+    ) -> dict:
+        start = time.perf_counter()
+        resp = self._post(self._payload(prompt, model, options, stream=False), timeout=timeout)
+        data = resp.json()
+        if "error" in data:
+            raise OllamaError(f"Ollama: {data['error']}")
+        record_ollama_timings(data, time.perf_counter() - start)
+        return data
+
+    def generate(
+        self,
+        prompt: str,
+        model: str | None = None,
+        options: dict | None = None,
+        timeout: float | None = None,
+    ) -> str:
+        model = model or self.model
+        if self.cache is not None:
+            cached = self.cache.get(model, prompt, options)
+            if cached is not None:
+                get_metrics().count("llm_cache_hits")
+                return cached
+
+        response = self.generate_raw(prompt, model, options, timeout).get("response", "").strip()
+        if self.cache is not None:
+            self.cache.put(model, prompt, response, options)
+        return response
+
+    def ping(self, timeout: float = 2.0) -> str:
+        # Server version; a single try with a short timeout, unlike _post.
+        try:
+            resp = self.session.get(f"{self.base_url}/api/version", timeout=timeout)
+        except requests.exceptions.ConnectionError as e:
+            raise OllamaConnectionError(f"Cannot connect to Ollama at {self.base_url}. Is it running?") from e
+        except requests.exceptions.Timeout as e:
+            raise OllamaTimeoutError("Ollama ping timed out.") from e
+        if resp.status_code != 200:
+            raise OllamaHTTPError(resp.status_code, resp.text)
+        return resp.json().get("version", "")
+
+    def warm_up(self, model: str | None = None, keep_alive: str | None = None) -> float:
+        # A request without a prompt only loads the model; keep_alive keeps it
+        # resident so the first real prompt skips the load. Returns the load
+        # time Ollama reported, in seconds.
+        payload = {"model": model or self.model, "prompt": "", "stream": False}
+        keep_alive = keep_alive or self.keep_alive
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        data = self._post(payload).json()
+        if "error" in data:
+            raise OllamaError(f"Ollama: {data['error']}")
+        return data.get("load_duration", 0) / 1e9
+
+    def stream(self, prompt: str, model: str | None = None, options: dict | None = None) -> "OllamaStream":
+        return OllamaStream(prompt, model=model, options=options, client=self)
+
+    def generate_many(
+        self,
+        prompts: list[str],
+        model: str | None = None,
+        options: dict | None = None,
+        max_workers: int | None = None,
+        return_exceptions: bool = True,
+    ) -> list[str | OllamaError]:
+        def run(prompt: str):
+            try:
+                return self.generate(prompt, model, options)
+            except OllamaError as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.pool_size) as pool:
+            return list(pool.map(run, prompts))
+
+    def close(self):
+        self.session.close()
+
+
+class OllamaStream:
+    def __init__(
+        self,
+        prompt: str,
+        model: str | None = None,
+        options: dict | None = None,
+        client: OllamaClient | None = None,
+        context: list[int] | None = None,
+    ):
+        self.prompt = prompt
+        self.client = client or get_default_client()
+        self.model = model
+        self.options = options
+        # Token state returned by a previous request: Ollama continues from it
+        # (reusing its KV cache) instead of re-reading the earlier prompts.
+        self.context = context
+
+        self.time_to_first_token: float | None = None
+        self.total_time: float | None = None
+        self.final: dict = {}
+        self.response = ""
+        self.cached = False
+
+    def __iter__(self) -> Iterator[str]:
+        start = time.perf_counter()
+        first = True
+        model = self.model or self.client.model
+        # Replies depend on the context as well as the prompt, so continued
+        # requests bypass the response cache.
+        cache = self.client.cache if not self.context else None
+
+        if cache is not None:
+            cached = cache.get(model, self.prompt, self.options)
+            if cached is not None:
+                self.cached = True
+                self.response = cached
+                self.time_to_first_token = self.total_time = time.perf_counter() - start
+                get_metrics().count("llm_cache_hits")
+                yield cached
+                return
+
+        pieces: list[str] = []
+        try:
+            payload = self.client._payload(self.prompt, self.model, self.options, stream=True, context=self.context)
+            with self.client._post(payload, stream=True) as resp:
+                # Ollama streams one JSON object per line; the last one has done=true
+                for line in resp.iter_lines():
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except ValueError as e:
+                        raise OllamaError(f"Ollama sent an invalid stream line: {line[:80]!r}") from e
+                    if "error" in data:
+                        raise OllamaError(f"Ollama: {data['error']}")
+
+                    piece = data.get("response", "")
+                    if first:
+                        piece = piece.lstrip()
+                    if piece:
+                        if first:
+                            self.time_to_first_token = time.perf_counter() - start
+                            first = False
+                        pieces.append(piece)
+                        yield piece
+
+                    if data.get("done"):
+                        self.final = data
+                        self.response = "".join(pieces).strip()
+                        record_ollama_timings(data, time.perf_counter() - start)
+                        if cache is not None:
+                            cache.put(model, self.prompt, self.response, self.options)
+                        break
+        except requests.exceptions.Timeout as e:
+            raise OllamaTimeoutError("Ollama request timed out.") from e
+        except requests.exceptions.RequestException as e:
+            # ConnectionError, or ChunkedEncodingError when the server drops
+            # the connection in the middle of the stream
+            raise OllamaConnectionError(f"Ollama connection lost: {e}") from e
+        finally:
+            self.total_time = time.perf_counter() - start
+
+    @property
+    def new_context(self) -> list[int] | None:
+        # Context to pass to the next request of the conversation.
+        return self.final.get("context")
+
+    @property
+    def prompt_eval_seconds(self) -> float | None:
+        value = self.final.get("prompt_eval_duration")
+        return None if value is None else value / 1e9
+
+    @property
+    def eval_seconds(self) -> float | None:
+        value = self.final.get("eval_duration")
+        return None if value is None else value / 1e9
+
+    def timing_summary(self) -> str:
+        ttft = "n/a" if self.time_to_first_token is None else f"{self.time_to_first_token:.2f}s"
+        total = "n/a" if self.total_time is None else f"{self.total_time:.2f}s"
+        source = ", cached" if self.cached else ""
+        llm = ""
+        if self.eval_seconds is not None:
+            llm = f", prompt eval: {self.prompt_eval_seconds or 0:.2f}s, eval: {self.eval_seconds:.2f}s"
+            if self.eval_seconds > 0 and "eval_count" in self.final:
+                llm += f" ({self.final['eval_count'] / self.eval_seconds:.1f} tok/s)"
+        return f"[time to first token: {ttft}, total: {total}{llm}{source}]"
+
+
+class AsyncOllamaClient:
+    # asyncio front-end over the pooled blocking client: each request runs in a
+    # worker thread, and the semaphore caps how many are in flight at once.
+    def __init__(self, client: OllamaClient | None = None, concurrency: int = 4):
+        self.client = client or OllamaClient(pool_size=max(concurrency, 1))
+        self.concurrency = concurrency
+        # one semaphore per event loop: a semaphore is bound to the loop that
+        # first waits on it, and the client may be reused across asyncio.run calls
+        self._semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _limit(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return semaphore
+
+    async def generate_raw(self, prompt: str, model: str | None = None, options: dict | None = None) -> dict:
+        async with self._limit():
+            return await asyncio.to_thread(self.client.generate_raw, prompt, model, options)
+
+    async def generate(self, prompt: str, model: str | None = None, options: dict | None = None) -> str:
+        async with self._limit():
+            return await asyncio.to_thread(self.client.generate, prompt, model, options)
+
+    async def generate_many(
+        self,
+        prompts: list[str],
+        model: str | None = None,
+        options: dict | None = None,
+        return_exceptions: bool = True,
+    ) -> list[str | BaseException]:
+        tasks = [self.generate(prompt, model, options) for prompt in prompts]
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+
+
+_default_client: OllamaClient | None = None
+
+
+def get_default_client() -> OllamaClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = OllamaClient(cache=ResponseCache())
+    return _default_client
+
+
+def set_default_client(client: OllamaClient | None):
+    # Points call_ollama and the GUI at another server (None = lazily rebuild
+    # the default localhost client on next use).
+    global _default_client
+    _default_client = client
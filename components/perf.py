@@ -0,0 +1,53 @@
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_bytes(children: bool = False) -> int | None:
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memory_peak_bytes() -> int | None:
+    # Peak RSS of the current address space. On Linux ru_maxrss also keeps
+    # the peak from before exec, so a spawned child would report its
+    # parent's; VmHWM starts over at exec.
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return peak_rss_bytes()
+
+
+def format_bytes(num: float | None) -> str:
+    if num is None:
+        return "n/a"
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num) < 1024 or unit == "GB":
+            return f"{num:.1f} {unit}"
+        num /= 1024
+
+
+_SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_bytes(text: str) -> int:
+    # "512M", "2G", "1.5GB" or a plain byte count
+    value = text.strip().upper().removesuffix("B")
+    scale = _SIZE_UNITS.get(value[-1:], 1)
+    if scale > 1:
+        value = value[:-1]
+    try:
+        return int(float(value) * scale)
+    except ValueError:
+        raise ValueError(f"Invalid size: {text!r} (expected e.g. 512M or 2G)") from None
@@ -0,0 +1,394 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from http import HTTPStatus
+from pathlib import Path
+
+from .llm_cache import ResponseCache
+from .metrics import get_metrics
+from .ngram_model import SmartNGramModel, load_model
+from .ollama_client import OLLAMA_BASE_URL, AsyncOllamaClient, OllamaClient, OllamaError
+from .story_ollama import build_prompt_timed
+
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+MODEL_FILES = {n: Path(f"models/ngram_{n}.bin") for n in (2, 3, 4, 5)}
+
+MAX_BATCH = 32
+BATCH_WINDOW = 0.005
+LLM_CONCURRENCY = 2
+MAX_LLM_PENDING = 16
+MAX_BODY_BYTES = 1 << 20
+MAX_SAMPLES = 8
+
+
+class ServiceError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def load_models(model_files: dict[int, Path] = MODEL_FILES, log=print) -> dict[int, SmartNGramModel]:
+    models: dict[int, SmartNGramModel] = {}
+    for n, path in model_files.items():
+        if not path.exists():
+            log(f"[WARN] Model for n={n} not found ({path}), /draft will reject n={n}.")
+            continue
+        models[n] = load_model(path)
+        log(f"[INFO] Loaded model n={n} from {path}")
+    return models
+
+
+class DraftBatcher:
+    # Collects /draft requests for the same model for up to `window` seconds
+    # (or max_batch requests) and runs them as one generate_batch call.
+    # Requests with an explicit seed are drafted on their own so they stay
+    # reproducible.
+    def __init__(self, models: dict[int, SmartNGramModel], max_batch: int = MAX_BATCH, window: float = BATCH_WINDOW):
+        self.models = models
+        self.max_batch = max_batch
+        self.window = window
+        self._queues: dict[int, asyncio.Queue] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        for n in self.models:
+            self._queues[n] = asyncio.Queue()
+            self._tasks.append(asyncio.create_task(self._run(n)))
+
+    async def draft(self, n: int, text: str, num_sentences: int, max_tokens: int, seed: int | None) -> str:
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[n].put((text, num_sentences, max_tokens, seed, future))
+        return await future
+
+    async def _run(self, n: int):
+        model = self.models[n]
+        queue = self._queues[n]
+        metrics = get_metrics()
+        while True:
+            batch = [await queue.get()]
+            await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            groups: dict[tuple, list] = {}
+            for item in batch:
+                text, num_sentences, max_tokens, seed, future = item
+                key = (num_sentences, max_tokens) if seed is None else (num_sentences, max_tokens, id(item))
+                groups.setdefault(key, []).append(item)
+
+            for items in groups.values():
+                num_sentences, max_tokens, seed = items[0][1], items[0][2], items[0][3]
+                prefixes = [item[0] for item in items]
+                start = time.perf_counter()
+                try:
+                    drafts = await asyncio.to_thread(
+                        model.generate_batch, prefixes, num_sentences, max_tokens, seed
+                    )
+                except Exception as e:
+                    for item in items:
+                        if not item[4].done():
+                            item[4].set_exception(e)
+                    continue
+                metrics.observe("draft", time.perf_counter() - start)
+                metrics.count("draft_batch_size", len(items))
+                for item, draft in zip(items, drafts):
+                    if not item[4].done():
+                        item[4].set_result(draft)
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+class StoryService:
+    def __init__(
+        self,
+        models: dict[int, SmartNGramModel],
+        llm: AsyncOllamaClient,
+        max_llm_pending: int = MAX_LLM_PENDING,
+        max_batch: int = MAX_BATCH,
+        batch_window: float = BATCH_WINDOW,
+    ):
+        self.models = models
+        self.llm = llm
+        self.max_llm_pending = max_llm_pending
+        self.batcher = DraftBatcher(models, max_batch=max_batch, window=batch_window)
+        self.llm_pending = 0
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/stats"): self.stats,
+            ("POST", "/draft"): self.draft,
+            ("POST", "/continue"): self.continue_story,
+            ("POST", "/compare"): self.compare,
+        }
+
+    def _model_order(self, body: dict) -> int:
+        n = body.get("n", 4)
+        if not isinstance(n, int) or n not in self.models:
+            raise ServiceError(400, f"n must be one of {sorted(self.models)}")
+        return n
+
+    @staticmethod
+    def _text(body: dict) -> str:
+        text = body.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise ServiceError(400, "text is required")
+        return text.strip()
+
+    @staticmethod
+    def _int(body: dict, key: str, default: int, low: int, high: int) -> int:
+        value = body.get(key, default)
+        if not isinstance(value, int) or not low <= value <= high:
+            raise ServiceError(400, f"{key} must be an integer in [{low}, {high}]")
+        return value
+
+    async def _draft(self, body: dict, n: int, text: str) -> str:
+        seed = body.get("seed")
+        if seed is not None and not isinstance(seed, int):
+            raise ServiceError(400, "seed must be an integer")
+        return await self.batcher.draft(
+            n,
+            text,
+            self._int(body, "num_sentences", 3, 1, 20),
+            self._int(body, "max_tokens", 80, 1, 500),
+            seed,
+        )
+
+    async def health(self, body: dict) -> dict:
+        return {"status": "ok", "pid": os.getpid(), "models": sorted(self.models), "llm_pending": self.llm_pending}
+
+    async def stats(self, body: dict) -> dict:
+        return get_metrics().snapshot()
+
+    async def draft(self, body: dict) -> dict:
+        n = self._model_order(body)
+        return {"n": n, "draft": await self._draft(body, n, self._text(body))}
+
+    async def compare(self, body: dict) -> dict:
+        text = self._text(body)
+        orders = body.get("orders", sorted(self.models))
+        if not isinstance(orders, list) or not all(isinstance(n, int) and n in self.models for n in orders):
+            raise ServiceError(400, f"orders must be a list drawn from {sorted(self.models)}")
+        samples = self._int(body, "samples", 1, 1, MAX_SAMPLES)
+
+        seed = body.get("seed")
+        jobs = [
+            self._draft({**body, "seed": None if seed is None else seed + i}, n, text)
+            for n in orders
+            for i in range(samples)
+        ]
+        results = await asyncio.gather(*jobs)
+        drafts = {str(n): results[i * samples : (i + 1) * samples] for i, n in enumerate(orders)}
+        return {"drafts": drafts}
+
+    async def continue_story(self, body: dict) -> dict:
+        n = self._model_order(body)
+        text = self._text(body)
+        genre = body.get("genre") or None
+
+        # Refuse instead of queueing without bound when Ollama falls behind.
+        if self.llm_pending >= self.max_llm_pending:
+            raise ServiceError(503, "LLM queue is full, retry later")
+
+        self.llm_pending += 1
+        start = time.perf_counter()
+        try:
+            draft = await self._draft(body, n, text)
+            prompt = build_prompt_timed(user_input=text, draft=draft, genre=genre)
+            continuation = await self.llm.generate(prompt)
+        except OllamaError as e:
+            raise ServiceError(502, str(e)) from e
+        finally:
+            self.llm_pending -= 1
+
+        return {
+            "n": n,
+            "draft": draft,
+            "continuation": continuation,
+            "seconds": time.perf_counter() - start,
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin-1").split(maxsplit=2)
+                headers: dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "request body too large"}, keep_alive=False)
+                    break
+                raw = await reader.readexactly(length) if length else b""
+
+                status, payload = await self._dispatch(method, path.split("?")[0], raw)
+                keep_alive = version.strip() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, raw: bytes) -> tuple[int, dict]:
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self.routes):
+                return 405, {"error": f"{method} not allowed on {path}"}
+            return 404, {"error": f"unknown endpoint {path}"}
+        try:
+            body = json.loads(raw) if raw else {}
+            if not isinstance(body, dict):
+                raise ServiceError(400, "request body must be a JSON object")
+            return 200, await handler(body)
+        except json.JSONDecodeError:
+            return 400, {"error": "invalid JSON"}
+        except ServiceError as e:
+            return e.status, {"error": e.message}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool):
+        data = json.dumps(payload).encode("utf-8")
+        lines = [
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(data)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if status == 503:
+            lines.append("Retry-After: 1")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+
+
+async def _serve(sock: socket.socket, models: dict[int, SmartNGramModel], options: dict):
+    # Per-process state: HTTP session pool and the SQLite cache connection
+    # must not be shared across fork().
+    client = OllamaClient(
+        base_url=options["ollama_url"],
+        pool_size=options["llm_concurrency"],
+        cache=ResponseCache(enabled=options["use_cache"]),
+    )
+    service = StoryService(
+        models,
+        AsyncOllamaClient(client, concurrency=options["llm_concurrency"]),
+        max_llm_pending=options["max_llm_pending"],
+        max_batch=options["max_batch"],
+        batch_window=options["batch_window"],
+    )
+    service.batcher.start()
+    server = await asyncio.start_server(service.handle, sock=sock)
+    async with server:
+        await server.serve_forever()
+
+
+def _run_worker(sock: socket.socket, models: dict[int, SmartNGramModel], options: dict):
+    try:
+        asyncio.run(_serve(sock, models, options))
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(
+    host: str = SERVICE_HOST,
+    port: int = SERVICE_PORT,
+    workers: int = 1,
+    llm_concurrency: int = LLM_CONCURRENCY,
+    max_llm_pending: int = MAX_LLM_PENDING,
+    max_batch: int = MAX_BATCH,
+    batch_window: float = BATCH_WINDOW,
+    use_cache: bool = True,
+    ollama_url: str = OLLAMA_BASE_URL,
+    model_files: dict[int, Path] = MODEL_FILES,
+    log=print,
+):
+    # Models are memory-mapped once here; forked workers inherit the mappings,
+    # so the model arrays live once in the page cache however many workers run.
+    models = load_models(model_files, log)
+    if not models:
+        raise FileNotFoundError("No n-gram models found. Train n-grams first.")
+
+    sock = socket.create_server((host, port), backlog=256)
+    options = {
+        "llm_concurrency": llm_concurrency,
+        "max_llm_pending": max_llm_pending,
+        "max_batch": max_batch,
+        "batch_window": batch_window,
+        "use_cache": use_cache,
+        "ollama_url": ollama_url,
+    }
+
+    if workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        log("[WARN] fork() is not available here, serving from a single process.")
+        workers = 1
+
+    log(f"[INFO] Serving on http://{host}:{sock.getsockname()[1]} with {workers} worker(s)")
+    if workers == 1:
+        _run_worker(sock, models, options)
+        return
+
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target=_run_worker, args=(sock, models, options), daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    # Treat SIGTERM like Ctrl+C so the workers are stopped with the parent.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP service for n-gram drafts and LLM continuations.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=1, help="server processes sharing the mapped models")
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_CONCURRENCY, help="Ollama requests in flight per worker")
+    parser.add_argument(
+        "--max-llm-pending",
+        type=int,
+        default=MAX_LLM_PENDING,
+        help="per worker; further /continue requests get 503 until the queue drains",
+    )
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="drafts generated together per model")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW, help="seconds to wait for a batch to fill")
+    parser.add_argument("--ollama-url", default=OLLAMA_BASE_URL)
+    parser.add_argument("--no-cache", action="store_true", help="always call the LLM, ignore cached responses")
+    args = parser.parse_args()
+
+    serve(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        llm_concurrency=args.llm_concurrency,
+        max_llm_pending=args.max_llm_pending,
+        max_batch=args.max_batch,
+        batch_window=args.batch_window,
+        use_cache=not args.no_cache,
+        ollama_url=args.ollama_url,
+    )
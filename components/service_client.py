@@ -0,0 +1,54 @@
+import requests
+
+from .ollama_client import OllamaError
+
+
+SERVICE_URL = "http://127.0.0.1:8765"
+
+
+class ServiceError(OllamaError):
+    pass
+
+
+class ServiceClient:
+    # Blocking client for components.service, used by the GUI instead of
+    # loading models in-process.
+    def __init__(self, base_url: str = SERVICE_URL, timeout: float = 180):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _request(self, method: str, path: str, body: dict | None = None) -> dict:
+        try:
+            resp = self.session.request(method, f"{self.base_url}{path}", json=body, timeout=self.timeout)
+        except requests.exceptions.ConnectionError as e:
+            raise ServiceError(f"Cannot connect to the generation service at {self.base_url}. Is it running?") from e
+        except requests.exceptions.Timeout as e:
+            raise ServiceError("Generation service request timed out.") from e
+
+        try:
+            data = resp.json()
+        except ValueError:
+            data = {"error": resp.text}
+        if resp.status_code != 200:
+            raise ServiceError(f"Service HTTP {resp.status_code}: {data.get('error', '')}")
+        return data
+
+    def health(self) -> dict:
+        return self._request("GET", "/health")
+
+    def draft(self, text: str, n: int = 4, num_sentences: int = 3, max_tokens: int = 80, seed: int | None = None) -> str:
+        body = {"text": text, "n": n, "num_sentences": num_sentences, "max_tokens": max_tokens, "seed": seed}
+        return self._request("POST", "/draft", body)["draft"]
+
+    def continue_story(self, text: str, n: int = 4, genre: str | None = None) -> dict:
+        return self._request("POST", "/continue", {"text": text, "n": n, "genre": genre})
+
+    def compare(self, text: str, orders: list[int] | None = None, samples: int = 1) -> dict[str, list[str]]:
+        body = {"text": text, "samples": samples}
+        if orders is not None:
+            body["orders"] = orders
+        return self._request("POST", "/compare", body)["drafts"]
+
+    def close(self):
+        self.session.close()
@@ -1,33 +1,49 @@
+import argparse
+from collections import Counter, deque
 from pathlib import Path
 
-import requests
+from .clean import tokenize
+from .metrics import Metrics, get_metrics
 from .ngram_model import load_model, SmartNGramModel
+from .ollama_client import OLLAMA_MODEL, OllamaClient, OllamaError, OllamaStream, get_default_client
 
 
-OLLAMA_MODEL = "gemma3:4b"
+# Session mode: Ollama context tokens kept before the conversation is
+# restarted from a compact prompt, story words quoted verbatim in that prompt,
+# and the length of the summary that stands in for everything older.
+CONTEXT_BUDGET = 2048
+WINDOW_WORDS = 300
+SUMMARY_WORDS = 80
+TAIL_TOKENS = 16
 
 
 def call_ollama(prompt: str, model: str = OLLAMA_MODEL, timeout: int = 120) -> str:
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False,
-    }
-
     try:
-        resp = requests.post(url, json=payload, timeout=timeout)
-    except requests.exceptions.ConnectionError:
-        return "[ERROR] Cannot connect to Ollama at http://localhost:11434. Is it running?"
-    except requests.exceptions.Timeout:
-        return "[ERROR] Ollama request timed out."
+        return get_default_client().generate(prompt, model=model, timeout=timeout)
+    except OllamaError as e:
+        return f"[ERROR] {e}"
 
-    if resp.status_code != 200:
-        return f"[ERROR] Ollama HTTP {resp.status_code}: {resp.text}"
 
-    data = resp.json()
+def draft_story(
+    model: SmartNGramModel,
+    text: str,
+    num_sentences: int = 3,
+    max_tokens: int = 80,
+    metrics: Metrics | None = None,
+) -> str:
+    # generate_multi plus the drafting counters: tokens sampled and how far
+    # they backed off (0 = full context, n-1 = unigram fallback).
+    metrics = metrics or get_metrics()
+    hits: Counter = Counter()
+    with metrics.span("draft"):
+        draft = model.generate_multi(text, num_sentences=num_sentences, max_tokens=max_tokens, backoff_hits=hits)
 
-    return data.get("response", "").strip()
+    tokens = sum(hits.values())
+    metrics.count("draft_tokens", tokens)
+    if tokens:
+        depth = sum((model.n - 1 - order) * count for order, count in hits.items())
+        metrics.count("backoff_depth", depth / tokens)
+    return draft
 
 
 def build_prompt(user_input: str, draft: str, genre: str | None = None) -> str:
@@ -54,11 +70,223 @@ Instructions:
     return prompt.strip()
 
 
-def main():
-    model_path = Path("models/ngram_4_smart.pkl")
-    ngram: SmartNGramModel = load_model(model_path)
+def build_prompt_timed(user_input: str, draft: str, genre: str | None = None, metrics: Metrics | None = None) -> str:
+    metrics = metrics or get_metrics()
+    with metrics.span("prompt"):
+        prompt = build_prompt(user_input=user_input, draft=draft, genre=genre)
+    metrics.count("prompt_chars", len(prompt))
+    return prompt
+
+
+def build_session_prompt(summary: str, recent: str, draft: str, genre: str | None = None) -> str:
+    genre_part = f"Genre: {genre}.\n" if genre else ""
+    summary_part = f"Summary of the story so far:\n\"\"\"{summary}\"\"\"\n\n" if summary else ""
+
+    prompt = f"""
+You are a story continuation assistant. We will write the story together over several turns.
+
+{genre_part}Your task is to continue the story in natural, fluent English.
+
+{summary_part}Most recent part of the story:
+\"\"\"{recent}\"\"\"
+
+Rough continuation draft generated by a statistical n-gram model:
+\"\"\"{draft}\"\"\"
+
+Instructions:
+- Use the rough draft only as inspiration for style and ideas, you may rewrite it.
+- Produce a coherent continuation of the story in 2–4 sentences.
+- Keep the same point of view, tense and general tone as the story so far.
+- Do not explain what you are doing, just output the continuation text only.
+"""
+    return prompt.strip()
+
+
+def build_turn_prompt(addition: str, draft: str) -> str:
+    # Later turns only carry what is new; the rest is already in the context.
+    addition_part = f"The user adds:\n\"\"\"{addition}\"\"\"\n\n" if addition else ""
+    prompt = f"""
+{addition_part}New rough draft from the n-gram model:
+\"\"\"{draft}\"\"\"
+
+Continue the story from where it stopped in 2–4 sentences, same rules as before. Output the continuation text only.
+"""
+    return prompt.strip()
+
+
+def build_summary_prompt(summary: str, passage: str, max_words: int = SUMMARY_WORDS) -> str:
+    summary_part = f"Summary so far:\n\"\"\"{summary}\"\"\"\n\n" if summary else ""
+    prompt = f"""
+{summary_part}Next part of the story:
+\"\"\"{passage}\"\"\"
+
+Write an updated summary of the whole story in at most {max_words} words. Keep names, places and open plot threads. Output the summary only.
+"""
+    return prompt.strip()
+
+
+class StorySession:
+    # A story written over several turns. Each turn continues the previous
+    # Ollama context (its KV state), so only the new text is evaluated. Once
+    # the context outgrows context_budget the conversation restarts from a
+    # bounded prompt: a summary of older parts (extended incrementally and
+    # served from the response cache when repeated) plus the last
+    # window_words words. The n-gram draft is fed only the last n-1 tokens.
+    def __init__(
+        self,
+        genre: str | None = None,
+        client: OllamaClient | None = None,
+        context_budget: int = CONTEXT_BUDGET,
+        window_words: int = WINDOW_WORDS,
+        metrics: Metrics | None = None,
+    ):
+        self.genre = genre
+        self.client = client or get_default_client()
+        self.context_budget = context_budget
+        self.window_words = window_words
+        self.metrics = metrics or get_metrics()
+
+        self.words: list[str] = []
+        self.tail: deque[str] = deque(maxlen=TAIL_TOKENS)
+        self.context: list[int] | None = None
+        self.summary = ""
+        self.summarized = 0
+        self.turns: list[dict] = []
+        # What prepare() set up for the running turn; complete() applies it,
+        # so a turn that fails leaves the session as it was.
+        self._pending: dict | None = None
+
+    @property
+    def story(self) -> str:
+        return " ".join(self.words)
+
+    def _add(self, text: str):
+        self.words.extend(text.split())
+        self.tail.extend(tokenize(text))
+
+    def draft_prefix(self, n: int, addition: str = "") -> str:
+        tokens = [*self.tail, *tokenize(addition)]
+        return " ".join(tokens[-(n - 1) :])
+
+    def _summarize(self, words: list[str]) -> tuple[str, int]:
+        # Folds the words that left the window into the summary.
+        end = len(words) - self.window_words
+        if end <= self.summarized:
+            return self.summary, self.summarized
+        passage = " ".join(words[self.summarized : end])
+        with self.metrics.span("summary"):
+            summary = self.client.generate(build_summary_prompt(self.summary, passage))
+        return summary, end
+
+    def prepare(self, addition: str, ngram: SmartNGramModel) -> tuple[str, OllamaStream]:
+        addition = addition.strip()
+        words = self.words + addition.split()
+        if not words:
+            raise ValueError("A session needs a story beginning.")
+
+        draft = draft_story(ngram, self.draft_prefix(ngram.n, addition), metrics=self.metrics)
+
+        compacted = self.context is None or len(self.context) > self.context_budget
+        context = None if compacted else self.context
+        summary, summarized = self.summary, self.summarized
+        with self.metrics.span("prompt"):
+            if compacted:
+                summary, summarized = self._summarize(words)
+                recent = " ".join(words[-self.window_words :])
+                prompt = build_session_prompt(summary, recent, draft, self.genre)
+            else:
+                prompt = build_turn_prompt(addition, draft)
+        self.metrics.count("prompt_chars", len(prompt))
+
+        self._pending = {"addition": addition, "compacted": compacted, "summary": summary, "summarized": summarized}
+        return draft, OllamaStream(prompt, client=self.client, context=context)
+
+    def complete(self, stream: OllamaStream) -> dict:
+        # Call after the stream finished; a cached reply carries no context,
+        # so the next turn starts over from a compact prompt.
+        pending, self._pending = self._pending, None
+        self._add(pending["addition"])
+        self._add(stream.response)
+        self.summary, self.summarized = pending["summary"], pending["summarized"]
+        self.context = stream.new_context
+        turn = {
+            "turn": len(self.turns) + 1,
+            "compacted": pending["compacted"],
+            "prompt_tokens": stream.final.get("prompt_eval_count", 0),
+            "prompt_seconds": stream.prompt_eval_seconds or 0.0,
+            "context_tokens": len(self.context or []),
+            "story_words": len(self.words),
+        }
+        self.turns.append(turn)
+        self.metrics.count("session_prompt_tokens", turn["prompt_tokens"])
+        return turn
+
+
+def format_turn(turn: dict) -> str:
+    restart = ", compact prompt" if turn["compacted"] else ""
+    return (
+        f"[turn {turn['turn']}: prompt {turn['prompt_tokens']} tok in {turn['prompt_seconds']:.2f}s, "
+        f"context {turn['context_tokens']} tok, story {turn['story_words']} words{restart}]"
+    )
+
+
+def run_session(ngram: SmartNGramModel, metrics_path: Path | None = None):
+    client = get_default_client()
+    metrics = get_metrics()
+    session = None
+
+    while True:
+        if session is None:
+            user_input = input("\nEnter story beginning (or 'quit'): ").strip()
+            if not user_input or user_input.lower() in {"quit", "exit"}:
+                break
+            genre = input("Optional genre (e.g. 'horror', 'fantasy', 'comedy'; press Enter to skip): ").strip()
+            session = StorySession(genre=genre or None, client=client, metrics=metrics)
+        else:
+            user_input = input("\nAdd to the story (Enter to let it continue, 'new' or 'quit'): ").strip()
+            if user_input.lower() in {"quit", "exit"}:
+                break
+            if user_input.lower() == "new":
+                session = None
+                continue
+
+        try:
+            draft, stream = session.prepare(user_input, ngram)
+            print("\n[Smart n-gram draft]:")
+            print(draft)
+            print("\n[LLM continuation]:")
+            for piece in stream:
+                print(piece, end="", flush=True)
+        except OllamaError as e:
+            # nothing was added to the story; a failed first turn starts over
+            print(f"[ERROR] {e}")
+            if not session.turns:
+                session = None
+            continue
+        print()
+        print(format_turn(session.complete(stream)), stream.timing_summary())
+        if metrics_path is not None:
+            metrics.export(metrics_path)
+        print("\n" + "-" * 60)
+
+    print("\n[Latency by stage]:")
+    print(metrics.summary())
+
+
+def main(use_cache: bool = True, metrics_path: Path | None = None, session: bool = False):
+    client = get_default_client()
+    client.cache.enabled = use_cache
+    metrics = get_metrics()
+
+    model_path = Path("models/ngram_4.bin")
+    with metrics.span("model_load"):
+        ngram: SmartNGramModel = load_model(model_path)
     print(f"Loaded smart n-gram model from {model_path}")
 
+    if session:
+        run_session(ngram, metrics_path)
+        return
+
     while True:
         user_input = input("\nEnter story beginning (or 'quit'): ").strip()
         if not user_input or user_input.lower() in {"quit", "exit"}:
@@ -68,19 +296,35 @@ def main():
         if not genre:
             genre = None
 
-        draft = ngram.generate_multi(user_input, num_sentences=3, max_tokens=80)
+        draft = draft_story(ngram, user_input)
         print("\n[Smart n-gram draft]:")
         print(draft)
 
-        prompt = build_prompt(user_input=user_input, draft=draft, genre=genre)
+        prompt = build_prompt_timed(user_input=user_input, draft=draft, genre=genre)
 
         print("\n[Calling LLM via Ollama...]\n")
-        llm_output = call_ollama(prompt)
-
         print("[LLM continuation]:")
-        print(llm_output)
+
+        stream = OllamaStream(prompt)
+        try:
+            for piece in stream:
+                print(piece, end="", flush=True)
+        except OllamaError as e:
+            print(f"[ERROR] {e}", end="")
+        print()
+        print(stream.timing_summary(), client.cache.summary())
+        if metrics_path is not None:
+            metrics.export(metrics_path)
         print("\n" + "-" * 60)
 
+    print("\n[Latency by stage]:")
+    print(metrics.summary())
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Interactive n-gram + LLM story continuation.")
+    parser.add_argument("--no-cache", action="store_true", help="always call the LLM, ignore cached responses")
+    parser.add_argument("--metrics", type=Path, help="write per-stage latency stats here (.json or .csv)")
+    parser.add_argument("--session", action="store_true", help="multi-turn story that reuses the LLM context")
+    args = parser.parse_args()
+    main(use_cache=not args.no_cache, metrics_path=args.metrics, session=args.session)
@@ -1,47 +1,55 @@
 # demo_compare_ngrams.py
-from pathlib import Path
-import pickle
-
-from .ngram_model import SmartNGramModel
-
-
-MODELS = {
-    "2": Path("models/ngram_2.pkl"),
-    "3": Path("models/ngram_3.pkl"),
-    "4": Path("models/ngram_4.pkl"),
-    "5": Path("models/ngram_5.pkl"),
-}
-
-
-def load_model_file(path: Path) -> SmartNGramModel:
-    with path.open("rb") as f:
-        return pickle.load(f)
-
-
-def main():
-    models: dict[str, SmartNGramModel] = {}
-    for n_str, path in MODELS.items():
-        if not path.exists():
-            print(f"[WARN] Model for n={n_str} not found at {path}, skipping.")
-            continue
-        models[n_str] = load_model_file(path)
-        print(f"[INFO] Loaded n={n_str} from {path}")
-
-    if not models:
-        print("No models loaded. Train them first with train_ngrams.py.")
-        return
-
-    while True:
-        prefix = input("\nEnter story beginning (or 'quit'): ").strip()
-        if not prefix or prefix.lower() in {"quit", "exit"}:
-            break
-
-        print("\n=== N-gram comparison ===")
-        for n_str, model in models.items():
-            draft = model.generate_multi(prefix, num_sentences=3, max_tokens=80)
-            print(f"\n[n={n_str} draft]:")
-            print(draft)
-
+import argparse
+
+from .compare import MODEL_FILES, ComparisonEngine
+
+
+def main(samples: int = 1):
+    engine = ComparisonEngine(MODEL_FILES)
+    # the engine's load and draft pools are shut down however the demo ends
+    try:
+        loads = engine.preload()
+
+        available = []
+        for n_str, future in loads.items():
+            try:
+                future.result()
+            except FileNotFoundError:
+                print(f"[WARN] Model for n={n_str} not found at {MODEL_FILES[n_str]}, skipping.")
+                continue
+            except Exception as e:
+                # corrupt or old-format files: skip the order, keep the demo going
+                print(f"[WARN] Model for n={n_str} failed to load: {e}")
+                continue
+            available.append(n_str)
+            print(f"[INFO] Loaded n={n_str} from {MODEL_FILES[n_str]}")
+
+        if not available:
+            print("No models loaded. Train them first with train_ngrams.py.")
+            return
+
+        while True:
+            try:
+                prefix = input("\nEnter story beginning (or 'quit'): ").strip()
+            except EOFError:
+                break
+            if not prefix or prefix.lower() in {"quit", "exit"}:
+                break
+
+            print("\n=== N-gram comparison ===")
+            for result in engine.compare(prefix, orders=available, samples=samples):
+                print(f"\n[n={result['n']} draft] ({result['seconds'] * 1000:.1f} ms):")
+                if result["error"]:
+                    print(f"[ERROR] {result['error']}")
+                    continue
+                for draft in result["drafts"]:
+                    print(draft)
+                print(result["backoff"])
+    finally:
+        engine.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Compare drafts from the n=2..5 models side by side.")
+    parser.add_argument("--samples", type=int, default=1, help="drafts per model")
+    args = parser.parse_args()
+    main(samples=args.samples)
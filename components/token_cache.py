@@ -0,0 +1,177 @@
+import argparse
+import time
+from array import array
+from collections import defaultdict, Counter
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+
+from .clean import tokenize, OUT_PATH as CORPUS_PATH
+from .model_format import read_binary, write_binary
+from .model_meta import file_checksum
+from .ngram_model import PAD, iter_corpus
+
+
+# Reserved ids; story token streams never contain them.
+BOS_ID, EOS_ID = 0, 1
+PROGRESS_EVERY = 100_000
+
+
+def cache_path(corpus_path: Path) -> Path:
+    # data/stories.txt -> data/stories.tokens.bin
+    return corpus_path.with_suffix(".tokens.bin")
+
+
+def _encode_vocab(vocab: list[str]) -> bytes:
+    return "\n".join(vocab).encode("utf-8")
+
+
+def _decode_vocab(blob) -> list[str]:
+    return bytes(blob).decode("utf-8").split("\n")
+
+
+# stories.txt as a token-id stream: story i is ids[offsets[i]:offsets[i + 1]],
+# vocab[id] its token. Stored in the same mmap container as the models.
+class TokenCache:
+    def __init__(self, path: Path, fields: dict, vocab: list[str], ids, offsets):
+        self.path = path
+        self.fields = fields
+        self.vocab = vocab
+        self.ids = ids
+        self.offsets = offsets
+
+    @property
+    def num_stories(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.ids)
+
+    def story_ids(self, i: int):
+        return self.ids[self.offsets[i] : self.offsets[i + 1]]
+
+    def story_tokens(self, i: int) -> list[str]:
+        vocab = self.vocab
+        return [vocab[t] for t in self.story_ids(i)]
+
+    def iter_tokens(self, stories: Iterable[int] | None = None) -> Iterator[list[str]]:
+        for i in range(self.num_stories) if stories is None else stories:
+            yield self.story_tokens(i)
+
+
+def build_token_cache(
+    corpus_path: Path = CORPUS_PATH,
+    out_path: Path | None = None,
+    log: Callable[[str], None] = print,
+    cancel_check: Callable[[], None] | None = None,
+) -> Path:
+    out_path = out_path or cache_path(corpus_path)
+    start = time.perf_counter()
+
+    token_ids: dict[str, int] = {"<bos>": BOS_ID, "<eos>": EOS_ID}
+    ids = array("I")
+    offsets = array("Q", [0])
+    for num_stories, story in enumerate(iter_corpus(corpus_path), 1):
+        if cancel_check is not None:
+            cancel_check()
+        ids.extend([token_ids.setdefault(tok, len(token_ids)) for tok in tokenize(story)])
+        offsets.append(len(ids))
+        if num_stories % PROGRESS_EVERY == 0:
+            log(f"[INFO] Tokenized {num_stories} stories...")
+
+    stat = corpus_path.stat()
+    fields = {
+        "kind": "token_cache",
+        "corpus": corpus_path.name,
+        "corpus_bytes": stat.st_size,
+        "corpus_sha256": file_checksum(corpus_path),
+        "num_stories": len(offsets) - 1,
+        "num_tokens": len(ids),
+        "vocab_size": len(token_ids),
+    }
+    write_binary(out_path, fields, {"vocab": _encode_vocab(list(token_ids)), "ids": ids, "offsets": offsets})
+
+    log(
+        f"[INFO] Token cache {out_path}: {fields['num_stories']} stories, {fields['num_tokens']} tokens, "
+        f"{fields['vocab_size']} types in {time.perf_counter() - start:.1f}s"
+    )
+    return out_path
+
+
+def read_token_cache(path: Path) -> TokenCache:
+    fields, sections = read_binary(path)
+    if fields.get("kind") != "token_cache":
+        raise ValueError(f"Not a token cache: {path}")
+    return TokenCache(path, fields, _decode_vocab(sections["vocab"]), sections["ids"], sections["offsets"])
+
+
+def load_token_cache(
+    corpus_path: Path = CORPUS_PATH,
+    log: Callable[[str], None] = print,
+    cancel_check: Callable[[], None] | None = None,
+) -> TokenCache:
+    # Rebuilds the cache when it is missing or was made from a corpus with a
+    # different checksum.
+    if not corpus_path.exists():
+        raise FileNotFoundError(f"Corpus not found: {corpus_path.resolve()}")
+
+    path = cache_path(corpus_path)
+    if path.exists():
+        cache = read_token_cache(path)
+        fields = cache.fields
+        if fields["corpus_bytes"] == corpus_path.stat().st_size and fields["corpus_sha256"] == file_checksum(corpus_path):
+            return cache
+        log(f"[INFO] {corpus_path} changed since {path} was built, re-tokenizing.")
+    else:
+        log(f"[INFO] No token cache for {corpus_path}, tokenizing once.")
+
+    build_token_cache(corpus_path, path, log, cancel_check)
+    return read_token_cache(path)
+
+
+def count_ngrams_cached(
+    cache: TokenCache,
+    n: int,
+    stories: Iterable[int] | None = None,
+    pad: bool = False,
+    cancel_check: Callable[[], None] | None = None,
+) -> tuple[dict[tuple, Counter], Counter, int]:
+    # Same result as count_ngrams over the same stories (including insertion
+    # order). Ids are mapped to the shared vocab strings per story rather than
+    # counted as ints: str hashes are cached, so tuple keys hash as cheaply
+    # and nothing has to be translated back afterwards. pad=True counts over
+    # stories padded for derive_order_counts. cancel_check is called once per
+    # story and raises to abort.
+    raw_counts: dict[tuple, Counter] = defaultdict(Counter)
+    unigram_counts: Counter = Counter()
+    total_tokens = 0
+    vocab, ids, offsets = cache.vocab, cache.ids, cache.offsets
+    bos, eos = vocab[BOS_ID], vocab[EOS_ID]
+    padding = [PAD] * (n - 2) if pad else []
+
+    for i in range(cache.num_stories) if stories is None else stories:
+        if cancel_check is not None:
+            cancel_check()
+        tokens = [bos, *[vocab[t] for t in ids[offsets[i] : offsets[i + 1]]], eos]
+        unigram_counts.update(tokens)
+        total_tokens += len(tokens)
+        tokens += padding
+
+        contexts = zip(*(tokens[j:] for j in range(n - 1)))
+        for context, nxt in zip(contexts, tokens[n - 1 :]):
+            raw_counts[context][nxt] += 1
+
+    return raw_counts, unigram_counts, total_tokens
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokenize stories.txt once into a memory-mappable id stream.")
+    parser.add_argument("--corpus", type=Path, default=CORPUS_PATH)
+    parser.add_argument("--force", action="store_true", help="rebuild even if the cache is up to date")
+    args = parser.parse_args()
+
+    if args.force:
+        build_token_cache(args.corpus)
+    else:
+        cache = load_token_cache(args.corpus)
+        print(f"[OK] {cache.path}: {cache.num_stories} stories, {cache.num_tokens} tokens, {len(cache.vocab)} types")
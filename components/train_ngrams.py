@@ -1,34 +1,329 @@
+import argparse
+import os
+import shutil
+from collections import defaultdict, Counter
+from collections.abc import Callable
+from multiprocessing import Pool, TimeoutError as PoolTimeout
 from pathlib import Path
 
-from .ngram_model import SmartNGramModel, load_corpus, save_model
+from .external_counts import fit_external
+from .model_format import is_binary_model, read_header
+from .model_meta import metadata_path
+from .ngram_model import SmartNGramModel, derive_order_counts, load_model, save_model
+from .perf import format_bytes, parse_bytes
+from .token_cache import TokenCache, count_ngrams_cached, load_token_cache, read_token_cache
 
 
 CORPUS_PATH = Path("data/stories.txt")
 MODELS_DIR = Path("models")
+SHARDS_PER_WORKER = 4
+# models are written here and moved into MODELS_DIR once every order is done
+STAGING_DIR = ".staging"
+CANCEL_POLL_SECONDS = 0.1
 
+# (n, min_count, top_k) of the models the app uses
+CONFIGS = [(2, 2, 12), (3, 2, 10), (4, 3, 8), (5, 3, 6)]
 
-def train_one_ngram(n: int, model_path: Path, min_count: int, top_k: int):
-    stories = load_corpus(CORPUS_PATH)
-    print(f"[n={n}] Loaded {len(stories)} stories from {CORPUS_PATH}")
 
-    model = SmartNGramModel(n=n, min_count=min_count, top_k=top_k)
-    model.fit(stories)
-    save_model(model, model_path)
+def split_stories(num_stories: int, num_shards: int) -> list[tuple[int, int]]:
+    bounds = [num_stories * i // num_shards for i in range(num_shards + 1)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
 
-    print(f"[n={n}] Saved model to {model_path}")
 
+def _count_shard(args: tuple[Path, int, int, int, bool]):
+    # Workers map the token cache themselves instead of receiving the ids.
+    cache_file, start, end, n, pad = args
+    return count_ngrams_cached(read_token_cache(cache_file), n, range(start, end), pad)
 
-def main():
-    configs = [
-        (2, MODELS_DIR / "ngram_2.pkl", 2, 12),
-        (3, MODELS_DIR / "ngram_3.pkl", 2, 10),
-        (4, MODELS_DIR / "ngram_4.pkl", 3, 8),
-        (5, MODELS_DIR / "ngram_5.pkl", 3, 6),
-    ]
+
+def count_ngrams_parallel(
+    cache: TokenCache,
+    n: int,
+    workers: int,
+    pad: bool = False,
+    cancel_check: Callable[[], None] | None = None,
+):
+    shards = split_stories(cache.num_stories, workers * SHARDS_PER_WORKER)
+
+    raw_counts: dict[tuple, Counter] = defaultdict(Counter)
+    unigram_counts: Counter = Counter()
+    total_tokens = 0
+
+    # Shards are merged in corpus order so the merged dicts keep the same
+    # insertion order as a serial pass over the corpus. Leaving the with block
+    # early (cancel_check raised) terminates the workers.
+    with Pool(processes=workers) as pool:
+        tasks = [(cache.path, start, end, n, pad) for start, end in shards]
+        results = pool.imap(_count_shard, tasks)
+        for shard_raw, shard_unigrams, shard_tokens in _poll(results, cancel_check):
+            for context, successors in shard_raw.items():
+                raw_counts[context].update(successors)
+            unigram_counts.update(shard_unigrams)
+            total_tokens += shard_tokens
+
+    return raw_counts, unigram_counts, total_tokens
+
+
+def _poll(results, cancel_check: Callable[[], None] | None):
+    # Waits on the pool in short slices so a cancel does not have to wait
+    # for the shard being counted.
+    while True:
+        if cancel_check is not None:
+            cancel_check()
+        try:
+            yield results.next(timeout=CANCEL_POLL_SECONDS)
+        except PoolTimeout:
+            continue
+        except StopIteration:
+            return
+
+
+def staged_path(model_path: Path) -> Path:
+    return model_path.parent / STAGING_DIR / model_path.name
+
+
+def publish_models(paths: list[Path]):
+    # Moves the staged models (and their metadata) over the old ones. No
+    # cancellation point in here, so either every order is replaced or none.
+    for path in paths:
+        staged = staged_path(path)
+        os.replace(staged, path)
+        os.replace(metadata_path(staged), metadata_path(path))
+
+
+def _start_model(
+    n: int,
+    model_path: Path,
+    min_count: int,
+    top_k: int,
+    append: bool,
+    log: Callable[[str], None],
+    corpus_path: Path,
+    keep_raw: bool = False,
+) -> SmartNGramModel:
+    # Raw (unfolded) counts make the model larger and slower to load, so
+    # they are only kept on request; appending needs them.
+    if append and model_path.exists():
+        model = load_model(model_path)
+        if model.raw_counts is None:
+            raise ValueError(f"{model_path} has no raw counts to append to; retrain it with --keep-raw first")
+        log(f"[n={n}] Appending stories from {corpus_path} to {model_path}")
+        return model
+    # a model started by --append can be appended to again
+    return SmartNGramModel(n=n, min_count=min_count, top_k=top_k, keep_raw=keep_raw or append)
+
+
+def check_appendable(paths: list[Path]):
+    # Reads only the headers, so a model without raw counts fails before
+    # anything is counted.
+    for path in paths:
+        if path.exists() and is_binary_model(path) and read_header(path)[0]["fields"].get("raw_key_words") is None:
+            raise ValueError(f"{path} has no raw counts to append to; retrain it with --keep-raw first")
+
+
+def _count(
+    cache: TokenCache,
+    n: int,
+    workers: int,
+    log: Callable[[str], None],
+    pad: bool = False,
+    cancel_check: Callable[[], None] | None = None,
+):
+    if workers > 1:
+        log(f"[n={n}] Counting with {workers} workers")
+        return count_ngrams_parallel(cache, n, workers, pad, cancel_check)
+    return count_ngrams_cached(cache, n, pad=pad, cancel_check=cancel_check)
+
+
+def _finish_model(model: SmartNGramModel, counts, model_path: Path, config: dict, log: Callable[[str], None]):
+    # Saved to the staging dir; main() publishes all orders together.
+    model._fold_counts(*counts)
+    log(f"[n={model.n}] Counted {model.total_tokens} tokens, {len(model.context_counts)} contexts")
+    save_model(model, staged_path(model_path), config)
+    log(f"[n={model.n}] Finished model for {model_path}")
+
+
+def train_one_ngram(
+    n: int,
+    model_path: Path,
+    min_count: int,
+    top_k: int,
+    workers: int = 1,
+    log: Callable[[str], None] = print,
+    corpus_path: Path = CORPUS_PATH,
+    append: bool = False,
+    cache: TokenCache | None = None,
+    keep_raw: bool = False,
+    cancel_check: Callable[[], None] | None = None,
+):
+    if cache is None:
+        cache = load_token_cache(corpus_path, log, cancel_check)
+
+    model = _start_model(n, model_path, min_count, top_k, append, log, corpus_path, keep_raw)
+    log(f"[n={n}] Counting stories from {cache.path}")
+    counts = _count(cache, n, workers, log, cancel_check=cancel_check)
+
+    config = {"corpus": str(corpus_path), "appended": append, "workers": workers}
+    _finish_model(model, counts, model_path, config, log)
+
+
+def train_ngram_orders(
+    configs: list[tuple[int, Path, int, int]],
+    workers: int = 1,
+    log: Callable[[str], None] = print,
+    corpus_path: Path = CORPUS_PATH,
+    append: bool = False,
+    cache: TokenCache | None = None,
+    keep_raw: bool = False,
+    cancel_check: Callable[[], None] | None = None,
+):
+    # One counting pass at the highest order; every lower order is summed out
+    # of it (derive_order_counts), then folded with its own min_count/top_k.
+    # The models are the same as training each order on its own.
+    if cache is None:
+        cache = load_token_cache(corpus_path, log, cancel_check)
+
+    by_order = {n: (path, min_count, top_k) for n, path, min_count, top_k in configs}
+    top = max(by_order)
+    log(f"[n={top}] Counting stories from {cache.path} for orders {', '.join(map(str, sorted(by_order)))}")
+    padded_counts, unigram_counts, total_tokens = _count(cache, top, workers, log, True, cancel_check)
+
+    orders = derive_order_counts(padded_counts, top)
+    # the generator holds the only reference, so each order is freed once
+    # the next lower one has been derived from it
+    del padded_counts
+    for n, raw_counts in orders:
+        if cancel_check is not None:
+            cancel_check()
+        if n not in by_order:
+            continue
+        path, min_count, top_k = by_order[n]
+        model = _start_model(n, path, min_count, top_k, append, log, corpus_path, keep_raw)
+        config = {"corpus": str(corpus_path), "appended": append, "workers": workers, "derived_from": top}
+        _finish_model(model, (raw_counts, unigram_counts, total_tokens), path, config, log)
+        del model, raw_counts
+
+
+def train_external(
+    configs: list[tuple[int, Path, int, int]],
+    max_memory: int,
+    log: Callable[[str], None] = print,
+    corpus_path: Path = CORPUS_PATH,
+    spill_dir: Path | None = None,
+    cache: TokenCache | None = None,
+    keep_raw: bool = False,
+    cancel_check: Callable[[], None] | None = None,
+):
+    # Out-of-core training: every order is counted with at most max_memory
+    # of n-grams in memory, spilling sorted runs to spill_dir and merging
+    # them straight into the model's compact stores.
+    if cache is None:
+        cache = load_token_cache(corpus_path, log, cancel_check)
 
     for n, path, min_count, top_k in configs:
-        train_one_ngram(n=n, model_path=path, min_count=min_count, top_k=top_k)
+        log(f"[n={n}] Counting stories from {cache.path} within {format_bytes(max_memory)}")
+        model, runs = fit_external(cache, n, min_count, top_k, max_memory, keep_raw, spill_dir, log, cancel_check)
+        config = {"corpus": str(corpus_path), "appended": False, "max_memory": max_memory, "runs": runs}
+        save_model(model, staged_path(path), config)
+        log(f"[n={n}] Finished model for {path}")
+        del model
+
+
+def main(
+    workers: int | None = None,
+    log: Callable[[str], None] = print,
+    corpus_path: Path = CORPUS_PATH,
+    append: bool = False,
+    per_order: bool = False,
+    max_memory: int | None = None,
+    spill_dir: Path | None = None,
+    keep_raw: bool = False,
+    cancel_check: Callable[[], None] | None = None,
+):
+    # cancel_check is called while counting and raises to abort training; the
+    # models in MODELS_DIR are only replaced once every order has been trained.
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    configs = [(n, MODELS_DIR / f"ngram_{n}.bin", min_count, top_k) for n, min_count, top_k in CONFIGS]
+
+    if append:
+        check_appendable([path for _, path, _, _ in configs])
+
+    if max_memory is not None and append:
+        raise ValueError("--append merges into in-memory counts; it cannot be combined with --max-memory")
+
+    staging = MODELS_DIR / STAGING_DIR
+    try:
+        if max_memory is not None:
+            train_external(configs, max_memory, log, corpus_path, spill_dir, keep_raw=keep_raw, cancel_check=cancel_check)
+        elif per_order:
+            # Tokenized once here (or reused from disk) for all four orders.
+            cache = load_token_cache(corpus_path, log, cancel_check)
+            for n, path, min_count, top_k in configs:
+                train_one_ngram(
+                    n, path, min_count, top_k, workers, log, corpus_path, append, cache, keep_raw, cancel_check
+                )
+        else:
+            train_ngram_orders(configs, workers, log, corpus_path, append, keep_raw=keep_raw, cancel_check=cancel_check)
+        publish_models([path for _, path, _, _ in configs])
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Train the n=2..5 n-gram models.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of counting processes (default: CPU count, 1 = serial)",
+    )
+    parser.add_argument(
+        "--append",
+        type=Path,
+        metavar="STORIES",
+        default=None,
+        help="add the stories in this file to the existing models instead of retraining (needs --keep-raw models)",
+    )
+    parser.add_argument(
+        "--keep-raw",
+        action="store_true",
+        help="also store the unfolded counts so the models can be appended to later (larger files)",
+    )
+    parser.add_argument(
+        "--per-order",
+        action="store_true",
+        help="count every order separately instead of deriving n=2..4 from the n=5 counts",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=parse_bytes,
+        metavar="SIZE",
+        default=None,
+        help="count out of core, keeping at most SIZE (e.g. 2G) of n-grams in memory; counting is serial",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        type=Path,
+        default=None,
+        help="where --max-memory writes its temporary sorted runs (default: system temp dir)",
+    )
+    args = parser.parse_args()
+    if args.append is not None and args.max_memory is not None:
+        parser.error("--append cannot be combined with --max-memory")
+    if args.append is not None:
+        try:
+            check_appendable([MODELS_DIR / f"ngram_{n}.bin" for n, _, _ in CONFIGS])
+        except ValueError as e:
+            parser.error(str(e))
+        main(workers=args.workers, corpus_path=args.append, append=True, per_order=args.per_order)
+    else:
+        main(
+            workers=args.workers,
+            per_order=args.per_order,
+            max_memory=args.max_memory,
+            spill_dir=args.spill_dir,
+            keep_raw=args.keep_raw,
+        )
+    print(f"[OK] Saved models to {MODELS_DIR}")
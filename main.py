@@ -1,24 +1,33 @@
+import time
+
+# Cold-start clock: taken before the heavy imports below.
+STARTED = time.perf_counter()
+
+import argparse
+import threading
 from pathlib import Path
-import traceback
 
 import customtkinter as ctk
 from tkinter import filedialog
 
+# Only what the window needs at startup is imported here. Training, the
+# Ollama client (requests) and the service client are imported on first use;
+# the LLM warm-up thread pulls in the Ollama client in the background.
 from components.clean import build_corpus, OUT_PATH as CORPUS_PATH
-from components.ngram_model import SmartNGramModel, load_model
-from components.train_ngrams import main as train_all_ngrams
-from components.story_ollama import call_ollama, build_prompt
+from components.compare import MODEL_FILES, ComparisonEngine
+from components.jobs import Job, JobCancelled, JobQueue
+from components.metrics import METRICS_PATH, get_metrics
+from components.ngram_model import SmartNGramModel
 
-MODEL_FILES = {
-    "2": Path("models/ngram_2.pkl"),
-    "3": Path("models/ngram_3.pkl"),
-    "4": Path("models/ngram_4.pkl"),
-    "5": Path("models/ngram_5.pkl"),
-}
+JOB_POLL_MS = 50
+STATS_REFRESH_MS = 1000
+DEFAULT_ORDER = "4"
+LLM_KEEP_ALIVE = "30m"
+MODEL_MARKS = {"idle": "·", "loading": "…", "ready": "✓", "missing": "✗", "failed": "!"}
 
 
 class StoryApp(ctk.CTk):
-    def __init__(self):
+    def __init__(self, warm_llm: bool = False):
         super().__init__()
 
         self.title("Story Generator – n-gram + LLM")
@@ -27,13 +36,156 @@ class StoryApp(ctk.CTk):
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("blue")
 
-        self.ngram_models: dict[str, SmartNGramModel] = {}
+        # Models are loaded in the background once the window is up (_warm_up).
+        self.engine = ComparisonEngine(MODEL_FILES)
+
+        self.jobs = JobQueue(num_workers=2)
+        self.metrics = get_metrics()
+        self.service_client = None
+        # Multi-turn story for "Session mode"; None until its first turn.
+        self.session = None
+
+        # "unknown", "checking", "offline", "reachable", "warming" or "warm"
+        self.llm_state = "unknown"
+        self._ready_text = ""
+        self._startup: dict[str, float] = {}
+        self._startup_lock = threading.Lock()
 
         self._build_ui()
+        self.use_keep_alive.set(warm_llm)
+        self.after(JOB_POLL_MS, self._poll_jobs)
+        self.after(STATS_REFRESH_MS, self._refresh_stats)
+        self.after_idle(self._warm_up)
+
+    def _since_start(self, event: str) -> float:
+        # Seconds from process start to the first occurrence of `event`.
+        with self._startup_lock:
+            if event not in self._startup:
+                self._startup[event] = time.perf_counter() - STARTED
+                self.metrics.observe(f"startup_{event}", self._startup[event])
+            return self._startup[event]
+
+    def _warm_up(self):
+        # Runs once the window is shown: the selected order loads first with
+        # the pool to itself, the other orders right after it.
+        self._since_start("window")
+        selected = self.option_ng.get()
+
+        def loaded(_):
+            self._since_start(f"model_{selected}")
+            self.engine.preload()
+
+        self.engine.preload([selected])[selected].add_done_callback(loaded)
+        threading.Thread(target=self._check_llm, args=(self.use_keep_alive.get(),), daemon=True).start()
+
+    def _check_llm(self, warm: bool):
+        # Background thread: pings Ollama and, if asked, loads the model with
+        # keep_alive so the first prompt skips the load.
+        from components.story_ollama import OllamaError, get_default_client
+
+        client = get_default_client()
+        self.llm_state = "checking"
+        try:
+            client.ping()
+        except OllamaError:
+            self.llm_state = "offline"
+            return
+        if not warm:
+            self.llm_state = "reachable"
+            return
+
+        client.keep_alive = LLM_KEEP_ALIVE
+        self.llm_state = "warming"
+        try:
+            load_seconds = client.warm_up()
+        except OllamaError:
+            self.llm_state = "reachable"
+            return
+        self.llm_state = "warm"
+        self._since_start("llm_warm")
+        self.metrics.observe("llm_load", load_seconds)
+
+    def on_toggle_keep_alive(self):
+        if self.use_keep_alive.get():
+            threading.Thread(target=self._check_llm, args=(True,), daemon=True).start()
+        elif self.llm_state == "warm":
+            from components.story_ollama import get_default_client
+
+            get_default_client().keep_alive = None
+            self.llm_state = "reachable"
+
+    def _first_draft(self) -> str | None:
+        # Cold-start report for the first draft of the session; None after that.
+        with self._startup_lock:
+            if "first_draft" in self._startup:
+                return None
+            total = self._startup["first_draft"] = time.perf_counter() - STARTED
+            startup = dict(self._startup)
+        self.metrics.observe("startup_first_draft", total)
+
+        parts = [f"window {startup['window']:.2f}s"] if "window" in startup else []
+        parts += [
+            f"n={event.removeprefix('model_')} ready {seconds:.2f}s"
+            for event, seconds in startup.items()
+            if event.startswith("model_")
+        ]
+        return f"[INFO] Cold start to first draft: {total:.2f}s ({', '.join(parts)})"
+
+    def _refresh_readiness(self):
+        status = self.engine.status()
+        models = " ".join(f"n={n_str} {MODEL_MARKS[state]}" for n_str, state in status.items())
+        text = f"Models: {models} | LLM: {self.llm_state}"
+        if text != self._ready_text:
+            self._ready_text = text
+            self.ready_label.configure(text=text)
+
+    def _poll_jobs(self):
+        self.jobs.poll()
+
+        active = self.jobs.active()
+        if active:
+            running = [job for job in active if job.status == "running"]
+            queued = len(active) - len(running)
+            names = ", ".join(job.group for job in running) or "-"
+            self.status_label.configure(text=f"Running: {names} | queued: {queued}")
+        else:
+            self.status_label.configure(text="Idle")
+
+        self._refresh_readiness()
+        self.after(JOB_POLL_MS, self._poll_jobs)
+
+    def _submit(self, widget: ctk.CTkTextbox, group: str, key, fn, *args, on_done=None, on_progress=None):
+        def on_error(e: Exception):
+            if isinstance(e, JobCancelled):
+                self.log(widget, f"[INFO] {group} cancelled.")
+            else:
+                self.log(widget, f"[ERROR] {group} failed: {e}")
+                if job.error:
+                    self.log(widget, job.error)
+
+        job, created = self.jobs.submit(
+            group,
+            key,
+            fn,
+            *args,
+            on_done=on_done,
+            on_progress=on_progress or (lambda msg: self.log(widget, msg)),
+            on_error=on_error,
+        )
+        if not created:
+            self.log(widget, f"[INFO] Same {group} request is already {job.status}, skipping duplicate.")
+        return job
+
+    def on_cancel(self, *groups: str):
+        for group in groups:
+            self.jobs.cancel(group)
 
     def log(self, widget: ctk.CTkTextbox, text: str):
+        self.append(widget, text + "\n")
+
+    def append(self, widget: ctk.CTkTextbox, text: str):
         widget.configure(state="normal")
-        widget.insert("end", text + "\n")
+        widget.insert("end", text)
         widget.see("end")
         widget.configure(state="disabled")
 
@@ -44,10 +196,22 @@ class StoryApp(ctk.CTk):
         tab_corpus = tabview.add("1. Base")
         tab_ngrams = tabview.add("2. N-gram models")
         tab_llm = tabview.add("3. N-gram + LLM")
+        tab_stats = tabview.add("4. Stats")
 
         self._build_tab_corpus(tab_corpus)
         self._build_tab_ngrams(tab_ngrams)
         self._build_tab_llm(tab_llm)
+        self._build_tab_stats(tab_stats)
+
+        frame_status = ctk.CTkFrame(self, fg_color="transparent")
+        frame_status.pack(fill="x", padx=15, pady=(0, 5))
+
+        self.status_label = ctk.CTkLabel(frame_status, text="Idle", anchor="w")
+        self.status_label.pack(side="left")
+
+        # Per-order load state (· idle, … loading, ✓ ready, ✗ missing, ! failed)
+        self.ready_label = ctk.CTkLabel(frame_status, text="", anchor="e")
+        self.ready_label.pack(side="right")
 
     def _build_tab_corpus(self, parent: ctk.CTkFrame):
         parent.grid_columnconfigure(0, weight=1)
@@ -67,6 +231,14 @@ class StoryApp(ctk.CTk):
         )
         btn_load.grid(row=1, column=0, padx=10, pady=5, sticky="w")
 
+        btn_cancel = ctk.CTkButton(
+            parent,
+            text="Cancel",
+            width=100,
+            command=lambda: self.on_cancel("cleaning"),
+        )
+        btn_cancel.grid(row=1, column=0, padx=(220, 10), pady=5, sticky="w")
+
         self.corpus_log = ctk.CTkTextbox(parent, wrap="word")
         self.corpus_log.grid(row=2, column=0, padx=10, pady=10, sticky="nsew")
         self.corpus_log.configure(state="disabled")
@@ -79,19 +251,19 @@ class StoryApp(ctk.CTk):
         if not path:
             return
 
-        try:
-            raw_path = Path(path)
-            self.log(self.corpus_log, f"[INFO] Selected file: {raw_path}")
+        raw_path = Path(path)
+        self.log(self.corpus_log, f"[INFO] Selected file: {raw_path}")
+
+        def run(job: Job, raw_path: Path):
+            build_corpus(raw_path=raw_path, out_path=CORPUS_PATH, log=job.progress, cancel_check=job.check_cancelled)
 
-            build_corpus(raw_path=raw_path, out_path=CORPUS_PATH)
+        def done(_):
             self.log(
                 self.corpus_log,
                 f"[OK] Corpus cleaned and saved to: {CORPUS_PATH.resolve()}",
             )
-        except Exception as e:
-            self.log(self.corpus_log, "[ERROR] Error while cleaning corpus:")
-            self.log(self.corpus_log, str(e))
-            self.log(self.corpus_log, traceback.format_exc())
+
+        self._submit(self.corpus_log, "cleaning", ("cleaning", raw_path), run, raw_path, on_done=done)
 
     def _build_tab_ngrams(self, parent: ctk.CTkFrame):
         parent.grid_columnconfigure(0, weight=1)
@@ -128,61 +300,76 @@ class StoryApp(ctk.CTk):
         )
         btn_compare.grid(row=0, column=1, padx=5, pady=5, sticky="w")
 
+        btn_cancel = ctk.CTkButton(
+            frame_top,
+            text="Cancel",
+            width=100,
+            command=lambda: self.on_cancel("training", "comparison"),
+        )
+        btn_cancel.grid(row=0, column=2, padx=5, pady=5, sticky="w")
+
+        lbl_samples = ctk.CTkLabel(frame_top, text="Drafts per model:")
+        lbl_samples.grid(row=2, column=0, padx=5, pady=5, sticky="w")
+
+        self.option_samples = ctk.CTkOptionMenu(frame_top, values=["1", "2", "3", "5"], width=80)
+        self.option_samples.set("1")
+        self.option_samples.grid(row=2, column=1, padx=5, pady=5, sticky="w")
+
         self.ngram_log = ctk.CTkTextbox(parent, wrap="word")
         self.ngram_log.grid(row=3, column=0, padx=10, pady=10, sticky="nsew")
         self.ngram_log.configure(state="disabled")
 
     def on_train_ngrams(self):
-        try:
-            self.log(self.ngram_log, "[INFO] Training n-gram models (2,3,4,5)...")
-            train_all_ngrams()
-            self.log(self.ngram_log, "[OK] Training finished. Models saved to /models.")
-            self.ngram_models.clear()
-        except Exception as e:
-            self.log(self.ngram_log, "[ERROR] Error while training n-grams:")
-            self.log(self.ngram_log, str(e))
-            self.log(self.ngram_log, traceback.format_exc())
+        self.log(self.ngram_log, "[INFO] Training n-gram models (2,3,4,5)...")
 
-    def _load_ngram_model_cached(self, n_str: str) -> SmartNGramModel | None:
-        if n_str in self.ngram_models:
-            return self.ngram_models[n_str]
+        def run(job: Job):
+            from components.train_ngrams import main as train_all_ngrams
 
-        path = MODEL_FILES.get(n_str)
-        if path is None or not path.exists():
-            self.log(
-                self.ngram_log,
-                f"[WARN] Model for n={n_str} not found ({path}). Train n-grams first.",
-            )
-            return None
+            train_all_ngrams(log=job.progress, cancel_check=job.check_cancelled)
+
+        def done(_):
+            self.log(self.ngram_log, "[OK] Training finished. Models saved to /models.")
+            self.engine.reset()
+            self.engine.preload()
+
+        self._submit(self.ngram_log, "training", "training", run, on_done=done)
 
+    def _load_ngram_model_cached(self, n_str: str, log) -> SmartNGramModel | None:
+        # Runs on job worker threads; `log` forwards messages to the UI thread.
+        # Usually returns at once since the engine preloads every order.
         try:
-            model = load_model(path)
-            self.ngram_models[n_str] = model
-            self.log(self.ngram_log, f"[INFO] Loaded model n={n_str} from {path}")
-            return model
+            return self.engine.model(n_str)
+        except FileNotFoundError as e:
+            log(f"[WARN] {e}")
         except Exception as e:
-            self.log(self.ngram_log, f"[ERROR] Failed to load model n={n_str}: {e}")
-            return None
+            log(f"[ERROR] Failed to load model n={n_str}: {e}")
+        return None
 
     def on_compare_ngrams(self):
         text = self.entry_ngram_input.get().strip()
         if not text:
             self.log(self.ngram_log, "[WARN] Enter text to compare n-grams.")
             return
-
-        self.log(self.ngram_log, "\n=== N-gram comparison ===")
-        self.log(self.ngram_log, f"[INPUT] {text}")
-
-        for n_str in ["2", "3", "4", "5"]:
-            model = self._load_ngram_model_cached(n_str)
-            if model is None:
-                continue
-            try:
-                draft = model.generate_multi(text, num_sentences=3, max_tokens=80)
-                self.log(self.ngram_log, f"\n[n={n_str} draft]:")
-                self.log(self.ngram_log, draft)
-            except Exception as e:
-                self.log(self.ngram_log, f"[ERROR] Generation error for n={n_str}: {e}")
+        samples = int(self.option_samples.get())
+
+        def run(job: Job, text: str, samples: int):
+            job.progress("\n=== N-gram comparison ===")
+            job.progress(f"[INPUT] {text}")
+
+            # Orders arrive as they finish, fastest first.
+            for result in self.engine.compare(text, samples=samples):
+                n_str = result["n"]
+                if result["error"]:
+                    job.progress(f"[ERROR] Generation error for n={n_str}: {result['error']}")
+                    continue
+                if report := self._first_draft():
+                    job.progress(report)
+                job.progress(f"\n[n={n_str} draft] ({result['seconds'] * 1000:.0f} ms):")
+                for draft in result["drafts"]:
+                    job.progress(draft)
+                job.progress(result["backoff"])
+
+        self._submit(self.ngram_log, "comparison", ("comparison", text, samples), run, text, samples)
 
     def _build_tab_llm(self, parent: ctk.CTkFrame):
         parent.grid_columnconfigure(0, weight=1)
@@ -195,11 +382,13 @@ class StoryApp(ctk.CTk):
         lbl_ng = ctk.CTkLabel(frame_top, text="Select n-gram model for draft:")
         lbl_ng.grid(row=0, column=0, padx=5, pady=5, sticky="w")
 
+        # Picking an order starts loading it if the warm-up has not yet.
         self.option_ng = ctk.CTkOptionMenu(
             frame_top,
             values=["2", "3", "4", "5"],
+            command=lambda n_str: self.engine.preload([n_str]),
         )
-        self.option_ng.set("4")
+        self.option_ng.set(DEFAULT_ORDER)
         self.option_ng.grid(row=0, column=1, padx=5, pady=5, sticky="w")
 
         lbl_input = ctk.CTkLabel(frame_top, text="Story beginning:")
@@ -224,6 +413,38 @@ class StoryApp(ctk.CTk):
         )
         self.entry_genre.grid(row=2, column=1, padx=5, pady=5, sticky="w")
 
+        self.use_cache = ctk.BooleanVar(value=True)
+        chk_cache = ctk.CTkCheckBox(frame_top, text="Use LLM response cache", variable=self.use_cache)
+        chk_cache.grid(row=3, column=1, padx=5, pady=5, sticky="w")
+
+        # Drafts and LLM calls go through `python -m components.service`
+        # instead of models loaded in this process.
+        self.use_service = ctk.BooleanVar(value=False)
+        chk_service = ctk.CTkCheckBox(
+            frame_top,
+            text="Use generation service",
+            variable=self.use_service,
+        )
+        chk_service.grid(row=3, column=1, padx=(220, 5), pady=5, sticky="w")
+
+        self.use_keep_alive = ctk.BooleanVar(value=False)
+        chk_keep_alive = ctk.CTkCheckBox(
+            frame_top,
+            text=f"Keep LLM loaded ({LLM_KEEP_ALIVE})",
+            variable=self.use_keep_alive,
+            command=self.on_toggle_keep_alive,
+        )
+        chk_keep_alive.grid(row=3, column=1, padx=(420, 5), pady=5, sticky="w")
+
+        # Each Generate continues the same story, reusing the LLM context;
+        # an empty entry lets the story go on by itself.
+        self.use_session = ctk.BooleanVar(value=False)
+        chk_session = ctk.CTkCheckBox(frame_top, text="Session mode", variable=self.use_session)
+        chk_session.grid(row=2, column=1, padx=(220, 5), pady=5, sticky="w")
+
+        btn_new_session = ctk.CTkButton(frame_top, text="New session", command=self.on_new_session)
+        btn_new_session.grid(row=2, column=2, padx=5, pady=5, sticky="e")
+
         btn_generate = ctk.CTkButton(
             frame_top,
             text="Generate (n-gram + LLM)",
@@ -231,47 +452,257 @@ class StoryApp(ctk.CTk):
         )
         btn_generate.grid(row=0, column=2, padx=5, pady=5, sticky="e")
 
+        btn_cancel = ctk.CTkButton(
+            frame_top,
+            text="Cancel",
+            command=lambda: self.on_cancel("generation", "session"),
+        )
+        btn_cancel.grid(row=1, column=2, padx=5, pady=(10, 5), sticky="e")
+
         self.llm_output = ctk.CTkTextbox(parent, wrap="word")
         self.llm_output.grid(row=4, column=0, padx=10, pady=10, sticky="nsew")
         self.llm_output.configure(state="disabled")
 
+    def on_new_session(self):
+        self.session = None
+        self.log(self.llm_output, "[INFO] New session: the next Generate starts a new story.")
+
     def on_generate_llm_pipeline(self):
         text = self.entry_llm_input.get().strip()
-        if not text:
+        continuing = self.use_session.get() and self.session is not None and self.session.turns
+        if not text and not continuing:
             self.log(self.llm_output, "[WARN] Enter a story beginning.")
             return
 
         genre = self.entry_genre.get().strip() or None
         n_str = self.option_ng.get()
-
-        model = self._load_ngram_model_cached(n_str)
-        if model is None:
-            self.log(self.llm_output, f"[WARN] No model for n={n_str}. Train n-grams first.")
+        if self.use_session.get():
+            if self.use_service.get():
+                self.log(self.llm_output, "[INFO] Session mode runs in this process, not through the service.")
+            self._generate_session(text, genre, n_str)
             return
-
-        try:
-            draft = model.generate_multi(text, num_sentences=3, max_tokens=80)
-        except Exception as e:
-            self.log(self.llm_output, f"[ERROR] Draft generation error: {e}")
+        if self.use_service.get():
+            self._generate_via_service(text, genre, n_str)
             return
 
-        prompt = build_prompt(user_input=text, draft=draft, genre=genre)
+        from components.story_ollama import (
+            OllamaError,
+            OllamaStream,
+            build_prompt_timed,
+            draft_story,
+            get_default_client,
+        )
 
-        self.log(self.llm_output, "\n=== N-gram + LLM ===")
-        self.log(self.llm_output, f"[n={n_str} draft]:")
-        self.log(self.llm_output, draft)
-        self.log(self.llm_output, "\n[LLM continuation]:")
+        client = get_default_client()
+        client.cache.enabled = self.use_cache.get()
 
-        try:
-            llm_output = call_ollama(prompt)
-        except Exception as e:
-            self.log(self.llm_output, f"[ERROR] Ollama call error: {e}")
-            self.log(self.llm_output, traceback.format_exc())
+        def run(job: Job, text: str, genre: str | None, n_str: str):
+            def log(msg: str):
+                job.progress(("log", msg))
+
+            model = self._load_ngram_model_cached(n_str, log)
+            if model is None:
+                log(f"[WARN] No model for n={n_str}. Train n-grams first.")
+                return
+
+            try:
+                draft = draft_story(model, text, metrics=self.metrics)
+            except Exception as e:
+                log(f"[ERROR] Draft generation error: {e}")
+                return
+            if report := self._first_draft():
+                log(report)
+
+            prompt = build_prompt_timed(user_input=text, draft=draft, genre=genre, metrics=self.metrics)
+
+            log("\n=== N-gram + LLM ===")
+            log(f"[n={n_str} draft]:")
+            log(draft)
+            log("\n[LLM continuation]:")
+
+            stream = OllamaStream(prompt)
+            try:
+                for piece in stream:
+                    job.progress(("append", piece))
+            except OllamaError as e:
+                log(f"[ERROR] {e}")
+
+            log("")
+            log(f"{stream.timing_summary()} {client.cache.summary()}")
+
+        def progress(event: tuple[str, str]):
+            kind, msg = event
+            if kind == "append":
+                self.append(self.llm_output, msg)
+            else:
+                self.log(self.llm_output, msg)
+
+        self._submit(
+            self.llm_output,
+            "generation",
+            ("generation", text, genre, n_str),
+            run,
+            text,
+            genre,
+            n_str,
+            on_progress=progress,
+        )
+
+    def _generate_session(self, text: str, genre: str | None, n_str: str):
+        from components.story_ollama import OllamaError, StorySession, format_turn, get_default_client
+
+        # Turns build on each other's state, so only one runs at a time.
+        if self.jobs.active("session"):
+            self.log(self.llm_output, "[INFO] The previous session turn is still running, wait for it or cancel it.")
             return
 
-        self.log(self.llm_output, llm_output)
+        client = get_default_client()
+        client.cache.enabled = self.use_cache.get()
+        if self.session is None:
+            self.session = StorySession(genre=genre, client=client, metrics=self.metrics)
+        session = self.session
+
+        def run(job: Job, text: str, n_str: str):
+            def log(msg: str):
+                job.progress(("log", msg))
+
+            model = self._load_ngram_model_cached(n_str, log)
+            if model is None:
+                log(f"[WARN] No model for n={n_str}. Train n-grams first.")
+                return False
+
+            try:
+                draft, stream = session.prepare(text, model)
+            except OllamaError as e:
+                log(f"[ERROR] Summary failed: {e}")
+                return False
+            except Exception as e:
+                log(f"[ERROR] Draft generation error: {e}")
+                return False
+            if report := self._first_draft():
+                log(report)
+
+            log(f"\n=== Session turn {len(session.turns) + 1} ===")
+            log(f"[n={n_str} draft]:")
+            log(draft)
+            log("\n[LLM continuation]:")
+
+            try:
+                for piece in stream:
+                    job.progress(("append", piece))
+            except OllamaError as e:
+                log(f"[ERROR] {e}")
+                return False
+
+            log("")
+            log(f"{format_turn(session.complete(stream))} {stream.timing_summary()}")
+            return True
+
+        def progress(event: tuple[str, str]):
+            kind, msg = event
+            if kind == "append":
+                self.append(self.llm_output, msg)
+            else:
+                self.log(self.llm_output, msg)
+
+        def done(completed: bool):
+            # The text is part of the story now; pressing Generate again
+            # continues instead of adding it a second time.
+            if completed and self.entry_llm_input.get().strip() == text:
+                self.entry_llm_input.delete(0, "end")
+
+        self._submit(
+            self.llm_output,
+            "session",
+            ("session", id(session), len(session.turns), text, n_str),
+            run,
+            text,
+            n_str,
+            on_done=done,
+            on_progress=progress,
+        )
+
+    def _generate_via_service(self, text: str, genre: str | None, n_str: str):
+        from components.service_client import ServiceClient, ServiceError
+
+        if self.service_client is None:
+            self.service_client = ServiceClient()
+        service = self.service_client
+
+        def run(job: Job, text: str, genre: str | None, n_str: str):
+            job.progress("\n=== N-gram + LLM (service) ===")
+            try:
+                result = service.continue_story(text, n=int(n_str), genre=genre)
+            except ServiceError as e:
+                job.progress(f"[ERROR] {e}")
+                return
+            if report := self._first_draft():
+                job.progress(report)
+            job.progress(f"[n={n_str} draft]:")
+            job.progress(result["draft"])
+            job.progress("\n[LLM continuation]:")
+            job.progress(result["continuation"])
+            job.progress(f"\n[service time: {result['seconds']:.2f}s]")
+
+        self._submit(
+            self.llm_output,
+            "generation",
+            ("generation", "service", text, genre, n_str),
+            run,
+            text,
+            genre,
+            n_str,
+        )
+
+    def _build_tab_stats(self, parent: ctk.CTkFrame):
+        parent.grid_columnconfigure(0, weight=1)
+        parent.grid_rowconfigure(1, weight=1)
+
+        frame_top = ctk.CTkFrame(parent)
+        frame_top.grid(row=0, column=0, padx=10, pady=10, sticky="ew")
+
+        lbl = ctk.CTkLabel(frame_top, text=f"Latency per stage (last {self.metrics.window} requests)")
+        lbl.grid(row=0, column=0, padx=5, pady=5, sticky="w")
+
+        btn_export = ctk.CTkButton(frame_top, text="Export JSON / CSV", command=self.on_export_stats)
+        btn_export.grid(row=0, column=1, padx=5, pady=5, sticky="w")
+
+        btn_reset = ctk.CTkButton(frame_top, text="Reset", width=100, command=self.metrics.reset)
+        btn_reset.grid(row=0, column=2, padx=5, pady=5, sticky="w")
+
+        self.stats_output = ctk.CTkTextbox(parent, wrap="none", font=("Courier", 13))
+        self.stats_output.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
+        self.stats_output.configure(state="disabled")
+
+    def _refresh_stats(self):
+        text = self.metrics.summary()
+        if text != self.stats_output.get("1.0", "end-1c"):
+            self.stats_output.configure(state="normal")
+            self.stats_output.delete("1.0", "end")
+            self.stats_output.insert("end", text)
+            self.stats_output.configure(state="disabled")
+        self.after(STATS_REFRESH_MS, self._refresh_stats)
+
+    def on_export_stats(self):
+        path = filedialog.asksaveasfilename(
+            title="Export latency stats",
+            initialfile=METRICS_PATH.name,
+            defaultextension=".json",
+            filetypes=[("JSON", "*.json"), ("CSV", "*.csv")],
+        )
+        if not path:
+            return
+        self.metrics.export(Path(path))
 
 
 if __name__ == "__main__":
-    app = StoryApp()
+    parser = argparse.ArgumentParser(description="Story generator GUI.")
+    parser.add_argument(
+        "--warm-llm",
+        action="store_true",
+        help=f"load the Ollama model at startup and keep it loaded for {LLM_KEEP_ALIVE}",
+    )
+    args = parser.parse_args()
+
+    app = StoryApp(warm_llm=args.warm_llm)
     app.mainloop()
@@ -0,0 +1,80 @@
+import argparse
+import time
+from pathlib import Path
+
+from components.model_meta import read_metadata
+from components.ngram_model import load_model, save_model
+from components.perf import format_bytes
+from stats_ngrams import MODEL_FILES, compute_stats
+
+
+def pruned_path(path: Path) -> Path:
+    return path.with_name(f"{path.stem}.pruned{path.suffix}")
+
+
+def prune_file(
+    path: Path,
+    out_path: Path,
+    min_context_count: int,
+    min_kl_gain: float | None,
+    sampling_only: bool,
+) -> tuple[dict, dict]:
+    model = load_model(path)
+    before = compute_stats(model)
+
+    model.prune(
+        min_context_count=min_context_count,
+        min_kl_gain=min_kl_gain,
+        sampling_only=sampling_only,
+    )
+    after = compute_stats(model)
+
+    # keep the training config of the source model alongside the pruning one
+    config = (read_metadata(path) or {}).get("config", {})
+    save_model(model, out_path, {**config, "pruned_from": path.name})
+    return before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune trained n-gram models.")
+    parser.add_argument("--min-context-count", type=int, default=1, help="drop contexts seen fewer times")
+    parser.add_argument(
+        "--min-kl-gain",
+        type=float,
+        default=None,
+        help="drop contexts whose count * KL(context || unigram) is below this many bits",
+    )
+    parser.add_argument(
+        "--sampling-only",
+        action="store_true",
+        help="keep only the top-k successors used for sampling (same generation distribution)",
+    )
+    parser.add_argument("--in-place", action="store_true", help="overwrite models instead of writing *.pruned.bin")
+    args = parser.parse_args()
+
+    for n, path in MODEL_FILES.items():
+        if not path.exists():
+            print(f"[WARN] model file for n={n} not found at {path}, skipping.")
+            continue
+
+        out_path = path if args.in_place else pruned_path(path)
+        before, after = prune_file(
+            path,
+            out_path,
+            min_context_count=args.min_context_count,
+            min_kl_gain=args.min_kl_gain,
+            sampling_only=args.sampling_only,
+        )
+
+        start = time.perf_counter()
+        load_model(out_path)
+        load_time = time.perf_counter() - start
+
+        print(f"[n={n}] saved {out_path} (loads in {load_time * 1000:.1f} ms)")
+        print(f"  contexts:   {before['num_contexts']} -> {after['num_contexts']}")
+        print(f"  successors: {before['total_successors']} -> {after['total_successors']}")
+        print(f"  bytes:      {format_bytes(before['model_bytes'])} -> {format_bytes(after['model_bytes'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,71 @@
+import argparse
 from pathlib import Path
 
+from components.clean import OUT_PATH as CORPUS_PATH
+from components.model_format import read_header
+from components.model_meta import metadata_is_current, model_stats, read_metadata, write_metadata
 from components.ngram_model import SmartNGramModel, load_model
+from components.token_cache import cache_path
 
 
 MODEL_FILES = {
-    2: Path("models/ngram_2.pkl"),
-    3: Path("models/ngram_3.pkl"),
-    4: Path("models/ngram_4.pkl"),
-    5: Path("models/ngram_5.pkl"),
+    2: Path("models/ngram_2.bin"),
+    3: Path("models/ngram_3.bin"),
+    4: Path("models/ngram_4.bin"),
+    5: Path("models/ngram_5.bin"),
 }
 
 
 def compute_stats(model: SmartNGramModel) -> dict:
-    n = model.n
-    vocab_size = len(model.vocab)
-    total_tokens = model.total_tokens
-    num_contexts = len(model.context_counts)
-
-    if num_contexts > 0:
-        total_next_variants = sum(len(counter) for counter in model.context_counts.values())
-        avg_next_per_context = total_next_variants / num_contexts
-        max_next_per_context = max(len(counter) for counter in model.context_counts.values())
-    else:
-        avg_next_per_context = 0.0
-        max_next_per_context = 0
-
-    return {
-        "n": n,
-        "vocab_size": vocab_size,
-        "total_tokens": total_tokens,
-        "num_contexts": num_contexts,
-        "avg_next_per_context": avg_next_per_context,
-        "max_next_per_context": max_next_per_context,
-    }
-
-
-def main():
+    return model_stats(model)
+
+
+def recompute(path: Path) -> dict:
+    # Maps the model and walks its successor counts once, then rewrites the
+    # sidecar, keeping whatever training config it had.
+    model = load_model(path)
+    config = (read_metadata(path) or {}).get("config")
+    write_metadata(model, path, config)
+    return read_metadata(path)
+
+
+def main(recompute_all: bool = False, verify: bool = False):
     rows: list[dict] = []
+    configs: list[dict] = []
 
     for n, path in MODEL_FILES.items():
         if not path.exists():
             print(f"[WARN] model file for n={n} not found at {path}, skipping.")
             continue
 
-        print(f"[INFO] loading model n={n} from {path}...")
-        model = load_model(path)
-        stats = compute_stats(model)
-        rows.append(stats)
+        if recompute_all:
+            print(f"[INFO] recomputing stats for n={n} from {path}...")
+            meta = recompute(path)
+        else:
+            meta = read_metadata(path)
+            if meta is None:
+                print(f"[WARN] no metadata for n={n} next to {path}; run with --recompute.")
+                continue
+            if not metadata_is_current(meta, path, verify_checksum=verify):
+                print(f"[WARN] metadata for n={n} does not match {path}; run with --recompute.")
+                continue
+
+        rows.append(meta["stats"])
+        configs.append(meta["config"])
 
     if not rows:
-        print("No models loaded. Train n-gram models first.")
+        print("No model statistics available. Train n-gram models first.")
         return
 
+    # Corpus size comes from the token cache header; the ids are not read.
+    token_cache = cache_path(CORPUS_PATH)
+    if token_cache.exists():
+        corpus = read_header(token_cache)[0]["fields"]
+        print(
+            f"\nCorpus ({corpus['corpus']}): {corpus['num_stories']} stories, "
+            f"{corpus['num_tokens']} tokens, {corpus['vocab_size']} types"
+        )
+
     print("\nN-gram model statistics:\n")
 
     header = (
@@ -61,6 +75,7 @@ def main():
         "num_contexts",
         "avg_next_per_context",
         "max_next_per_context",
+        "bytes_per_context",
     )
     col_widths = [len(h) for h in header]
     for row in rows:
@@ -73,6 +88,10 @@ def main():
             len(f"{row['avg_next_per_context']:.2f}"),
         )
         col_widths[5] = max(col_widths[5], len(str(row["max_next_per_context"])))
+        col_widths[6] = max(
+            col_widths[6],
+            len(f"{row['bytes_per_context']:.1f}"),
+        )
 
     def fmt_row(values):
         return "  ".join(
@@ -90,9 +109,28 @@ def main():
             row["num_contexts"],
             f"{row['avg_next_per_context']:.2f}",
             row["max_next_per_context"],
+            f"{row['bytes_per_context']:.1f}",
         )
         print(fmt_row(values))
 
+    print("\nSuccessors per context:\n")
+    for row, config in zip(rows, configs):
+        quantiles = ", ".join(f"{k}={v}" for k, v in row.get("successor_quantiles", {}).items())
+        histogram = ", ".join(f"{k}: {v}" for k, v in row.get("successor_histogram", {}).items())
+        trained = f"min_count={config.get('min_count')}, top_k={config.get('top_k')}"
+        if config.get("pruning"):
+            trained += f", pruned {config['pruning']}"
+        print(f"n={row['n']} ({trained}) {quantiles}")
+        print(f"  {histogram}")
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Print n-gram model statistics from the metadata sidecars.")
+    parser.add_argument(
+        "--recompute",
+        action="store_true",
+        help="ignore the sidecars, recount from the models and rewrite them",
+    )
+    parser.add_argument("--verify", action="store_true", help="also check each sidecar's sha256 against its model")
+    args = parser.parse_args()
+    main(recompute_all=args.recompute, verify=args.verify)
@@ -0,0 +1,108 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from benchmarks.fake_ollama import FakeOllamaServer
+from components.ollama_client import (
+    AsyncOllamaClient,
+    OllamaClient,
+    OllamaConnectionError,
+    OllamaHTTPError,
+    OllamaTimeoutError,
+)
+
+
+@pytest.fixture
+def server():
+    with FakeOllamaServer() as server:
+        yield server
+
+
+def make_client(server: FakeOllamaServer, **kwargs) -> OllamaClient:
+    kwargs = {"cache": None, "backoff": 0.0, **kwargs}
+    return OllamaClient(base_url=server.base_url, **kwargs)
+
+
+def test_generate(server):
+    client = make_client(server)
+    assert client.generate("Once upon a time") == "The door creaked open."
+    assert server.requests == 1
+
+
+def test_retries_503_until_success(server):
+    server.fail_statuses = [503, 503]
+    client = make_client(server, retries=2)
+    assert client.generate("hello") == "The door creaked open."
+    assert server.requests == 3
+
+
+def test_gives_up_after_retries(server):
+    server.fail_statuses = [503, 503, 503]
+    client = make_client(server, retries=2)
+    with pytest.raises(OllamaHTTPError) as excinfo:
+        client.generate("hello")
+    assert excinfo.value.status_code == 503
+    assert server.requests == 3
+
+
+def test_400_is_not_retried(server):
+    server.fail_statuses = [400]
+    client = make_client(server, retries=2)
+    with pytest.raises(OllamaHTTPError) as excinfo:
+        client.generate("hello")
+    assert excinfo.value.status_code == 400
+    assert server.requests == 1
+
+
+def test_read_timeout_is_not_retried(server):
+    server.latency = 0.5
+    client = make_client(server, retries=2, timeout=0.1)
+    start = time.perf_counter()
+    with pytest.raises(OllamaTimeoutError):
+        client.generate("hello")
+    assert time.perf_counter() - start < 0.4
+    assert server.requests == 1
+
+
+def test_connection_error():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    client = OllamaClient(base_url=f"http://127.0.0.1:{port}", cache=None, retries=1, backoff=0.0)
+    with pytest.raises(OllamaConnectionError):
+        client.generate("hello")
+
+
+def test_generate_many_returns_errors_in_place(server):
+    server.fail_statuses = [400]
+    client = make_client(server, retries=0)
+    results = client.generate_many([f"prompt {i}" for i in range(5)], max_workers=1)
+    assert isinstance(results[0], OllamaHTTPError)
+    assert results[1:] == ["The door creaked open."] * 4
+
+
+def test_generate_many_caps_threads(server):
+    server.latency = 0.05
+    client = make_client(server)
+    results = client.generate_many([f"prompt {i}" for i in range(8)], max_workers=3)
+    assert results == ["The door creaked open."] * 8
+    assert server.max_in_flight == 3
+
+
+def test_async_client_semaphore_limits_requests(server):
+    server.latency = 0.05
+    client = AsyncOllamaClient(make_client(server), concurrency=2)
+    results = asyncio.run(client.generate_many([f"prompt {i}" for i in range(6)]))
+    assert results == ["The door creaked open."] * 6
+    assert server.max_in_flight == 2
+
+
+def test_async_client_can_be_reused_across_event_loops(server):
+    server.latency = 0.02
+    client = AsyncOllamaClient(make_client(server), concurrency=2)
+    for _ in range(2):
+        results = asyncio.run(client.generate_many([f"prompt {i}" for i in range(4)]))
+        assert results == ["The door creaked open."] * 4
+    assert server.max_in_flight == 2
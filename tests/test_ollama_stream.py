@@ -0,0 +1,90 @@
+import socket
+
+import pytest
+
+from benchmarks.fake_ollama import FakeOllamaServer
+from components.llm_cache import ResponseCache
+from components.ollama_client import OllamaClient, OllamaConnectionError, OllamaError, OllamaHTTPError, OllamaStream
+
+
+PIECES = [" The", " door", " creaked", " open", "."]
+
+
+@pytest.fixture
+def server():
+    with FakeOllamaServer(pieces=PIECES, token_delay=0.02) as server:
+        yield server
+
+
+def make_client(server: FakeOllamaServer, **kwargs) -> OllamaClient:
+    kwargs = {"cache": None, "backoff": 0.0, **kwargs}
+    return OllamaClient(base_url=server.base_url, **kwargs)
+
+
+def test_yields_pieces_as_they_arrive(server):
+    stream = OllamaStream("Once upon a time", client=make_client(server))
+    pieces = list(stream)
+
+    # leading whitespace of the first piece is dropped
+    assert pieces == ["The", " door", " creaked", " open", "."]
+    assert stream.response == "The door creaked open."
+    assert not stream.cached
+
+
+def test_final_chunk_and_timings(server):
+    stream = OllamaStream("Once upon a time", client=make_client(server))
+    list(stream)
+
+    assert stream.final["done"] is True
+    assert stream.final["eval_count"] == len(PIECES)
+    assert stream.final["prompt_eval_count"] == 4
+    assert stream.eval_seconds == pytest.approx(0.002)
+    # the first piece follows one token delay, the whole reply six
+    assert 0.02 <= stream.time_to_first_token < stream.total_time
+    assert stream.total_time >= 0.02 * (len(PIECES) + 1)
+    assert "time to first token" in stream.timing_summary()
+
+
+def test_cached_reply_skips_the_server(server, tmp_path):
+    client = make_client(server, cache=ResponseCache(tmp_path / "cache.sqlite"))
+    first = list(OllamaStream("Once upon a time", client=client))
+    stream = OllamaStream("Once upon a time", client=client)
+    assert list(stream) == ["The door creaked open."]
+    assert stream.cached
+    assert "".join(first) == stream.response
+    assert server.requests == 1
+
+
+def test_http_error_is_raised_before_any_piece(server):
+    server.fail_statuses = [400]
+    stream = OllamaStream("Once upon a time", client=make_client(server, retries=0))
+    pieces = []
+    with pytest.raises(OllamaHTTPError) as excinfo:
+        for piece in stream:
+            pieces.append(piece)
+    assert excinfo.value.status_code == 400
+    assert pieces == []
+    assert stream.final == {}
+    assert stream.total_time is not None
+
+
+def test_connection_error():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    client = OllamaClient(base_url=f"http://127.0.0.1:{port}", cache=None, retries=0)
+    with pytest.raises(OllamaConnectionError):
+        list(OllamaStream("Once upon a time", client=client))
+
+
+@pytest.mark.parametrize("mode, error", [("drop", OllamaConnectionError), ("garble", OllamaError)])
+def test_truncated_stream_raises_ollama_error(server, mode, error):
+    server.cut_stream_after = 2
+    server.cut_mode = mode
+    stream = OllamaStream("Once upon a time", client=make_client(server))
+    pieces = []
+    with pytest.raises(error):
+        for piece in stream:
+            pieces.append(piece)
+    assert pieces == ["The", " door"]
+    assert stream.final == {}
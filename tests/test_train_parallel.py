@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from components.ngram_model import SmartNGramModel, count_ngrams, iter_corpus, save_model
+from components.token_cache import build_token_cache, count_ngrams_cached, read_token_cache
+from components import train_ngrams
+from components.train_ngrams import count_ngrams_parallel
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    rng = random.Random(0)
+    words = [f"w{i}" for i in range(200)] + [".", ",", "!"]
+    path = tmp_path_factory.mktemp("corpus") / "stories.txt"
+    stories = [" ".join(rng.choice(words) for _ in range(rng.randint(1, 60))) for _ in range(300)]
+    path.write_text("\n".join(stories) + "\n", encoding="utf-8")
+    return path
+
+
+@pytest.fixture(scope="module")
+def cache(corpus):
+    return read_token_cache(build_token_cache(corpus, log=lambda msg: None))
+
+
+def assert_same_counts(actual, expected):
+    # Equal counts in the same insertion order: folding and the successor
+    # tie order depend on it.
+    raw, unigrams, total = actual
+    expected_raw, expected_unigrams, expected_total = expected
+    assert list(raw) == list(expected_raw)
+    for context, successors in expected_raw.items():
+        assert list(raw[context].items()) == list(successors.items())
+    assert list(unigrams.items()) == list(expected_unigrams.items())
+    assert total == expected_total
+
+
+@pytest.mark.parametrize("n", [2, 4])
+@pytest.mark.parametrize("pad", [False, True])
+def test_parallel_counts_match_serial(cache, n, pad):
+    serial = count_ngrams_cached(cache, n, pad=pad)
+    assert_same_counts(count_ngrams_parallel(cache, n, workers=1, pad=pad), serial)
+    assert_same_counts(count_ngrams_parallel(cache, n, workers=2, pad=pad), serial)
+
+
+def test_cached_counts_match_text_counts(corpus, cache):
+    assert_same_counts(count_ngrams_cached(cache, 3), count_ngrams(iter_corpus(corpus), 3))
+
+
+def test_parallel_model_file_is_bit_identical(cache, tmp_path):
+    paths = []
+    for workers in (1, 2):
+        model = SmartNGramModel(n=3, min_count=2, top_k=8)
+        model._fold_counts(*count_ngrams_parallel(cache, 3, workers))
+        path = tmp_path / f"ngram_3_{workers}.bin"
+        save_model(model, path)
+        paths.append(path)
+    assert paths[0].read_bytes() == paths[1].read_bytes()
+
+
+class Cancelled(Exception):
+    pass
+
+
+def cancel_after(calls: int):
+    remaining = calls
+
+    def check():
+        nonlocal remaining
+        remaining -= 1
+        if remaining < 0:
+            raise Cancelled()
+
+    return check
+
+
+# serial: partway through counting, and between the derived orders (the
+# check runs once per story); parallel: while merging the shards
+@pytest.mark.parametrize("workers, calls", [(1, 5), (1, 303), (2, 2)])
+def test_cancelled_training_keeps_old_models(corpus, cache, tmp_path, monkeypatch, workers, calls):
+    monkeypatch.setattr(train_ngrams, "MODELS_DIR", tmp_path)
+    quiet = lambda msg: None
+    train_ngrams.main(workers=1, log=quiet, corpus_path=corpus)
+    before = {path.name: path.read_bytes() for path in tmp_path.iterdir()}
+    assert len(before) == 2 * len(train_ngrams.CONFIGS)
+
+    with pytest.raises(Cancelled):
+        train_ngrams.main(workers=workers, log=quiet, corpus_path=corpus, keep_raw=True, cancel_check=cancel_after(calls))
+    assert {path.name: path.read_bytes() for path in tmp_path.iterdir()} == before